@@ -1,87 +1,200 @@
 import html
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import streamlit as st
 
+import ssr_avvik
+import ssr_kilder
+import ssr_likhet
+import ssr_panel
+import ssr_trengsel
+import ssr_ytelse
+from ssr_analyse import (
+    _agg_issuer_date,
+    _standardiser_shortpercent,
+    bruk_copy_on_write,
+    dataversjon,
+)
 from ssr_api import (
+    MIN_SEKUNDER_MELLOM_OPPDATERINGER,
+    VARSELTYPER,
+    hent_analyser,
     hent_database_data,
     hent_fullt_register,
+    hent_posisjonshendelser,
     hent_posisjonsholdere,
+    hent_register_per_dato,
     hent_siste_oppdatering,
-    lagre_i_database,
+    hent_varselregler,
+    hent_varsler,
+    legg_til_varselregel,
+    oppdater_historikk,
+    siste_hendelsesdato,
+    slett_varselregel,
     tving_ny_nedlasting,
 )
 
+bruk_copy_on_write()
+
 # -------------------- DATAHJELPERE --------------------
 
-def _standardiser_shortpercent(df: pd.DataFrame) -> pd.DataFrame:
-    if df.empty or "shortPercent" not in df.columns:
-        return df
-    out = df.copy()
-    out["shortPercent"] = pd.to_numeric(out["shortPercent"], errors="coerce")
-    maximum = out["shortPercent"].max(skipna=True)
-    if pd.notna(maximum) and maximum > 20:
-        out["shortPercent"] = out["shortPercent"] / 100
-    return out
+@ssr_ytelse.cache_data(ttl=600, max_entries=4, show_spinner=False)
+def dataframe_to_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
 
 
-def _agg_issuer_date(df: pd.DataFrame) -> pd.DataFrame:
-    if df.empty:
-        return df.copy()
-    out = _standardiser_shortpercent(df)
-    out["date"] = pd.to_datetime(out["date"], errors="coerce")
-    out = out.dropna(subset=["issuerName", "date", "shortPercent"])
-    return (
-        out.groupby(["issuerName", "date"], as_index=False)["shortPercent"]
-        .sum()
-        .sort_values(["issuerName", "date"])
+# -------------------- FIGURER --------------------
+
+_FIGURSTIL = dict(
+    template="plotly_white",
+    paper_bgcolor="#ffffff",
+    font=dict(color="#0f172a"),
+    margin=dict(l=20, r=20, t=70, b=20),
+)
+
+
+def _figur_sok_linje(plot_data: pd.DataFrame, periode) -> go.Figure:
+    fig = px.line(
+        plot_data,
+        x="date",
+        y="shortPercent",
+        color="issuerName",
+        markers=True,
+        title="Utvikling i shortposisjon",
+        labels={"date": "Dato", "shortPercent": "Shortandel (%)", "issuerName": "Selskap"},
+    )
+    fig.update_layout(
+        hovermode="x unified", height=600, legend_title_text="Utsteder", plot_bgcolor="#ffffff", **_FIGURSTIL
     )
+    return fig
 
 
-def hent_siste_posisjon_per_selskap(df: pd.DataFrame) -> pd.DataFrame:
-    """Returnerer siste registrerte, aggregerte shortandel for hvert selskap."""
-    data = _agg_issuer_date(df)
-    if data.empty:
-        return data
-
-    return (
-        data.sort_values(["issuerName", "date"])
-        .groupby("issuerName", as_index=False)
-        .tail(1)
-        .sort_values(["shortPercent", "issuerName"], ascending=[False, True])
-        .reset_index(drop=True)
+def _figur_topp10_stolpe(top10: pd.DataFrame, days: int) -> go.Figure:
+    fig = px.bar(
+        top10,
+        x="issuerName",
+        y="shortPercent",
+        text_auto=".2f",
+        title=f"Topp 10 – gjennomsnittlig shortandel siste {days} dager",
+        labels={"issuerName": "Selskap", "shortPercent": "Shortandel (%)"},
+    )
+    fig.update_layout(xaxis_tickangle=-35, height=500, plot_bgcolor="#ffffff", **_FIGURSTIL)
+    return fig
+
+
+def _figur_topp10_linje(development: pd.DataFrame, days: int) -> go.Figure:
+    fig = px.line(
+        development,
+        x="date",
+        y="shortPercent",
+        color="issuerName",
+        title="Utvikling over tid for Topp 10",
+        labels={"date": "Dato", "shortPercent": "Shortandel (%)", "issuerName": "Selskap"},
     )
+    fig.update_layout(hovermode="x unified", height=600, plot_bgcolor="#ffffff", **_FIGURSTIL)
+    return fig
 
 
-def beregn_storste_endringer(df: pd.DataFrame) -> pd.DataFrame:
-    data = _agg_issuer_date(df)
-    if data.empty:
-        return data
-    data["forrige_short"] = data.groupby("issuerName")["shortPercent"].shift(1)
-    latest = data.groupby("issuerName").tail(1).copy()
-    latest["endring"] = latest["shortPercent"] - latest["forrige_short"]
-    latest = latest.dropna(subset=["endring"])
-    return latest.reindex(latest["endring"].abs().sort_values(ascending=False).index)
+def _figur_topp10_heatmap(heat: pd.DataFrame, days: int) -> go.Figure:
+    fig = px.imshow(
+        heat,
+        aspect="auto",
+        title="Daglige endringer i shortandel",
+        labels={"x": "Dato", "y": "Selskap", "color": "Endring (%)"},
+    )
+    fig.update_layout(height=600, **_FIGURSTIL)
+    return fig
 
 
-def finn_nye_shortposisjoner(df: pd.DataFrame, terskel: float = 0.5) -> pd.DataFrame:
-    data = _agg_issuer_date(df)
-    if data.empty:
-        return data
-    data["forrige_short"] = data.groupby("issuerName")["shortPercent"].shift(1)
-    latest = data.groupby("issuerName").tail(1).copy()
-    result = latest[
-        (latest["shortPercent"] >= terskel)
-        & (latest["forrige_short"].isna() | (latest["forrige_short"] < terskel))
-    ].copy()
-    return result.sort_values(["date", "shortPercent"], ascending=[False, False])
+def _figur_marked_total(totalt: pd.DataFrame, periode) -> go.Figure:
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=totalt["date"], y=totalt["shortPercent"], name="Samlet shortandel (%)"))
+    fig.add_trace(
+        go.Scatter(x=totalt["date"], y=totalt["selskaper"], name="Selskaper med short", yaxis="y2", line=dict(dash="dot"))
+    )
+    fig.update_layout(
+        title="Hele markedet per handelsdag",
+        yaxis=dict(title="Samlet shortandel (%)"),
+        yaxis2=dict(title="Selskaper", overlaying="y", side="right", showgrid=False),
+        hovermode="x unified",
+        height=450,
+        plot_bgcolor="#ffffff",
+        **_FIGURSTIL,
+    )
+    return fig
 
 
-@st.cache_data(ttl=600, max_entries=4, show_spinner=False)
-def dataframe_to_csv(df: pd.DataFrame) -> bytes:
-    return df.to_csv(index=False).encode("utf-8")
+def _figur_lignende_linje(forlop: pd.DataFrame, maaneder: int) -> go.Figure:
+    fig = px.line(
+        forlop,
+        x="date",
+        y="shortPercent",
+        color="issuerName",
+        title=f"Shortandel siste {maaneder} måneder",
+        labels={"date": "Dato", "shortPercent": "Shortandel (%)", "issuerName": "Selskap"},
+    )
+    fig.update_layout(hovermode="x unified", height=500, plot_bgcolor="#ffffff", **_FIGURSTIL)
+    return fig
+
+
+_FIGURER = {
+    "sok_linje": _figur_sok_linje,
+    "topp10_stolpe": _figur_topp10_stolpe,
+    "topp10_linje": _figur_topp10_linje,
+    "topp10_heatmap": _figur_topp10_heatmap,
+    "marked_total": _figur_marked_total,
+    "lignende_linje": _figur_lignende_linje,
+}
+
+
+@ssr_ytelse.cache_resource(ttl=3600, max_entries=32, show_spinner=False)
+def lag_figur(versjon: str, graf: str, utvalg: tuple, periode, _data: pd.DataFrame) -> go.Figure:
+    """
+    Ferdig Plotly-figur per (dataversjon, graf, utvalg, periode). Figuren deles
+    mellom øktene og endres aldri etter at den er bygget, så en uendret rerun
+    hopper over plotly.express helt.
+    """
+    with ssr_ytelse.spenn(f"figur:{graf}"):
+        return _FIGURER[graf](_data, periode)
+
+
+def _sokefilter(df: pd.DataFrame, kolonner: list, search: str, key: str) -> pd.DataFrame:
+    """
+    Filtrerer rader der søketeksten finnes i en av kolonnene.
 
+    Treffene huskes per datasett og søk i session_state, slik at reruns der
+    søket ikke er endret hopper over strengsøket.
+    """
+    if not search:
+        return df
+    signatur = (dataversjon(df), len(df), search)
+    lagret = st.session_state.get(key)
+    if lagret is None or lagret[0] != signatur:
+        mask = np.zeros(len(df), dtype=bool)
+        for kolonne in kolonner:
+            mask |= (
+                df[kolonne].fillna("").astype(str)
+                .str.contains(search, case=False, na=False, regex=False)
+                .to_numpy()
+            )
+        lagret = (signatur, np.flatnonzero(mask))
+        st.session_state[key] = lagret
+    return df.iloc[lagret[1]]
 
+
+def _kilder_i(df: pd.DataFrame) -> list:
+    """Visningsnavnene til kildene i datasettet, i samme rekkefølge som kildeoppsettet."""
+    if "source" not in df.columns:
+        return [ssr_kilder.FINANSTILSYNET.tittel]
+    finnes = set(df["source"].dropna().unique())
+    return [kilde.tittel for kilde in ssr_kilder.KILDER if kilde.navn in finnes] or [
+        ssr_kilder.tittel(navn) for navn in sorted(finnes)
+    ]
+
+
+@st.fragment
 def vis_posisjonsholdere(df: pd.DataFrame, key_prefix: str = "holders") -> None:
     """Viser individuelle offentlige posisjonsholdere uten å påvirke aggregert historikk."""
     st.subheader("Hvem shorter aksjene?")
@@ -94,11 +207,12 @@ def vis_posisjonsholdere(df: pd.DataFrame, key_prefix: str = "holders") -> None:
         st.info("Ingen individuelle posisjonsholdere tilgjengelig akkurat nå.")
         return
 
-    data = df.copy()
-    data["date"] = pd.to_datetime(data["date"], errors="coerce")
-    data["shortPercent"] = pd.to_numeric(data["shortPercent"], errors="coerce")
-    data["shares"] = pd.to_numeric(data.get("shares"), errors="coerce")
-    data = data.dropna(subset=["issuerName", "positionHolder", "date", "shortPercent"])
+    with ssr_ytelse.spenn(f"tabell:{key_prefix}_klargjoring", rader=len(df)):
+        data = df.assign(
+            date=pd.to_datetime(df["date"], errors="coerce"),
+            shortPercent=pd.to_numeric(df["shortPercent"], errors="coerce"),
+            shares=pd.to_numeric(df.get("shares"), errors="coerce"),
+        ).dropna(subset=["issuerName", "positionHolder", "date", "shortPercent"])
 
     search = st.text_input(
         "Søk etter selskap, ISIN eller posisjonsholder",
@@ -106,20 +220,16 @@ def vis_posisjonsholdere(df: pd.DataFrame, key_prefix: str = "holders") -> None:
         key=f"{key_prefix}_search",
     ).strip()
 
-    if search:
-        mask = (
-            data["issuerName"].fillna("").astype(str).str.contains(search, case=False, na=False, regex=False)
-            | data["isin"].fillna("").astype(str).str.contains(search, case=False, na=False, regex=False)
-            | data["positionHolder"].fillna("").astype(str).str.contains(search, case=False, na=False, regex=False)
-        )
-        data = data.loc[mask]
+    data = _sokefilter(data, ["issuerName", "isin", "positionHolder"], search, f"{key_prefix}_search_hits")
 
     newest_only = st.toggle(
-        "Kun siste registrerte posisjon per selskap og posisjonsholder",
+        "Kun gjeldende posisjoner (siste event per selskap)",
         value=True,
         key=f"{key_prefix}_latest",
     )
     if newest_only and not data.empty:
+        if "latestEvent" in data.columns:
+            data = data.loc[data["latestEvent"].fillna(False).astype(bool)]
         data = (
             data.sort_values("date")
             .groupby(["issuerName", "positionHolder"], as_index=False)
@@ -135,9 +245,13 @@ def vis_posisjonsholdere(df: pd.DataFrame, key_prefix: str = "holders") -> None:
             "shares": "Aksjer",
             "isin": "ISIN",
         }
-    ).copy()
+    )
     view["Dato"] = view["date"].dt.strftime("%d.%m.%Y")
-    view = view[["Selskap", "Posisjonsholder", "Dato", "Short %", "Aksjer", "ISIN"]]
+    kolonner = ["Selskap", "Posisjonsholder", "Dato", "Short %", "Aksjer", "ISIN"]
+    if len(_kilder_i(df)) > 1:
+        view["Kilde"] = view["source"].map(ssr_kilder.tittel)
+        kolonner.append("Kilde")
+    view = view[kolonner]
 
     st.dataframe(
         view,
@@ -150,6 +264,7 @@ def vis_posisjonsholdere(df: pd.DataFrame, key_prefix: str = "holders") -> None:
             "Short %": st.column_config.NumberColumn("Short %", format="%.2f %%"),
             "Aksjer": st.column_config.NumberColumn("Aksjer", format="%d"),
             "ISIN": st.column_config.TextColumn("ISIN", width="medium"),
+            "Kilde": st.column_config.TextColumn("Kilde", width="small"),
         },
     )
 
@@ -162,18 +277,339 @@ def vis_posisjonsholdere(df: pd.DataFrame, key_prefix: str = "holders") -> None:
     )
 
 
-def vis_hurtiginnsikt(df: pd.DataFrame, expanded: bool = False) -> None:
+@st.fragment
+def vis_register_per_dato(df: pd.DataFrame) -> None:
+    """Registeret slik det så ut på en valgt dato, slått opp direkte i SQLite."""
+    st.subheader("Registeret per dato")
+    datoer = pd.to_datetime(df["date"], errors="coerce").dropna()
+    if datoer.empty:
+        st.info("Ingen gyldige datoer i historikken.")
+        return
+
+    left, right = st.columns([1, 1], gap="medium")
+    with left:
+        dato = st.date_input(
+            "Vis registeret slik det var på",
+            value=datoer.max().date(),
+            min_value=datoer.min().date(),
+            max_value=datoer.max().date(),
+            format="DD.MM.YYYY",
+            key="db_per_dato",
+        )
+    with right:
+        per_holder = st.toggle("Per posisjonsholder", value=False, key="db_per_dato_holder")
+
+    data = hent_register_per_dato(dato, per_holder=per_holder)
+    if data.empty:
+        st.info("Ingen registreringer på eller før valgt dato.")
+        return
+
+    view = data.rename(
+        columns={
+            "issuerName": "Selskap",
+            "positionHolder": "Posisjonsholder",
+            "shortPercent": "Short %",
+            "shares": "Aksjer",
+            "isin": "ISIN",
+        }
+    )
+    view["Sist registrert"] = view["date"].dt.strftime("%d.%m.%Y")
+    kolonner = ["Selskap", "Posisjonsholder", "Sist registrert", "Short %", "Aksjer", "ISIN"]
+    view = view[[k for k in kolonner if k in view.columns]]
+
+    st.caption(f"{len(view):,} {'posisjoner' if per_holder else 'selskaper'} per {dato.strftime('%d.%m.%Y')}.")
+    st.dataframe(
+        view,
+        width="stretch",
+        hide_index=True,
+        column_config={
+            "Short %": st.column_config.NumberColumn("Short %", format="%.2f %%"),
+            "Aksjer": st.column_config.NumberColumn("Aksjer", format="%d"),
+        },
+    )
+
+
+@st.fragment
+def vis_lignende(df: pd.DataFrame) -> None:
+    """Selskapene med mest lik utvikling i shortandel som et valgt selskap."""
+    st.subheader("Lignende selskaper")
+    left, right = st.columns([2, 1], gap="medium")
+    with right:
+        maaneder = st.select_slider("Periode (måneder)", options=[3, 6, 12, 24], value=12, key="lignende_periode")
+    indeks = ssr_likhet.hent_indeks(df, maaneder)
+    if len(indeks) < 2:
+        st.info("For lite historikk i perioden til å sammenligne selskaper.")
+        return
+    with left:
+        selskap = st.selectbox("Selskap", sorted(indeks.selskaper), key="lignende_selskap")
+
+    lignende = indeks.lignende(selskap, k=10)
+    st.caption(
+        f"Korrelasjon mellom forløpene siste {maaneder} måneder, med ett punkt per uke. "
+        "1 betyr at shortandelen har beveget seg helt likt, uavhengig av nivå."
+    )
+    st.dataframe(
+        lignende.rename(columns={"issuerName": "Selskap", "korrelasjon": "Korrelasjon"}),
+        width="stretch",
+        hide_index=True,
+        column_config={
+            "Korrelasjon": st.column_config.ProgressColumn("Korrelasjon", min_value=-1.0, max_value=1.0, format="%.2f"),
+        },
+    )
+
+    panel = ssr_panel.hent_panel(df)
+    navn = [selskap, *lignende["issuerName"].head(3)]
+    forlop = pd.concat(
+        [panel.serie(n).loc[indeks.dager[0]:].rename_axis("date").reset_index().assign(issuerName=n) for n in navn],
+        ignore_index=True,
+    )
+    fig = lag_figur(dataversjon(df), "lignende_linje", tuple(navn), maaneder, forlop)
+    st.plotly_chart(fig, use_container_width=True, key="lignende_chart")
+
+
+HENDELSESTYPER = {"opened": "Åpnet", "increased": "Økt", "reduced": "Redusert", "closed": "Lukket"}
+
+
+@st.fragment
+def vis_endringsfeed() -> None:
+    """Åpnede, økte, reduserte og lukkede posisjoner, lest fra hendelsestabellen."""
+    siste = siste_hendelsesdato()
+    if siste is None:
+        st.info(
+            "Ingen posisjonsendringer er registrert ennå. Endringer registreres når "
+            "historikken oppdateres, fra og med andre gang."
+        )
+        return
+
+    siste = pd.Timestamp(siste).date()
+    left, right = st.columns([1, 2], gap="medium")
+    with left:
+        periode = st.date_input(
+            "Periode",
+            value=(siste, siste),
+            max_value=max(siste, pd.Timestamp.today().date()),
+            format="DD.MM.YYYY",
+            key="endringer_periode",
+        )
+    with right:
+        valgte = st.multiselect(
+            "Type endring",
+            options=list(HENDELSESTYPER),
+            default=list(HENDELSESTYPER),
+            format_func=HENDELSESTYPER.get,
+            key="endringer_typer",
+        )
+
+    fra, til = (periode[0], periode[-1]) if isinstance(periode, tuple) and periode else (siste, siste)
+    hendelser = hent_posisjonshendelser(fra, til, valgte)
+
+    kolonner = st.columns(len(HENDELSESTYPER))
+    antall = hendelser["event_type"].value_counts()
+    for kolonne, (type_, navn) in zip(kolonner, HENDELSESTYPER.items()):
+        kolonne.metric(navn, int(antall.get(type_, 0)))
+
+    if hendelser.empty:
+        st.info("Ingen endringer i valgt periode.")
+        return
+
+    view = hendelser.assign(
+        Dato=pd.to_datetime(hendelser["event_date"], errors="coerce").dt.strftime("%d.%m.%Y"),
+        Endring=hendelser["event_type"].map(HENDELSESTYPER),
+    ).rename(
+        columns={
+            "issuerName": "Selskap",
+            "positionHolder": "Posisjonsholder",
+            "previous_percent": "Før %",
+            "new_percent": "Nå %",
+            "new_shares": "Aksjer",
+            "isin": "ISIN",
+        }
+    )[["Dato", "Endring", "Selskap", "Posisjonsholder", "Før %", "Nå %", "Aksjer", "ISIN"]]
+
+    st.dataframe(
+        view,
+        width="stretch",
+        hide_index=True,
+        column_config={
+            "Før %": st.column_config.NumberColumn("Før %", format="%.2f %%"),
+            "Nå %": st.column_config.NumberColumn("Nå %", format="%.2f %%"),
+            "Aksjer": st.column_config.NumberColumn("Aksjer", format="%d"),
+        },
+    )
+
+
+def vis_trengsel(df_holders: pd.DataFrame) -> None:
+    """Crowding: antall holdere, konsentrasjon og felles holdere mellom selskaper."""
+    if df_holders is None or df_holders.empty:
+        st.info("Ingen individuelle posisjonsholdere tilgjengelig akkurat nå.")
+        return
+
+    eksponering = ssr_trengsel.hent_eksponering(df_holders)
+    with ssr_ytelse.spenn("analyse:trengsel", posisjoner=len(eksponering)):
+        per_selskap = eksponering.per_selskap()
+        per_holder = eksponering.per_holder()
+        par = eksponering.overlappende_par(n=20)
+    if per_selskap.empty:
+        st.info("Ingen åpne posisjoner over publiseringsterskelen.")
+        return
+
+    kolonner = st.columns(4)
+    kolonner[0].metric("Åpne posisjoner", f"{len(eksponering):,}")
+    kolonner[1].metric("Posisjonsholdere", f"{len(per_holder):,}")
+    kolonner[2].metric("Selskaper med short", f"{len(per_selskap):,}")
+    kolonner[3].metric("Holdere per selskap", f"{per_selskap['holdere'].mean():.1f}")
+
+    st.subheader("Mest crowdede selskaper")
+    st.caption(
+        "Konsentrasjon er Herfindahl-indeksen over holdernes andeler av shorten: "
+        "1 betyr at én holder står for alt, lave verdier at shorten er spredt på mange."
+    )
+    st.dataframe(
+        per_selskap.rename(
+            columns={
+                "issuerName": "Selskap",
+                "holdere": "Holdere",
+                "shortPercent": "Short %",
+                "storste_posisjon": "Største posisjon %",
+                "storste_andel": "Største holders andel",
+                "hhi": "Konsentrasjon",
+            }
+        ),
+        width="stretch",
+        hide_index=True,
+        column_config={
+            "Short %": st.column_config.NumberColumn("Short %", format="%.2f %%"),
+            "Største posisjon %": st.column_config.NumberColumn("Største posisjon %", format="%.2f %%"),
+            "Største holders andel": st.column_config.ProgressColumn(
+                "Største holders andel", format="percent", min_value=0.0, max_value=1.0
+            ),
+            "Konsentrasjon": st.column_config.NumberColumn("Konsentrasjon", format="%.2f"),
+        },
+    )
+
+    left, right = st.columns(2, gap="medium")
+    with left:
+        st.subheader("Felles posisjonsholdere")
+        selskap = st.selectbox(
+            "Selskap",
+            options=per_selskap["issuerName"].tolist(),
+            key="trengsel_selskap",
+        )
+        overlapp = eksponering.overlapp(selskap, n=10)
+        if overlapp.empty:
+            st.info("Ingen andre selskaper shortes av de samme holderne.")
+        else:
+            st.dataframe(
+                overlapp.rename(
+                    columns={"issuerName": "Selskap", "felles_holdere": "Felles holdere", "jaccard": "Overlapp"}
+                ),
+                width="stretch",
+                hide_index=True,
+                column_config={"Overlapp": st.column_config.NumberColumn("Overlapp", format="%.2f")},
+            )
+    with right:
+        st.subheader("Selskapspar med flest felles holdere")
+        if par.empty:
+            st.info("Ingen selskapspar deler to eller flere posisjonsholdere.")
+        else:
+            st.dataframe(
+                par.rename(
+                    columns={
+                        "selskap_a": "Selskap",
+                        "selskap_b": "Selskap 2",
+                        "felles_holdere": "Felles holdere",
+                        "jaccard": "Overlapp",
+                    }
+                ),
+                width="stretch",
+                hide_index=True,
+                column_config={"Overlapp": st.column_config.NumberColumn("Overlapp", format="%.2f")},
+            )
+
+    st.subheader("Posisjonsholdere med flest selskaper")
+    st.dataframe(
+        per_holder.head(25).rename(
+            columns={"positionHolder": "Posisjonsholder", "selskaper": "Selskaper", "shortPercent": "Sum short %"}
+        ),
+        width="stretch",
+        hide_index=True,
+        column_config={"Sum short %": st.column_config.NumberColumn("Sum short %", format="%.2f %%")},
+    )
+
+
+# Regeltypene kommer fra ssr_api; en ny type uten tekst her vises med navnet sitt.
+_VARSELTEKST = {
+    "over": "Shortandel krysser terskel oppover",
+    "under": "Shortandel krysser terskel nedover",
+    "apnet": "Posisjonsholder åpner posisjon",
+    "lukket": "Posisjonsholder lukker posisjon",
+}
+
+
+def _varseltekst(regel: str) -> str:
+    return _VARSELTEKST.get(regel, regel)
+
+
+@st.fragment
+def vis_overvaking() -> None:
+    """Overvåkingsregler og siste varsler. Reglene sjekkes hver gang historikken oppdateres."""
+    st.subheader("Overvåking og varsler")
+    with st.form("ny_varselregel", clear_on_submit=True, border=True):
+        type_col, selskap_col, holder_col, terskel_col = st.columns([2, 2, 2, 1])
+        rule_type = type_col.selectbox("Regel", VARSELTYPER, format_func=_varseltekst)
+        selskap = selskap_col.text_input("Selskap", placeholder="Tomt = alle selskaper").strip()
+        holder = holder_col.text_input("Posisjonsholder", placeholder="Tomt = alle").strip()
+        terskel = terskel_col.number_input("Terskel %", min_value=0.0, max_value=100.0, value=2.0, step=0.1)
+        if st.form_submit_button("Legg til regel"):
+            try:
+                legg_til_varselregel(
+                    rule_type,
+                    issuerName=selskap or None,
+                    positionHolder=holder or None,
+                    threshold=terskel if rule_type in ("over", "under") else None,
+                )
+                st.success("Regelen er lagt til.")
+            except ValueError as exc:
+                st.error(str(exc))
+
+    regler = hent_varselregler()
+    if not regler.empty:
+        regler = regler.assign(Regel=regler["rule_type"].map(_varseltekst))
+        st.dataframe(
+            regler.rename(
+                columns={"id": "Id", "issuerName": "Selskap", "positionHolder": "Posisjonsholder", "threshold": "Terskel %"}
+            )[["Id", "Regel", "Selskap", "Posisjonsholder", "Terskel %"]],
+            width="stretch",
+            hide_index=True,
+        )
+        slett = st.selectbox("Slett regel", [None, *regler["id"].tolist()], key="slett_varselregel")
+        if slett is not None and st.button("Slett valgt regel", key="slett_varselregel_knapp"):
+            slett_varselregel(slett)
+            st.rerun(scope="fragment")
+
+    varsler = hent_varsler()
+    if varsler.empty:
+        st.caption("Ingen varsler er utløst ennå.")
+    else:
+        st.dataframe(
+            varsler.rename(columns={"fired_at": "Utløst", "message": "Varsel"})[["Utløst", "Varsel"]],
+            width="stretch",
+            hide_index=True,
+        )
+
+
+def vis_hurtiginnsikt(df: pd.DataFrame, expanded: bool = False, panel: str = "historikk") -> None:
     with st.expander("Hurtig-innsikt: største endringer og nye posisjoner", expanded=expanded):
         left, right = st.columns([1, 1], gap="medium")
 
         with left:
             st.markdown("### Største endringer")
-            changes = beregn_storste_endringer(df)
+            changes = hent_analyser(df)["endringer"]
 
             if changes.empty:
                 st.info("Ingen endringer å vise.")
             else:
-                changes_view = changes.copy()
+                changes_view = changes.head(10)
                 changes_view["Retning"] = changes_view["endring"].apply(
                     lambda value: "▲ Økning" if value > 0 else "▼ Reduksjon"
                 )
@@ -196,7 +632,6 @@ def vis_hurtiginnsikt(df: pd.DataFrame, expanded: bool = False) -> None:
                             "date": "Dato",
                         }
                     )
-                    .head(10)
                 )
 
                 st.dataframe(
@@ -216,12 +651,12 @@ def vis_hurtiginnsikt(df: pd.DataFrame, expanded: bool = False) -> None:
 
         with right:
             st.markdown("### Nye posisjoner over 0,5 %")
-            new_positions = finn_nye_shortposisjoner(df)
+            new_positions = hent_analyser(df)["nye_posisjoner"]
 
             if new_positions.empty:
                 st.info("Ingen nye posisjoner å vise.")
             else:
-                new_positions_view = new_positions.copy()
+                new_positions_view = new_positions.head(10)
                 new_positions_view["forrige_short"] = new_positions_view[
                     "forrige_short"
                 ].fillna(0.0)
@@ -244,7 +679,6 @@ def vis_hurtiginnsikt(df: pd.DataFrame, expanded: bool = False) -> None:
                             "date": "Dato",
                         }
                     )
-                    .head(10)
                 )
 
                 st.dataframe(
@@ -261,7 +695,50 @@ def vis_hurtiginnsikt(df: pd.DataFrame, expanded: bool = False) -> None:
                     },
                 )
 
+        vis_uvanlige_bevegelser(df, panel)
 
+
+def vis_uvanlige_bevegelser(df: pd.DataFrame, panel: str) -> None:
+    st.markdown("### Uvanlige bevegelser")
+    st.caption(
+        f"Siste endring per selskap målt mot selskapets egne {ssr_avvik.VINDU} foregående endringer. "
+        "Persentilen er andelen av dem som var mindre."
+    )
+    avvik = ssr_avvik.hent_avvik(df, panel).dropna(subset=["zscore"])
+    if avvik.empty:
+        st.info("For lite historikk til å skille uvanlige bevegelser fra vanlige.")
+        return
+
+    view = avvik.head(10)
+    view["Fra → til"] = [
+        f"{fra:.2f} % → {til:.2f} %" for fra, til in zip(view["forrige_short"], view["shortPercent"])
+    ]
+    view["date"] = view["date"].dt.strftime("%d.%m.%Y")
+    view = view[["issuerName", "Fra → til", "endring", "zscore", "persentil", "date"]].rename(
+        columns={
+            "issuerName": "Selskap",
+            "endring": "Endring (pp)",
+            "zscore": "Z-skår",
+            "persentil": "Persentil",
+            "date": "Dato",
+        }
+    )
+    st.dataframe(
+        view,
+        width="stretch",
+        hide_index=True,
+        column_config={
+            "Selskap": st.column_config.TextColumn("Selskap", width=200),
+            "Fra → til": st.column_config.TextColumn("Fra → til", width=155),
+            "Endring (pp)": st.column_config.NumberColumn("Endring (pp)", format="%.2f", width=95),
+            "Z-skår": st.column_config.NumberColumn("Z-skår", format="%+.1f", width=80),
+            "Persentil": st.column_config.NumberColumn("Persentil", format="%.2f", width=80),
+            "Dato": st.column_config.TextColumn("Dato", width=90),
+        },
+    )
+
+
+@st.fragment
 def vis_sok_og_graf(df: pd.DataFrame, key_prefix: str) -> None:
     if df.empty:
         st.info("Ingen data tilgjengelig.")
@@ -279,17 +756,8 @@ def vis_sok_og_graf(df: pd.DataFrame, key_prefix: str) -> None:
         key=f"{key_prefix}_search",
     ).strip()
 
-    filtered = df.copy()
-    if search:
-        issuer_mask = (
-            filtered["issuerName"].fillna("").astype(str)
-            .str.contains(search, case=False, na=False, regex=False)
-        )
-        isin_mask = (
-            filtered["isin"].fillna("").astype(str)
-            .str.contains(search, case=False, na=False, regex=False)
-        )
-        filtered = filtered.loc[issuer_mask | isin_mask]
+    with ssr_ytelse.spenn(f"sok:{key_prefix}_filtrering", rader=len(df)):
+        filtered = _sokefilter(df, ["issuerName", "isin"], search, f"{key_prefix}_search_hits")
 
     issuers = sorted(filtered["issuerName"].dropna().astype(str).unique().tolist())
     selected = st.multiselect(
@@ -300,30 +768,27 @@ def vis_sok_og_graf(df: pd.DataFrame, key_prefix: str) -> None:
         placeholder="Velg selskaper – tomt valg viser alle",
     )
 
-    shown = (
-        filtered.loc[filtered["issuerName"].astype(str).isin(selected)].copy()
-        if selected
-        else filtered.copy()
-    )
+    shown = filtered.loc[filtered["issuerName"].astype(str).isin(selected)] if selected else filtered
     if shown.empty:
         st.info("Ingen treff for søket eller filteret.")
         return
 
-    shown = _standardiser_shortpercent(shown)
-    shown["date"] = pd.to_datetime(shown["date"], errors="coerce")
-    shown = shown.dropna(subset=["issuerName", "date", "shortPercent"])
-
-    # Beregn endring mot forrige registrerte nivå for hvert selskap.
-    shown = shown.sort_values(["issuerName", "date"])
-    shown["Endring (pp)"] = shown.groupby("issuerName")["shortPercent"].diff()
-    shown["Trend"] = shown["Endring (pp)"].apply(
-        lambda value: (
-            "▲ Økning" if pd.notna(value) and value > 0
-            else "▼ Reduksjon" if pd.notna(value) and value < 0
-            else "— Uendret"
+    with ssr_ytelse.spenn(f"tabell:{key_prefix}_endringer", rader=len(shown)):
+        shown = _standardiser_shortpercent(shown)
+        shown = shown.assign(date=pd.to_datetime(shown["date"], errors="coerce"))
+        shown = shown.dropna(subset=["issuerName", "date", "shortPercent"])
+
+        # Beregn endring mot forrige registrerte nivå for hvert selskap.
+        shown = shown.sort_values(["issuerName", "date"])
+        shown["Endring (pp)"] = shown.groupby("issuerName")["shortPercent"].diff()
+        shown["Trend"] = shown["Endring (pp)"].apply(
+            lambda value: (
+                "▲ Økning" if pd.notna(value) and value > 0
+                else "▼ Reduksjon" if pd.notna(value) and value < 0
+                else "— Uendret"
+            )
         )
-    )
-    shown = shown.sort_values(["date", "issuerName"], ascending=[False, True])
+        shown = shown.sort_values(["date", "issuerName"], ascending=[False, True])
 
     controls_left, controls_middle, controls_right = st.columns([1.25, 1, 1])
     with controls_left:
@@ -350,25 +815,31 @@ def vis_sok_og_graf(df: pd.DataFrame, key_prefix: str) -> None:
         shown = shown.sort_values("date").groupby("issuerName", as_index=False).tail(1)
         shown = shown.sort_values(["shortPercent", "issuerName"], ascending=[False, True])
 
-    shown["Posisjonsholder"] = (
-        shown.get("positionHolder", pd.Series(index=shown.index, dtype="object"))
-        .fillna("Aggregert")
-        .replace({"None": "Aggregert", "": "Aggregert"})
-    )
-    shown["Dato"] = shown["date"].dt.strftime("%d.%m.%Y")
-    shown["Selskap"] = shown["issuerName"].astype(str)
-    shown["Short %"] = shown["shortPercent"]
-    shown["ISIN"] = shown["isin"].fillna("—").astype(str)
+    with ssr_ytelse.spenn(f"tabell:{key_prefix}_formatering", rader=len(shown)):
+        shown["Posisjonsholder"] = (
+            shown.get("positionHolder", pd.Series(index=shown.index, dtype="object"))
+            .fillna("Aggregert")
+            .replace({"None": "Aggregert", "": "Aggregert"})
+        )
+        shown["Dato"] = shown["date"].dt.strftime("%d.%m.%Y")
+        shown["Selskap"] = shown["issuerName"].astype(str)
+        shown["Short %"] = shown["shortPercent"]
+        shown["ISIN"] = shown["isin"].fillna("—").astype(str)
 
-    if "shares" in shown.columns:
-        shown["Aksjer"] = pd.to_numeric(shown["shares"], errors="coerce")
-    else:
-        shown["Aksjer"] = pd.NA
+        if "shares" in shown.columns:
+            shown["Aksjer"] = pd.to_numeric(shown["shares"], errors="coerce")
+        else:
+            shown["Aksjer"] = pd.NA
+        shown["Kilde"] = (
+            shown.get("source", pd.Series(index=shown.index, dtype="object"))
+            .fillna(ssr_kilder.STANDARDKILDE)
+            .map(ssr_kilder.tittel)
+        )
 
-    base_columns = ["Selskap", "Dato", "Short %", "Endring (pp)", "Trend"]
-    advanced_columns = ["ISIN", "Posisjonsholder", "Aksjer"]
-    display_columns = base_columns + advanced_columns if advanced else base_columns
-    table_view = shown[display_columns].head(max_rows)
+        base_columns = ["Selskap", "Dato", "Short %", "Endring (pp)", "Trend"]
+        advanced_columns = ["ISIN", "Posisjonsholder", "Aksjer", "Kilde"]
+        display_columns = base_columns + advanced_columns if advanced else base_columns
+        table_view = shown[display_columns].head(max_rows)
 
     info_left, info_right = st.columns([2, 1])
     with info_left:
@@ -395,6 +866,7 @@ def vis_sok_og_graf(df: pd.DataFrame, key_prefix: str) -> None:
         "ISIN": st.column_config.TextColumn("ISIN", width="medium"),
         "Posisjonsholder": st.column_config.TextColumn("Posisjonsholder", width="medium"),
         "Aksjer": st.column_config.NumberColumn("Aksjer", format="%d"),
+        "Kilde": st.column_config.TextColumn("Kilde", width="small"),
     }
 
     st.dataframe(
@@ -405,31 +877,138 @@ def vis_sok_og_graf(df: pd.DataFrame, key_prefix: str) -> None:
         height=min(760, 42 + 35 * min(len(table_view), 20)),
     )
 
-    plot_data = _agg_issuer_date(shown)
+    with ssr_ytelse.spenn(f"analyse:{key_prefix}_agg_issuer_date", rader=len(shown)):
+        plot_data = _agg_issuer_date(shown)
     if not plot_data.empty:
-        fig = px.line(
-            plot_data,
-            x="date",
-            y="shortPercent",
-            color="issuerName",
-            markers=True,
-            title="Utvikling i shortposisjon",
-            labels={"date": "Dato", "shortPercent": "Shortandel (%)", "issuerName": "Selskap"},
-        )
-        fig.update_layout(
-            template="plotly_white",
-            hovermode="x unified",
-            height=600,
-            legend_title_text="Utsteder",
-            paper_bgcolor="#ffffff",
-            plot_bgcolor="#ffffff",
-            font=dict(color="#0f172a"),
-            margin=dict(l=20, r=20, t=70, b=20),
+        fig = lag_figur(
+            dataversjon(df), "sok_linje", (search, tuple(selected), newest_only), None, plot_data
         )
         st.plotly_chart(fig, use_container_width=True, key=f"{key_prefix}_short_chart")
 
 
+@st.fragment
+def vis_topp10(data: pd.DataFrame) -> None:
+    """Periodevalg, tabell og grafer for Topp 10. Kjøres på nytt alene når perioden endres."""
+    period = st.selectbox("Velg tidsperiode", ["30 dager", "90 dager", "180 dager", "365 dager"])
+    days = int(period.split()[0])
+    start_date = pd.Timestamp.today().normalize() - pd.Timedelta(days=days)
+    recent = data.loc[data["date"] >= start_date]
+    # Perioden regnes fra dagens dato, så startdatoen hører med i figurnøkkelen.
+    versjon = f"{dataversjon(data)}:{start_date:%Y-%m-%d}"
+
+    if recent.empty:
+        st.warning("Ingen data for valgt periode.")
+    else:
+        with ssr_ytelse.spenn("analyse:topp10"):
+            top10 = (
+                recent.groupby("issuerName", as_index=False)["shortPercent"]
+                .mean()
+                .sort_values("shortPercent", ascending=False)
+                .head(10)
+            )
+        st.download_button(
+            "Last ned Topp 10 som CSV",
+            dataframe_to_csv(top10),
+            f"topp10_shorts_{days}d.csv",
+            "text/csv",
+        )
+
+        fig_bar = lag_figur(versjon, "topp10_stolpe", (), days, top10)
+        st.plotly_chart(fig_bar, use_container_width=True, key="top10_bar_chart")
+        st.dataframe(top10, width="stretch", hide_index=True)
+
+        names = top10["issuerName"].tolist()
+        with ssr_ytelse.spenn("analyse:topp10_utvikling"):
+            development = (
+                recent.loc[recent["issuerName"].isin(names)]
+                .groupby(["issuerName", "date"], as_index=False)["shortPercent"]
+                .mean()
+            )
+        if not development.empty:
+            fig_line = lag_figur(versjon, "topp10_linje", (), days, development)
+            st.plotly_chart(fig_line, use_container_width=True, key="top10_line_chart")
+
+            with ssr_ytelse.spenn("analyse:topp10_heatmap"):
+                heat = (
+                    development.pivot_table(index="issuerName", columns="date", values="shortPercent")
+                    .diff(axis=1)
+                    .fillna(0)
+                )
+            if not heat.empty:
+                fig_heat = lag_figur(versjon, "topp10_heatmap", (), days, heat)
+                st.plotly_chart(fig_heat, use_container_width=True, key="top10_heatmap")
+
+
+@st.fragment
+def vis_marked(df_db: pd.DataFrame) -> None:
+    """Markedstotaler og rangering for en valgt dag, lest fra det daglige panelet."""
+    st.subheader("Hele markedet")
+    panel = ssr_panel.hent_panel(df_db)
+    if not panel.form[1]:
+        st.info("Ingen gyldige datoer i historikken.")
+        return
+
+    totalt = panel.totalt()
+    fig = lag_figur(dataversjon(df_db), "marked_total", (), None, totalt)
+    st.plotly_chart(fig, use_container_width=True, key="marked_total_chart")
+
+    dato = st.date_input(
+        "Rangering per",
+        value=panel.dager[-1].date(),
+        min_value=panel.dager[0].date(),
+        max_value=panel.dager[-1].date(),
+        format="DD.MM.YYYY",
+        key="marked_dato",
+    )
+    rangering = panel.rangering(dato)
+    if rangering.empty:
+        st.info("Ingen selskaper med short på valgt dato.")
+        return
+    st.caption(
+        f"{len(rangering):,} selskaper med short per {dato.strftime('%d.%m.%Y')}. "
+        "Endring i plass er mot 20 handelsdager tidligere."
+    )
+    st.dataframe(
+        rangering.rename(
+            columns={
+                "issuerName": "Selskap",
+                "shortPercent": "Short %",
+                "plass": "Plass",
+                "persentil": "Persentil",
+                "endring_plass": "Endring i plass",
+            }
+        ),
+        width="stretch",
+        hide_index=True,
+        column_config={
+            "Short %": st.column_config.NumberColumn("Short %", format="%.2f %%"),
+            "Plass": st.column_config.NumberColumn("Plass", format="%d"),
+            "Persentil": st.column_config.ProgressColumn("Persentil", min_value=0.0, max_value=1.0, format="%.2f"),
+            "Endring i plass": st.column_config.NumberColumn("Endring i plass", format="%+d"),
+        },
+    )
+
+
+def vis_ytelsespanel() -> None:
+    """Skjult ytelsespanel, aktiveres med ?debug=1 i adressen."""
+    with st.expander("Ytelse (debug)", expanded=True):
+        st.markdown("### Denne kjøringen")
+        st.dataframe(ssr_ytelse.gjeldende_spenn(), width="stretch", hide_index=True)
+        st.markdown("### Persentiler på tvers av kjøringer")
+        st.dataframe(ssr_ytelse.persentiler(), width="stretch", hide_index=True)
+        st.markdown("### Cache-treff")
+        st.dataframe(ssr_ytelse.cache_statistikk(), width="stretch", hide_index=True)
+        st.markdown("### Minne per cache")
+        minne = ssr_ytelse.cache_minne()
+        st.caption(
+            f"Totalt {minne['MB'].sum():,.1f} MB av et budsjett på "
+            f"{ssr_ytelse.CACHE_BUDSJETT_BYTE / 1_048_576:,.0f} MB."
+        )
+        st.dataframe(minne, width="stretch", hide_index=True)
+
+
 # -------------------- APP --------------------
+ssr_ytelse.start_rerun("shortsalg_app")
 st.set_page_config(page_title="Shortsalg-register", layout="wide")
 
 st.markdown(
@@ -809,19 +1388,16 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-# Registeret ligger i en delt ressurs-cache. Ingen kopier lagres i brukernes session_state.
-with st.spinner("Laster delt datagrunnlag …"):
-    df_live = hent_fullt_register()
-    df_holders = hent_posisjonsholdere()
+# Hver visning er en egen side. Bare siden brukeren ser på kjøres ved en rerun,
+# mens datagrunnlaget hentes fra de delte cachene i ssr_api.
 
-# SQLite-data leses også fra en delt cache og blir ikke lagret per bruker.
-df_db = hent_database_data()
 
-tab_live, tab_db, tab_top10, tab_about = st.tabs(
-    ["Live-oversikt", "Søk i selskaper", "Topp 10", "Om plattformen"]
-)
+def side_live() -> None:
+    # Registeret ligger i en delt ressurs-cache. Ingen kopier lagres i brukernes session_state.
+    with st.spinner("Laster delt datagrunnlag …"):
+        df_live = hent_fullt_register()
+        df_holders = hent_posisjonsholdere()
 
-with tab_live:
     title_col, refresh_col = st.columns([5, 1], vertical_alignment="center")
 
     with title_col:
@@ -843,15 +1419,23 @@ with tab_live:
             "↻ Oppdater fra Finanstilsynet",
             key="force_refresh",
             width="stretch",
-            help="Tømmer den delte én-timescachen og henter registeret på nytt.",
+            help="Henter registeret på nytt. Samtidige trykk deler én nedlasting.",
         ):
-            st.session_state["show_refresh_success"] = True
-            tving_ny_nedlasting()
+            with st.spinner("Henter registeret fra Finanstilsynet …"):
+                st.session_state["refresh_status"] = tving_ny_nedlasting()
             st.rerun()
 
 
-    if st.session_state.pop("show_refresh_success", False):
+    refresh_status = st.session_state.pop("refresh_status", None)
+    if refresh_status == "oppdatert":
         st.success("Registeret er oppdatert med de nyeste dataene fra Finanstilsynet.")
+    elif refresh_status == "for_tidlig":
+        st.info(
+            "Registeret ble nettopp oppdatert. Du ser allerede de nyeste dataene – "
+            f"ny nedlasting er mulig etter {MIN_SEKUNDER_MELLOM_OPPDATERINGER // 60} minutter."
+        )
+    elif refresh_status == "feilet":
+        st.warning("Klarte ikke hente nye data fra Finanstilsynet. Viser forrige versjon av registeret.")
 
     if df_live.empty:
         st.error("Klarte ikke hente data fra Finanstilsynet akkurat nå.")
@@ -860,8 +1444,9 @@ with tab_live:
 
         # Bruk siste registrerte, aggregerte shortandel per selskap.
         # Dette samsvarer med "SUM SHORT %" i Finanstilsynets oversikt.
-        live_data = _standardiser_shortpercent(df_live)
-        current_positions = hent_siste_posisjon_per_selskap(live_data)
+        # Analysene caches per dataversjon og deles mellom alle brukerne.
+        analyser = hent_analyser(df_live)
+        current_positions = analyser["siste_per_selskap"]
         total_short = (
             current_positions["shortPercent"].sum()
             if not current_positions.empty
@@ -903,7 +1488,7 @@ with tab_live:
 
         # Tre raske markedssignaler. Vi viser største reduksjon og økning
         # separat for å unngå å gjenta "største gjeldende shortandel" fra KPI-kortene.
-        changes = beregn_storste_endringer(live_data)
+        changes = analyser["endringer"]
 
         if changes.empty:
             decrease_value = "Ingen endring"
@@ -914,7 +1499,7 @@ with tab_live:
             increase_company = "Ingen tilgjengelige data"
             increase_detail = "Kan beregnes når minst to observasjoner finnes."
         else:
-            decreases = changes.loc[changes["endring"] < 0].copy()
+            decreases = changes.loc[changes["endring"] < 0]
             if decreases.empty:
                 decrease_value = "Ingen reduksjon"
                 decrease_company = "Ingen tilgjengelige data"
@@ -936,7 +1521,7 @@ with tab_live:
                     f"{decrease_date_text}"
                 )
 
-            increases = changes.loc[changes["endring"] > 0].copy()
+            increases = changes.loc[changes["endring"] > 0]
             if increases.empty:
                 increase_value = "Ingen økning"
                 increase_company = "Ingen tilgjengelige data"
@@ -958,7 +1543,7 @@ with tab_live:
                     f"{increase_date_text}"
                 )
 
-        new_positions = finn_nye_shortposisjoner(live_data)
+        new_positions = analyser["nye_posisjoner"]
         if new_positions.empty:
             new_value = "Ingen nye"
             new_company = "Ingen nye posisjoner over 0,5 %"
@@ -1034,7 +1619,7 @@ with tab_live:
             )
 
         st.caption(
-            " Siste markedsdata fra Finanstilsynet: "
+            f" Siste markedsdata fra {', '.join(_kilder_i(df_live))}: "
             + (latest_date.strftime("%d.%m.%Y") if pd.notna(latest_date) else "ukjent")
         )
 
@@ -1045,11 +1630,14 @@ with tab_live:
                 "Oppdater historikk",
                 key="save_live",
                 width="stretch",
-                help="Lagrer bare nye rader i SQLite-databasen.",
+                help="Lagrer bare nye rader i SQLite-databasen og registrerer endrede posisjoner.",
             ):
                 with st.spinner("Sammenligner og lagrer nye rader …"):
-                    new_rows = lagre_i_database(df_live)
-                st.success(f"Ferdig. {new_rows:,} nye rader ble lagret.")
+                    new_rows, hendelser, varsler = oppdater_historikk(df_live, df_holders)
+                st.success(
+                    f"Ferdig. {new_rows:,} nye rader ble lagret og {hendelser:,} posisjonsendringer registrert."
+                    + (f" {varsler:,} varsler ble utløst." if varsler else "")
+                )
 
         with action_right:
             st.download_button(
@@ -1065,7 +1653,7 @@ with tab_live:
             "Historikk-knappen lagrer bare registreringer som ikke allerede finnes i databasen."
         )
 
-        vis_hurtiginnsikt(df_live, expanded=True)
+        vis_hurtiginnsikt(df_live, expanded=True, panel="live")
         st.subheader("Søk og filtrering")
         vis_sok_og_graf(df_live, "live")
 
@@ -1077,7 +1665,10 @@ with tab_live:
     else:
         st.info("Ingen lagringshistorikk er registrert ennå.")
 
-with tab_db:
+
+def side_historikk() -> None:
+    # SQLite-data leses også fra en delt cache og blir ikke lagret per bruker.
+    df_db = hent_database_data()
     st.header("Søk i historiske shortposisjoner")
     if df_db.empty:
         st.info("SQLite-databasen er tom. Lagre live-registeret først.")
@@ -1085,106 +1676,47 @@ with tab_db:
         st.success(f"Databasen inneholder {len(df_db):,} rader.")
         vis_hurtiginnsikt(df_db)
         vis_sok_og_graf(df_db, "db")
+        vis_register_per_dato(df_db)
+        vis_lignende(df_db)
 
 
-with tab_top10:
+def side_topp10() -> None:
+    df_db = hent_database_data()
     st.header("Markedets mest shortede selskaper")
     if df_db.empty:
         st.info("SQLite-databasen er tom. Lagre live-registeret først.")
     else:
-        data = _standardiser_shortpercent(df_db)
-        data["date"] = pd.to_datetime(data["date"], errors="coerce")
-        data = data.dropna(subset=["issuerName", "date", "shortPercent"])
+        with ssr_ytelse.spenn("analyse:topp10_klargjoring", rader=len(df_db)):
+            data = _standardiser_shortpercent(df_db)
+            data["date"] = pd.to_datetime(data["date"], errors="coerce")
+            data = data.dropna(subset=["issuerName", "date", "shortPercent"])
 
-        period = st.selectbox("Velg tidsperiode", ["30 dager", "90 dager", "180 dager", "365 dager"])
-        days = int(period.split()[0])
-        start_date = pd.Timestamp.today().normalize() - pd.Timedelta(days=days)
-        recent = data.loc[data["date"] >= start_date]
+        vis_topp10(data)
+        st.divider()
+        vis_marked(df_db)
 
-        if recent.empty:
-            st.warning("Ingen data for valgt periode.")
-        else:
-            top10 = (
-                recent.groupby("issuerName", as_index=False)["shortPercent"]
-                .mean()
-                .sort_values("shortPercent", ascending=False)
-                .head(10)
-            )
-            st.download_button(
-                "Last ned Topp 10 som CSV",
-                dataframe_to_csv(top10),
-                f"topp10_shorts_{days}d.csv",
-                "text/csv",
-            )
 
-            fig_bar = px.bar(
-                top10,
-                x="issuerName",
-                y="shortPercent",
-                text_auto=".2f",
-                title=f"Topp 10 – gjennomsnittlig shortandel siste {days} dager",
-                labels={"issuerName": "Selskap", "shortPercent": "Shortandel (%)"},
-            )
-            fig_bar.update_layout(
-                template="plotly_white",
-                xaxis_tickangle=-35,
-                height=500,
-                paper_bgcolor="#ffffff",
-                plot_bgcolor="#ffffff",
-                font=dict(color="#0f172a"),
-                margin=dict(l=20, r=20, t=70, b=20),
-            )
-            st.plotly_chart(fig_bar, use_container_width=True, key="top10_bar_chart")
-            st.dataframe(top10, width="stretch", hide_index=True)
+def side_trengsel() -> None:
+    st.header("Crowding")
+    st.caption(
+        "Hvor mange som shorter hvert selskap, hvor konsentrert shorten er, og hvilke selskaper "
+        "som shortes av de samme posisjonsholderne. Bygger på gjeldende posisjoner i live-registeret."
+    )
+    vis_trengsel(hent_posisjonsholdere())
 
-            names = top10["issuerName"].tolist()
-            development = (
-                recent.loc[recent["issuerName"].isin(names)]
-                .groupby(["issuerName", "date"], as_index=False)["shortPercent"]
-                .mean()
-            )
-            if not development.empty:
-                fig_line = px.line(
-                    development,
-                    x="date",
-                    y="shortPercent",
-                    color="issuerName",
-                    title="Utvikling over tid for Topp 10",
-                    labels={"date": "Dato", "shortPercent": "Shortandel (%)", "issuerName": "Selskap"},
-                )
-                fig_line.update_layout(
-                    template="plotly_white",
-                    hovermode="x unified",
-                    height=600,
-                    paper_bgcolor="#ffffff",
-                    plot_bgcolor="#ffffff",
-                    font=dict(color="#0f172a"),
-                    margin=dict(l=20, r=20, t=70, b=20),
-                )
-                st.plotly_chart(fig_line, use_container_width=True, key="top10_line_chart")
 
-                heat = (
-                    development.pivot_table(index="issuerName", columns="date", values="shortPercent")
-                    .diff(axis=1)
-                    .fillna(0)
-                )
-                if not heat.empty:
-                    fig_heat = px.imshow(
-                        heat,
-                        aspect="auto",
-                        title="Daglige endringer i shortandel",
-                        labels={"x": "Dato", "y": "Selskap", "color": "Endring (%)"},
-                    )
-                    fig_heat.update_layout(
-                        template="plotly_white",
-                        height=600,
-                        paper_bgcolor="#ffffff",
-                        font=dict(color="#0f172a"),
-                        margin=dict(l=20, r=20, t=70, b=20),
-                    )
-                    st.plotly_chart(fig_heat, use_container_width=True, key="top10_heatmap")
+def side_endringer() -> None:
+    st.header("Endringer i posisjoner")
+    st.caption(
+        "Hvem har åpnet, økt, redusert eller lukket en shortposisjon. En posisjon regnes som "
+        "lukket når den faller under 0,5 % eller forsvinner fra registeret."
+    )
+    vis_endringsfeed()
+    st.divider()
+    vis_overvaking()
+
 
-with tab_about:
+def side_om() -> None:
     st.header("Om plattformen")
     st.markdown(
         """
@@ -1197,3 +1729,21 @@ with tab_about:
         **Utvikler:** Andreas Bolton Seielstad.
         """
     )
+
+
+navigasjon = st.navigation(
+    [
+        st.Page(side_live, title="Live-oversikt", url_path="live", default=True),
+        st.Page(side_historikk, title="Søk i selskaper", url_path="sok"),
+        st.Page(side_topp10, title="Topp 10", url_path="topp10"),
+        st.Page(side_trengsel, title="Crowding", url_path="crowding"),
+        st.Page(side_endringer, title="Endringer", url_path="endringer"),
+        st.Page(side_om, title="Om plattformen", url_path="om"),
+    ],
+    position="top",
+)
+navigasjon.run()
+
+if st.query_params.get("debug") == "1":
+    vis_ytelsespanel()
+ssr_ytelse.avslutt_rerun()
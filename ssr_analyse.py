@@ -0,0 +1,83 @@
+import os
+
+import pandas as pd
+
+
+def bruk_copy_on_write():
+    """
+    Slår på pandas copy-on-write for prosessen: utsnitt og avledede frames
+    deler data med kilden til noen faktisk skriver til dem, så visningene
+    trenger ingen defensive kopier. Kalles fra inngangspunktene (appen,
+    serveren og kommandolinjeverktøyene). SHORTSALG_COPY_ON_WRITE=0 slår det av.
+    """
+    pd.set_option("mode.copy_on_write", os.environ.get("SHORTSALG_COPY_ON_WRITE", "1") != "0")
+
+
+def dataversjon(df: pd.DataFrame) -> str:
+    """Versjonsmerket satt av ssr_api, eller en innholdshash for umerkede frames."""
+    versjon = df.attrs.get("dataversjon")
+    if versjon is None:
+        versjon = f"hash:{int(pd.util.hash_pandas_object(df, index=False).sum())}"
+    return versjon
+
+
+def _standardiser_shortpercent(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty or "shortPercent" not in df.columns:
+        return df
+    out = df.assign(shortPercent=pd.to_numeric(df["shortPercent"], errors="coerce"))
+    maximum = out["shortPercent"].max(skipna=True)
+    if pd.notna(maximum) and maximum > 20:
+        out["shortPercent"] = out["shortPercent"] / 100
+    return out
+
+
+def _agg_issuer_date(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty:
+        return df
+    out = _standardiser_shortpercent(df)
+    out = out.assign(date=pd.to_datetime(out["date"], errors="coerce"))
+    out = out.dropna(subset=["issuerName", "date", "shortPercent"])
+    return (
+        out.groupby(["issuerName", "date"], as_index=False)["shortPercent"]
+        .sum()
+        .sort_values(["issuerName", "date"])
+    )
+
+
+def hent_siste_posisjon_per_selskap(df: pd.DataFrame) -> pd.DataFrame:
+    """Returnerer siste registrerte, aggregerte shortandel for hvert selskap."""
+    data = _agg_issuer_date(df)
+    if data.empty:
+        return data
+
+    return (
+        data.sort_values(["issuerName", "date"])
+        .groupby("issuerName", as_index=False)
+        .tail(1)
+        .sort_values(["shortPercent", "issuerName"], ascending=[False, True])
+        .reset_index(drop=True)
+    )
+
+
+def beregn_storste_endringer(df: pd.DataFrame) -> pd.DataFrame:
+    data = _agg_issuer_date(df)
+    if data.empty:
+        return data
+    data["forrige_short"] = data.groupby("issuerName")["shortPercent"].shift(1)
+    latest = data.groupby("issuerName").tail(1)
+    latest["endring"] = latest["shortPercent"] - latest["forrige_short"]
+    latest = latest.dropna(subset=["endring"])
+    return latest.reindex(latest["endring"].abs().sort_values(ascending=False).index)
+
+
+def finn_nye_shortposisjoner(df: pd.DataFrame, terskel: float = 0.5) -> pd.DataFrame:
+    data = _agg_issuer_date(df)
+    if data.empty:
+        return data
+    data["forrige_short"] = data.groupby("issuerName")["shortPercent"].shift(1)
+    latest = data.groupby("issuerName").tail(1)
+    result = latest[
+        (latest["shortPercent"] >= terskel)
+        & (latest["forrige_short"].isna() | (latest["forrige_short"] < terskel))
+    ]
+    return result.sort_values(["date", "shortPercent"], ascending=[False, False])
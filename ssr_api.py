@@ -1,17 +1,53 @@
+import argparse
 import datetime
+import gzip
+import json
+import logging
 import os
+import random
 import sqlite3
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import requests
-import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+
+import ssr_delt
+import ssr_kilder
+import ssr_ytelse
+from ssr_analyse import (
+    beregn_storste_endringer,
+    bruk_copy_on_write,
+    dataversjon,
+    finn_nye_shortposisjoner,
+    hent_siste_posisjon_per_selskap,
+)
 
-API_URL = "https://ssr.finanstilsynet.no/api/v2/instruments/export-json"
 DB_PATH = os.environ.get("SHORTSALG_DB_PATH", "shortsalg.db")
-_DB_LOCK = threading.RLock()
+MIN_SEKUNDER_MELLOM_OPPDATERINGER = int(os.environ.get("SHORTSALG_MIN_REFRESH_SECONDS", "120"))
+# "rader" lagrer hver observasjon. "kompakt" lagrer bare endringspunkter, der
+# valid_to sier hvor lenge samme shortPercent og shares ble observert.
+LAGRINGSMODUS = os.environ.get("SHORTSALG_STORAGE", "rader")
+# Finanstilsynet publiserer posisjoner fra 0,5 %. Under dette regnes posisjonen som lukket.
+PUBLISERINGSTERSKEL = 0.5
+# Lesere åpner egne skrivebeskyttede forbindelser og går i parallell (WAL).
+# All skriving i prosessen står i kø hos én skrivetråd.
+_SKRIVER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ssr-skriver")
+_skjema_klart = set()
+
+# Grenser for henting fra API-et. Fristen gjelder hele nedlastingen inkludert
+# nye forsøk, slik at et tregt endepunkt aldri holder en sidevisning i minutter.
+HENT_FRIST_SEKUNDER = float(os.environ.get("SHORTSALG_FETCH_DEADLINE", "45"))
+_TILKOBLING_TIMEOUT = 5
+_LESE_TIMEOUT = 30
+_BACKOFF_START = 0.5
+_BACKOFF_MAKS = 8.0
 
 
 def _to_iso_date(value):
@@ -48,9 +84,10 @@ def _get_first(data, candidates, default=None):
     return default
 
 
-def _normaliser_payload(data):
+def _normaliser_payload(data, kilde=ssr_kilder.FINANSTILSYNET):
     rows = []
-    columns = ["isin", "issuerName", "positionHolder", "date", "shortPercent", "shares"]
+    columns = ["isin", "issuerName", "positionHolder", "date", "shortPercent", "shares", "source"]
+    felt = kilde.felt
 
     if not isinstance(data, list):
         return pd.DataFrame(columns=columns)
@@ -59,14 +96,11 @@ def _normaliser_payload(data):
         if not isinstance(instrument, dict):
             continue
 
-        isin = _get_first(instrument, ["isin", "instrumentIsin"])
-        issuer = _get_first(instrument, ["issuerName", "issuer", "instrumentName"])
-        instrument_holder = _get_first(
-            instrument,
-            ["positionHolder", "positionHolderName", "holderName", "positionOwner", "ownerName", "holder"],
-        )
+        isin = _get_first(instrument, felt["isin"])
+        issuer = _get_first(instrument, felt["issuerName"])
+        instrument_holder = _get_first(instrument, felt["positionHolder"])
 
-        events = instrument.get("events", [])
+        events = _get_first(instrument, felt["events"], default=[])
         if not isinstance(events, list):
             continue
 
@@ -74,21 +108,16 @@ def _normaliser_payload(data):
             if not isinstance(event, dict):
                 continue
 
-            holder = _get_first(
-                event,
-                ["positionHolder", "positionHolderName", "holderName", "positionOwner", "ownerName", "holder"],
-                default=instrument_holder,
-            )
+            holder = _get_first(event, felt["positionHolder"], default=instrument_holder)
 
             row = {
-                "isin": isin or _get_first(event, ["isin", "instrumentIsin"]),
-                "issuerName": issuer or _get_first(event, ["issuerName", "issuer"]),
+                "isin": isin or _get_first(event, felt["isin"]),
+                "issuerName": issuer or _get_first(event, felt["issuerName"]),
                 "positionHolder": holder,
-                "date": _to_iso_date(_get_first(event, ["date", "positionDate", "disclosureDate"])),
-                "shortPercent": _standardiser_shortpercent(
-                    _get_first(event, ["shortPercent", "netShortPosition", "positionPercent", "percent"])
-                ),
-                "shares": _get_first(event, ["shares", "shortPosition", "position", "numberOfShares"]),
+                "date": _to_iso_date(_get_first(event, felt["date"])),
+                "shortPercent": _standardiser_shortpercent(_get_first(event, felt["shortPercent"])),
+                "shares": _get_first(event, felt["shares"]),
+                "source": kilde.navn,
             }
 
             if row["issuerName"] and row["date"] and row["shortPercent"] is not None:
@@ -103,14 +132,18 @@ def _normaliser_payload(data):
     return df
 
 
-def _normaliser_posisjonsholdere(data):
+def _normaliser_posisjonsholdere(data, kilde=ssr_kilder.FINANSTILSYNET):
     """
     Lager ett separat datasett med individuelle offentlige shortposisjoner.
     Leser event["activePositions"] og holder dette adskilt fra de aggregerte
     event-radene, slik at eksisterende grafer og summer ikke dobbeltteller.
+
+    latestEvent er sann for posisjonene i instrumentets siste event, altså
+    registeret slik det står nå. En holder som mangler der, har lukket.
     """
     rows = []
-    columns = ["isin", "issuerName", "positionHolder", "date", "shortPercent", "shares"]
+    columns = ["isin", "issuerName", "positionHolder", "date", "shortPercent", "shares", "source", "latestEvent"]
+    felt = kilde.felt
 
     if not isinstance(data, list):
         return pd.DataFrame(columns=columns)
@@ -119,18 +152,23 @@ def _normaliser_posisjonsholdere(data):
         if not isinstance(instrument, dict):
             continue
 
-        isin = _get_first(instrument, ["isin", "instrumentIsin"])
-        issuer = _get_first(instrument, ["issuerName", "issuer", "instrumentName"])
-        events = instrument.get("events", [])
+        isin = _get_first(instrument, felt["isin"])
+        issuer = _get_first(instrument, felt["issuerName"])
+        events = _get_first(instrument, felt["events"], default=[])
         if not isinstance(events, list):
             continue
 
-        for event in events:
+        datoer = [
+            _to_iso_date(_get_first(event, felt["date"])) if isinstance(event, dict) else None for event in events
+        ]
+        siste = max((i for i, dato in enumerate(datoer) if dato), key=lambda i: datoer[i], default=None)
+
+        for indeks, event in enumerate(events):
             if not isinstance(event, dict):
                 continue
 
-            event_date = _to_iso_date(_get_first(event, ["date", "positionDate", "disclosureDate"]))
-            active_positions = event.get("activePositions", [])
+            event_date = datoer[indeks]
+            active_positions = _get_first(event, felt["activePositions"], default=[])
             if not isinstance(active_positions, list):
                 continue
 
@@ -138,21 +176,15 @@ def _normaliser_posisjonsholdere(data):
                 if not isinstance(position, dict):
                     continue
 
-                holder = _get_first(
-                    position,
-                    ["positionHolder", "positionHolderName", "holderName", "positionOwner", "ownerName", "holder"],
-                )
                 row = {
-                    "isin": isin or _get_first(position, ["isin", "instrumentIsin"]),
-                    "issuerName": issuer or _get_first(position, ["issuerName", "issuer"]),
-                    "positionHolder": holder,
-                    "date": _to_iso_date(
-                        _get_first(position, ["date", "positionDate", "disclosureDate"], default=event_date)
-                    ),
-                    "shortPercent": _standardiser_shortpercent(
-                        _get_first(position, ["shortPercent", "netShortPosition", "positionPercent", "percent"])
-                    ),
-                    "shares": _get_first(position, ["shares", "shortPosition", "position", "numberOfShares"]),
+                    "isin": isin or _get_first(position, felt["isin"]),
+                    "issuerName": issuer or _get_first(position, felt["issuerName"]),
+                    "positionHolder": _get_first(position, felt["positionHolder"]),
+                    "date": _to_iso_date(_get_first(position, felt["date"], default=event_date)),
+                    "shortPercent": _standardiser_shortpercent(_get_first(position, felt["shortPercent"])),
+                    "shares": _get_first(position, felt["shares"]),
+                    "source": kilde.navn,
+                    "latestEvent": indeks == siste,
                 }
 
                 if row["issuerName"] and row["positionHolder"] and row["date"] and row["shortPercent"] is not None:
@@ -167,56 +199,410 @@ def _normaliser_posisjonsholdere(data):
     return df
 
 
-@st.cache_data(ttl=3600, max_entries=1, show_spinner=False)
-def _hent_api_payload(max_retries=3):
-    """Henter rå JSON én gang per time og deler samme payload mellom datasett."""
+class HentingFeilet(RuntimeError):
+    """API-et kunne ikke leveres innenfor fristen, eller kretsbryteren er åpen."""
+
+
+class _Kretsbryter:
+    """
+    Slutter å kalle et endepunkt etter gjentatte feil.
+
+    Etter `terskel` feilede nedlastinger på rad er bryteren åpen i `pause`
+    sekunder, og alle kall feiler umiddelbart. Deretter slippes ett prøvekall
+    gjennom; lykkes det, lukkes bryteren igjen.
+    """
+
+    def __init__(self, terskel=2, pause=60):
+        self.terskel = terskel
+        self.pause = pause
+        self._feil = 0
+        self._apnet = None
+        self._prover = False
+        self._lock = threading.Lock()
+
+    def tillat(self):
+        with self._lock:
+            if self._apnet is None:
+                return True
+            if self._prover or time.monotonic() - self._apnet < self.pause:
+                return False
+            self._prover = True
+            return True
+
+    def suksess(self):
+        with self._lock:
+            self._feil = 0
+            self._apnet = None
+            self._prover = False
+
+    def feil(self):
+        with self._lock:
+            self._feil += 1
+            self._prover = False
+            if self._feil >= self.terskel:
+                self._apnet = time.monotonic()
+
+
+_KRETSBRYTERE = {}
+_KRETSBRYTER_LOCK = threading.Lock()
+_TRAD_LOKAL = threading.local()
+# Kildene hentes side om side; med bare Finanstilsynet skjer alt i kallende tråd.
+_KILDE_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ssr-kilde")
+
+
+def _kretsbryter(kilde):
+    """Egen kretsbryter per kilde, så ett register som feiler ikke stenger de andre."""
+    with _KRETSBRYTER_LOCK:
+        if kilde.navn not in _KRETSBRYTERE:
+            _KRETSBRYTERE[kilde.navn] = _Kretsbryter(
+                terskel=int(os.environ.get("SHORTSALG_BREAKER_THRESHOLD", "2")),
+                pause=float(os.environ.get("SHORTSALG_BREAKER_COOLDOWN", "60")),
+            )
+        return _KRETSBRYTERE[kilde.navn]
+
+
+def _per_kilde(funksjon):
+    """
+    Kjører funksjon(kildenavn) for hver kilde og returnerer {kildenavn: resultat}
+    i kilderekkefølgen. Flere kilder hentes parallelt i _KILDE_POOL, med
+    scriptkonteksten videreført slik at Streamlit-cachene virker som vanlig.
+    Pooltrådene lever videre, så konteksten tas av igjen etterpå.
+    """
+    navn = [kilde.navn for kilde in ssr_kilder.KILDER]
+    if len(navn) == 1:
+        return {navn[0]: funksjon(navn[0])}
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    def kjor(kildenavn):
+        if ctx is None:
+            return funksjon(kildenavn)
+        traad = threading.current_thread()
+        forrige = getattr(traad, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+        add_script_run_ctx(traad, ctx)
+        try:
+            return funksjon(kildenavn)
+        finally:
+            setattr(traad, SCRIPT_RUN_CONTEXT_ATTR_NAME, forrige)
+
+    return dict(zip(navn, _KILDE_POOL.map(kjor, navn)))
+
+
+def _http_session():
+    """Gjenbruker én requests.Session per tråd, med keep-alive og komprimering."""
+    session = getattr(_TRAD_LOKAL, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(
+            {
+                "User-Agent": "shortsalg-register/2.1",
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+            }
+        )
+        _TRAD_LOKAL.session = session
+    return session
+
+
+def _les_json_innen(response, slutt):
+    """Leser svaret i biter og avbryter hvis den totale fristen passeres."""
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=256 * 1024):
+        if time.monotonic() > slutt:
+            raise TimeoutError("Fristen for nedlasting ble overskredet.")
+        body.extend(chunk)
+    return json.loads(body)
+
+
+def _last_ned_payload(max_retries=3, frist=None, kilde=ssr_kilder.FINANSTILSYNET):
+    """
+    Laster ned instrumentlisten fra en kilde innenfor en samlet frist.
+
+    Nye forsøk venter med eksponentiell backoff og jitter. Kaster HentingFeilet
+    hvis alle forsøk feiler, fristen går ut eller kretsbryteren er åpen.
+    """
+    kretsbryter = _kretsbryter(kilde)
+    if not kretsbryter.tillat():
+        raise HentingFeilet(f"{kilde.tittel} feiler gjentatte ganger; venter før nytt forsøk.")
+
+    slutt = time.monotonic() + (HENT_FRIST_SEKUNDER if frist is None else frist)
     last_error = None
     for attempt in range(max_retries):
+        gjenstaende = slutt - time.monotonic()
+        if gjenstaende <= 0:
+            break
         try:
-            response = requests.get(
-                API_URL,
-                timeout=(15, 120),
-                headers={"User-Agent": "shortsalg-register/2.1"},
-            )
-            response.raise_for_status()
-            data = response.json()
-            if not isinstance(data, list) or not data:
+            with ssr_ytelse.spenn("api:nedlasting", kilde=kilde.navn, forsok=attempt + 1) as maling, _http_session().get(
+                kilde.url,
+                headers=kilde.headers,
+                timeout=(min(_TILKOBLING_TIMEOUT, gjenstaende), min(_LESE_TIMEOUT, gjenstaende)),
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+                data = kilde.instrumenter(_les_json_innen(response, slutt))
+                maling["instrumenter"] = len(data) if data else 0
+            if not data:
                 raise ValueError("API-et svarte, men payloaden var tom eller ugyldig.")
+            kretsbryter.suksess()
             return data
         except Exception as exc:
             last_error = exc
             if attempt < max_retries - 1:
-                time.sleep(2 + attempt)
+                pause = random.uniform(0, min(_BACKOFF_MAKS, _BACKOFF_START * 2 ** attempt))
+                if time.monotonic() + pause >= slutt:
+                    break
+                time.sleep(pause)
+
+    kretsbryter.feil()
+    raise HentingFeilet(f"Klarte ikke hente data fra {kilde.tittel}: {last_error}")
+
+
+# Tvungne oppdateringer bytter til en ny payload-versjon i stedet for å tømme
+# cachene. Versjonen inngår i cache-nøklene, slik at forrige versjon fortsatt
+# serveres helt til den nye payloaden er lastet ned og validert. Hver kilde har
+# sin egen versjon, så en kilde som feiler beholder dataene den allerede har.
+_OPPDATERING_LOCK = threading.Lock()
+_oppdateringer = {}
+
+
+def _oppdatering(kilde):
+    with _OPPDATERING_LOCK:
+        if kilde not in _oppdateringer:
+            _oppdateringer[kilde] = {
+                "lock": threading.Lock(),
+                "versjon": 0,
+                "fullfort": 0.0,
+                "oppdatert": 0.0,
+                "status": None,
+                "klargjort": {},
+            }
+        return _oppdateringer[kilde]
+
 
-    print(f"Klarte ikke hente data fra Finanstilsynet: {last_error}")
-    return []
+def _ta_klargjort(versjon, navn, kilde):
+    """Plukker opp et ferdig validert datasett for versjonen, hvis det finnes."""
+    klargjort = _oppdatering(kilde)["klargjort"]
+    if klargjort.get("versjon") != versjon:
+        return None
+    return klargjort.pop(navn, None)
+
+
+def _merk_versjon(df, navn, versjon):
+    """Merker et datasett slik at visninger kan cache avledede resultater per versjon."""
+    df.attrs["dataversjon"] = f"{navn}:{versjon}:{time.time_ns()}"
+    return df
+
+
+@ssr_ytelse.cache_data(ttl=3600, max_entries=2 * len(ssr_kilder.KILDER), show_spinner=False)
+def _hent_api_payload(versjon=0, max_retries=3, kilde=ssr_kilder.STANDARDKILDE):
+    """Henter rå JSON én gang per time og kilde, og deler payloaden mellom datasett."""
+    data = _ta_klargjort(versjon, "payload", kilde)
+    if data is not None:
+        return data
+    # Feil kastes videre og caches ikke; kretsbryteren hindrer nye forsøk per rerun.
+    return _last_ned_payload(max_retries=max_retries, kilde=ssr_kilder.kilde(kilde))
+
+
+@ssr_ytelse.cache_data(ttl=3600, max_entries=2 * len(ssr_kilder.KILDER), show_spinner=False)
+def _hent_fullt_register(versjon, max_retries=3, kilde=ssr_kilder.STANDARDKILDE):
+    df = _ta_klargjort(versjon, "register", kilde)
+    if df is None:
+        data = _hent_api_payload(versjon, max_retries=max_retries, kilde=kilde)
+        with ssr_ytelse.spenn("normaliser:register", kilde=kilde) as maling:
+            df = _normaliser_payload(data, ssr_kilder.kilde(kilde))
+            maling["rader"] = len(df)
+        if df.empty:
+            print(f"{ssr_kilder.tittel(kilde)} svarte, men parseren fant ingen gyldige aggregerte rader.")
+    return _merk_versjon(df, f"register-{kilde}", versjon)
+
+
+@ssr_ytelse.cache_data(ttl=3600, max_entries=2 * len(ssr_kilder.KILDER), show_spinner=False)
+def _hent_posisjonsholdere(versjon, max_retries=3, kilde=ssr_kilder.STANDARDKILDE):
+    df = _ta_klargjort(versjon, "holdere", kilde)
+    if df is None:
+        data = _hent_api_payload(versjon, max_retries=max_retries, kilde=kilde)
+        with ssr_ytelse.spenn("normaliser:holdere", kilde=kilde) as maling:
+            df = _normaliser_posisjonsholdere(data, ssr_kilder.kilde(kilde))
+            maling["rader"] = len(df)
+        if df.empty:
+            print(f"Ingen individuelle posisjonsholdere ble funnet i activePositions fra {ssr_kilder.tittel(kilde)}.")
+    return _merk_versjon(df, f"holdere-{kilde}", versjon)
+
+
+def _last_ned_og_valider(max_retries=3, kilde=ssr_kilder.STANDARDKILDE):
+    """Laster ned og normaliserer en ny payload. Kaster hvis registeret blir tomt."""
+    adapter = ssr_kilder.kilde(kilde)
+    data = _last_ned_payload(max_retries=max_retries, kilde=adapter)
+    with ssr_ytelse.spenn("normaliser:register", kilde=kilde) as maling:
+        register = _normaliser_payload(data, adapter)
+        maling["rader"] = len(register)
+    if register.empty:
+        raise ValueError(f"Ny payload fra {adapter.tittel} inneholdt ingen gyldige aggregerte rader.")
+    with ssr_ytelse.spenn("normaliser:holdere", kilde=kilde) as maling:
+        holdere = _normaliser_posisjonsholdere(data, adapter)
+        maling["rader"] = len(holdere)
+    return data, register, holdere
+
+
+def _delt_gruppe(kilde):
+    # Finanstilsynet beholder gruppenavnet fra før kildene ble innført.
+    return "api" if kilde == ssr_kilder.STANDARDKILDE else f"api-{kilde}"
+
+
+def _api_fra_delt_lager(max_retries=3, kilde=ssr_kilder.STANDARDKILDE):
+    """
+    Register og posisjonsholdere fra det delte lageret. Bare én replika laster
+    ned når publisert versjon er eldre enn en time; de andre leser filene.
+    """
+
+    def last():
+        _, register, holdere = _last_ned_og_valider(max_retries=max_retries, kilde=kilde)
+        return {"register": register, "holdere": holdere}
+
+    with ssr_ytelse.spenn("delt:api", kilde=kilde):
+        return ssr_delt.hent(_delt_gruppe(kilde), last, maks_alder=3600)
+
+
+# Sist vellykkede datasett per kilde, brukt når en kilde ikke svarer.
+_siste_gode = {}
+# Sammenslåtte datasett fra flere kilder, gjenbrukt til en av kildene får en ny versjon.
+_sammenslatt = {}
+
+
+def _fra_kilde(navn, hent, max_retries, kilde):
+    try:
+        if ssr_delt.aktiv():
+            df = _api_fra_delt_lager(max_retries=max_retries, kilde=kilde)[navn]
+        else:
+            df = hent(_oppdatering(kilde)["versjon"], max_retries=max_retries, kilde=kilde)
+    except (HentingFeilet, ValueError) as exc:
+        reserve = _siste_gode.get((navn, kilde))
+        if reserve is None:
+            print(exc)
+            return None
+        print(f"{exc} Viser sist vellykkede data.")
+        return reserve
+    if not df.empty:
+        _siste_gode[(navn, kilde)] = df
+    return df
+
+
+def _med_reserve(navn, hent, max_retries):
+    """Datasettet fra alle kildene. En kilde som feiler bidrar med sist vellykkede data."""
+    deler = [df for df in _per_kilde(lambda kilde: _fra_kilde(navn, hent, max_retries, kilde)).values() if df is not None]
+    if not deler:
+        return pd.DataFrame(columns=_RAD_KOLONNER)
+    if len(deler) == 1:
+        return deler[0]
+
+    versjon = "+".join(dataversjon(df) for df in deler)
+    forrige = _sammenslatt.get(navn)
+    if forrige is not None and forrige[0] == versjon:
+        return forrige[1]
+    df = pd.concat(deler, ignore_index=True)
+    df.attrs["dataversjon"] = f"{navn}:{versjon}"
+    _sammenslatt[navn] = (versjon, df)
+    return df
 
 
-@st.cache_data(ttl=3600, max_entries=1, show_spinner=False)
 def hent_fullt_register(max_retries=3):
     """Returnerer kun aggregerte event-rader for eksisterende analyser og grafer."""
-    data = _hent_api_payload(max_retries=max_retries)
-    df = _normaliser_payload(data)
-    if df.empty:
-        print("API-et svarte, men parseren fant ingen gyldige aggregerte rader.")
-    return df
+    return _med_reserve("register", _hent_fullt_register, max_retries)
 
 
-@st.cache_data(ttl=3600, max_entries=1, show_spinner=False)
 def hent_posisjonsholdere(max_retries=3):
     """Returnerer individuelle offentlige shortposisjoner fra activePositions."""
-    data = _hent_api_payload(max_retries=max_retries)
-    df = _normaliser_posisjonsholdere(data)
-    if df.empty:
-        print("Ingen individuelle posisjonsholdere ble funnet i activePositions.")
-    return df
+    return _med_reserve("holdere", _hent_posisjonsholdere, max_retries)
+
 
+def tving_ny_nedlasting(max_retries=3):
+    """
+    Henter registeret på nytt for alle brukere, fra alle kildene parallelt.
+
+    Samtidige kall deler én nedlasting per kilde: den som kommer først laster
+    ned, de andre venter og får samme resultat. En ny nedlasting startes
+    tidligst MIN_SEKUNDER_MELLOM_OPPDATERINGER etter forrige vellykkede.
+    Cachene byttes først når den nye payloaden er validert, ellers beholdes
+    dataene som allerede vises.
 
-def tving_ny_nedlasting():
-    """Tømmer delte API-cacher. Neste kall laster data på nytt."""
-    _hent_api_payload.clear()
-    hent_fullt_register.clear()
-    hent_posisjonsholdere.clear()
+    Med delt lager gjelder det samme på tvers av replikaene: nedlastingen
+    skjer under en fillås, og de andre leser den publiserte versjonen.
+
+    Returnerer "oppdatert" hvis minst én kilde ble oppdatert, ellers
+    "for_tidlig" eller "feilet".
+    """
+    tving = _tving_kilde_delt if ssr_delt.aktiv() else _tving_kilde
+    statuser = _per_kilde(lambda kilde: tving(kilde, max_retries)).values()
+    for status in ("oppdatert", "feilet"):
+        if status in statuser:
+            break
+    else:
+        status = "for_tidlig"
+    if status == "oppdatert":
+        hent_fullt_register(max_retries=max_retries)
+        hent_posisjonsholdere(max_retries=max_retries)
+    return status
+
+
+def _tving_kilde(kilde, max_retries=3):
+    oppdatering = _oppdatering(kilde)
+    bestilt = time.monotonic()
+    with oppdatering["lock"]:
+        if oppdatering["fullfort"] > bestilt:
+            # En annen bruker fullførte en nedlasting mens vi ventet på låsen.
+            return oppdatering["status"]
+        # Bare en vellykket nedlasting teller; etter en feil kan man prøve igjen med en gang.
+        oppdatert = oppdatering["oppdatert"]
+        if oppdatert and bestilt - oppdatert < MIN_SEKUNDER_MELLOM_OPPDATERINGER:
+            return "for_tidlig"
+
+        try:
+            data, register, holdere = _last_ned_og_valider(max_retries=max_retries, kilde=kilde)
+        except Exception as exc:
+            print(f"Tvungen oppdatering av {ssr_kilder.tittel(kilde)} feilet, beholder eksisterende data: {exc}")
+            status = "feilet"
+        else:
+            versjon = oppdatering["versjon"] + 1
+            oppdatering["klargjort"] = {
+                "versjon": versjon,
+                "payload": data,
+                "register": register,
+                "holdere": holdere,
+            }
+            oppdatering["versjon"] = versjon
+            # Fyll cachene for den nye versjonen før noen ber om dem.
+            _hent_api_payload(versjon, max_retries=max_retries, kilde=kilde)
+            _hent_fullt_register(versjon, max_retries=max_retries, kilde=kilde)
+            _hent_posisjonsholdere(versjon, max_retries=max_retries, kilde=kilde)
+            oppdatering["klargjort"] = {}
+            status = "oppdatert"
+
+        oppdatering["status"] = status
+        oppdatering["fullfort"] = time.monotonic()
+        if status == "oppdatert":
+            oppdatering["oppdatert"] = oppdatering["fullfort"]
+        return status
+
+
+def _tving_kilde_delt(kilde, max_retries=3):
+    bestilt = time.time()
+    gruppe = _delt_gruppe(kilde)
+    with ssr_delt.eksklusiv(gruppe):
+        peker = ssr_delt.les_peker(gruppe)
+        if peker is not None:
+            if peker["publisert"] > bestilt:
+                # En annen replika publiserte mens vi ventet på låsen.
+                return "oppdatert"
+            if bestilt - peker["publisert"] < MIN_SEKUNDER_MELLOM_OPPDATERINGER:
+                return "for_tidlig"
+        try:
+            _, register, holdere = _last_ned_og_valider(max_retries=max_retries, kilde=kilde)
+        except Exception as exc:
+            print(f"Tvungen oppdatering av {ssr_kilder.tittel(kilde)} feilet, beholder eksisterende data: {exc}")
+            return "feilet"
+        ssr_delt.publiser(gruppe, {"register": register, "holdere": holdere})
+    _api_fra_delt_lager(max_retries=max_retries, kilde=kilde)
+    return "oppdatert"
 
 
 def _connect(db_path=DB_PATH):
@@ -255,99 +641,1238 @@ def _ensure_schema(conn):
     conn.execute(
         "CREATE INDEX IF NOT EXISTS idx_short_isin ON short_positions (isin)"
     )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_short_issuer_holder_date "
+        "ON short_positions (issuerName, positionHolder, date)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS holder_snapshot (
+            issuerName TEXT,
+            positionHolder TEXT,
+            isin TEXT,
+            date TEXT,
+            shortPercent REAL,
+            shares REAL,
+            PRIMARY KEY (issuerName, positionHolder)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS position_events (
+            event_date TEXT,
+            detected_at TEXT,
+            issuerName TEXT,
+            isin TEXT,
+            positionHolder TEXT,
+            event_type TEXT,
+            previous_percent REAL,
+            new_percent REAL,
+            previous_shares REAL,
+            new_shares REAL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_date ON position_events (event_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_issuer_date ON position_events (issuerName, event_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_holder_date ON position_events (positionHolder, event_date)")
+    conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+    _ensure_varsel_schema(conn)
+    kolonner = {rad[1] for rad in conn.execute("PRAGMA table_info(short_positions)")}
+    if "valid_to" not in kolonner:
+        conn.execute("ALTER TABLE short_positions ADD COLUMN valid_to TEXT")
+    if "source" not in kolonner:
+        # Eksisterende rader er hentet fra Finanstilsynet og får det som standardverdi.
+        conn.execute(
+            f"ALTER TABLE short_positions ADD COLUMN source TEXT NOT NULL DEFAULT '{ssr_kilder.STANDARDKILDE}'"
+        )
     conn.commit()
 
 
-@st.cache_data(ttl=300, max_entries=1, show_spinner=False)
-def hent_database_data(db_path=DB_PATH):
+def _kjor_skrivejobb(db_path, jobb):
+    conn = _connect(db_path)
+    try:
+        _ensure_schema(conn)
+        _skjema_klart.add(Path(db_path).resolve())
+        return jobb(conn)
+    finally:
+        conn.close()
+
+
+def _skriv(db_path, jobb):
+    """
+    Kjører jobb(conn) i skrivetråden og returnerer resultatet. Skrivingene
+    serialiseres der, mens lesere aldri venter på en lang lagring.
+    """
+    if threading.current_thread().name.startswith("ssr-skriver"):
+        return _kjor_skrivejobb(db_path, jobb)
+    return _SKRIVER.submit(_kjor_skrivejobb, db_path, jobb).result()
+
+
+@contextmanager
+def _leser(db_path=DB_PATH):
+    """Skrivebeskyttet forbindelse. Skjemaet opprettes først, via skrivetråden."""
+    sti = Path(db_path).resolve()
+    if sti not in _skjema_klart or not sti.exists():
+        _skriv(db_path, lambda conn: None)
+    conn = sqlite3.connect(f"{sti.as_uri()}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+    try:
+        conn.execute("PRAGMA busy_timeout=30000")
+        yield conn
+    finally:
+        conn.close()
+
+
+def _utvid_perioder(df):
+    """
+    Gjør komprimerte perioder om til vanlige rader: én rad på startdatoen og
+    én på valid_to. Rader uten valid_to (vanlig lagring) er uendret.
+
+    Dagene inne i en periode blir ikke fylt ut. Snitt og antall per dato over
+    historikken (f.eks. Topp 10 for en periode) teller derfor hver periode med
+    høyst to observasjoner i en kompakt database, ikke én per observert dag.
+    """
+    slutt = df["valid_to"].notna() & df["valid_to"].ne(df["date"])
+    if slutt.any():
+        ekstra = df.loc[slutt].assign(date=df.loc[slutt, "valid_to"])
+        df = pd.concat([df, ekstra]).sort_index(kind="stable")
+    return df.drop(columns="valid_to").reset_index(drop=True)
+
+
+def _les_rader(conn):
+    return _utvid_perioder(
+        pd.read_sql_query(
+            "SELECT isin, issuerName, positionHolder, date, shortPercent, shares, source, valid_to FROM short_positions",
+            conn,
+        )
+    )
+
+
+def _les_historikk(db_path):
+    with ssr_ytelse.spenn("sqlite:les_historikk") as maling, _leser(db_path) as conn:
+        df = _les_rader(conn)
+        siste_logg = conn.execute("SELECT MAX(rowid) FROM updates_log").fetchone()[0]
+        maling["rader"] = len(df)
+    df.attrs["dataversjon"] = f"db:{siste_logg}:{len(df)}"
+    return df
+
+
+@ssr_ytelse.cache_data(ttl=300, max_entries=1, show_spinner=False)
+def _hent_database_data(db_path=DB_PATH):
     """Leser SQLite-data én gang per fem minutter, delt mellom brukerne."""
     try:
-        with _DB_LOCK:
-            conn = _connect(db_path)
-            _ensure_schema(conn)
-            df = pd.read_sql_query(
-                "SELECT isin, issuerName, positionHolder, date, shortPercent, shares FROM short_positions",
-                conn,
+        return _les_historikk(db_path)
+    except Exception as exc:
+        print(f"Feil ved lesing av database: {exc}")
+        return pd.DataFrame(columns=_RAD_KOLONNER)
+
+
+def _historikk_fra_delt_lager(db_path):
+    """
+    Historikken fra det delte lageret. Versjonen er siste rad i updates_log,
+    så en lagring fra hvilken som helst replika gjør den publiserte filen ugyldig.
+    """
+    try:
+        with _leser(db_path) as conn:
+            siste_logg = conn.execute("SELECT MAX(rowid) FROM updates_log").fetchone()[0]
+        gruppe = ssr_delt.gruppenavn("historikk", Path(db_path).resolve())
+        with ssr_ytelse.spenn("delt:historikk"):
+            frames = ssr_delt.hent(
+                gruppe,
+                lambda: {"historikk": _les_historikk(db_path)},
+                versjon=f"db{siste_logg or 0}",
             )
-            conn.close()
-        return df
+        return frames["historikk"]
     except Exception as exc:
         print(f"Feil ved lesing av database: {exc}")
-        return pd.DataFrame(columns=["isin", "issuerName", "positionHolder", "date", "shortPercent", "shares"])
+        return pd.DataFrame(columns=_RAD_KOLONNER)
+
+
+def hent_database_data(db_path=DB_PATH):
+    """Historikken fra SQLite, delt mellom brukerne (og replikaene med delt lager)."""
+    if ssr_delt.aktiv():
+        return _historikk_fra_delt_lager(db_path)
+    return _hent_database_data(db_path)
 
 
 def _clear_database_cache():
-    hent_database_data.clear()
+    _hent_database_data.clear()
+
+
+_RAD_KOLONNER = ["isin", "issuerName", "positionHolder", "date", "shortPercent", "shares", "source"]
+
+
+def _klargjor_rader(df):
+    mangler = {column: None for column in _RAD_KOLONNER if column not in df.columns}
+    df = df.assign(**mangler)
+    return df.assign(source=df["source"].fillna(ssr_kilder.STANDARDKILDE))[_RAD_KOLONNER].drop_duplicates()
+
+
+def _sammenligningsform(df):
+    """
+    Tekst som streng med tom streng for manglende verdier, og tall som float,
+    slik at rader lest fra SQLite og rader fra API-et sammenlignes likt.
+    """
+    form = pd.DataFrame(index=df.index)
+    for column in ["isin", "issuerName", "positionHolder", "date"]:
+        form[column] = df[column].fillna("").astype(str)
+    form["source"] = df["source"].fillna(ssr_kilder.STANDARDKILDE).astype(str)
+    for column in ["shortPercent", "shares"]:
+        form[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+    return form
+
+
+def _radnokler(df):
+    """Én hash per rad for deduplisering."""
+    return pd.util.hash_pandas_object(_sammenligningsform(df), index=False)
+
+
+def _bare_nye_rader(clean, kjente):
+    """Radene i clean som ikke finnes i settet kjente. De nye nøklene legges til i settet."""
+    nokler = _radnokler(clean).tolist()
+    nye = [nokkel not in kjente for nokkel in nokler]
+    kjente.update(nokler)
+    return clean.loc[nye]
+
+
+def _les_radnokler(conn):
+    return set(_radnokler(_les_rader(conn)).tolist())
+
+
+def _sett_inn_rader(conn, df):
+    kolonner = list(df.columns)
+    verdier = df.astype(object).where(df.notna(), None)
+    conn.executemany(
+        f"INSERT INTO short_positions ({', '.join(kolonner)}) VALUES ({', '.join('?' * len(kolonner))})",
+        verdier.itertuples(index=False, name=None),
+    )
+
+
+_NOKKEL = ["source", "isin", "issuerName", "positionHolder"]
+_VERDIER = ["shortPercent", "shares"]
+
+
+def _kompakter_rader(df):
+    """
+    Slår sammen påfølgende observasjoner med samme shortPercent og shares per
+    selskap og posisjonsholder til én periode fra date til valid_to.
+    """
+    valid_to = df["valid_to"] if "valid_to" in df.columns else pd.Series(None, index=df.index, dtype=object)
+    data = df.assign(valid_to=valid_to.fillna(df["date"]))
+    if data.empty:
+        return data[_RAD_KOLONNER + ["valid_to"]]
+
+    form = _sammenligningsform(data).sort_values(_NOKKEL + ["date"] + _VERDIER, kind="stable")
+    data = data.loc[form.index]
+
+    ny_nokkel = form[_NOKKEL].ne(form[_NOKKEL].shift()).any(axis=1)
+    verdier = form[_VERDIER]
+    forrige = verdier.shift()
+    ny_verdi = ~(verdier.eq(forrige) | (verdier.isna() & forrige.isna())).all(axis=1)
+    periode = (ny_nokkel | ny_verdi).cumsum().to_numpy()
+
+    perioder = data.loc[~pd.Series(periode).duplicated().to_numpy(), _RAD_KOLONNER]
+    perioder["valid_to"] = data.groupby(periode)["valid_to"].max().to_numpy()
+    return perioder.reset_index(drop=True)
+
+
+def _udekkede_rader(clean, perioder):
+    """Radene i clean som ikke allerede ligger innenfor en lagret periode med samme verdier."""
+    if perioder.empty:
+        return clean
+    venstre = _sammenligningsform(clean).assign(_rad=range(len(clean)))
+    hoyre = _sammenligningsform(perioder).rename(columns={"date": "_fra"})
+    hoyre["_til"] = perioder["valid_to"].fillna(perioder["date"]).astype(str)
+    treff = venstre.merge(hoyre, on=_NOKKEL + _VERDIER)
+    dekket = set(treff.loc[treff["date"].between(treff["_fra"], treff["_til"]), "_rad"])
+    return clean.loc[[rad not in dekket for rad in range(len(clean))]]
+
+
+def _lagringsmodus(conn):
+    """
+    SHORTSALG_STORAGE, bortsett fra at en database som først er kompaktert
+    forblir kompakt. Radvis deduplisering ser bare start og slutt på hver
+    periode og ville satt inn radene imellom på nytt.
+    """
+    rad = conn.execute("SELECT value FROM settings WHERE key = 'storage_mode'").fetchone()
+    return "kompakt" if rad is not None and rad[0] == "kompakt" else LAGRINGSMODUS
+
+
+def _merk_kompakt(conn):
+    conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('storage_mode', 'kompakt')")
+
+
+def _lagre_kompakt(conn, clean):
+    """
+    Fletter nye rader inn i de komprimerte periodene. Bare periodene til
+    berørte selskaper og posisjonsholdere leses og skrives på nytt.
+    Returnerer radene som ikke allerede lå innenfor en periode.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS berorte_selskaper (navn TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM berorte_selskaper")
+    conn.executemany(
+        "INSERT OR IGNORE INTO berorte_selskaper (navn) VALUES (?)",
+        [(navn,) for navn in clean["issuerName"].dropna().astype(str).unique()],
+    )
+    eksisterende = pd.read_sql_query(
+        "SELECT rowid AS radid, isin, issuerName, positionHolder, date, shortPercent, shares, source, valid_to "
+        "FROM short_positions WHERE issuerName IN (SELECT navn FROM berorte_selskaper)",
+        conn,
+    )
+
+    nye = _udekkede_rader(clean, eksisterende)
+    if nye.empty:
+        return nye
+
+    nye_nokler = set(pd.util.hash_pandas_object(_sammenligningsform(nye)[_NOKKEL], index=False))
+    berort = pd.util.hash_pandas_object(_sammenligningsform(eksisterende)[_NOKKEL], index=False).isin(nye_nokler)
+    gamle = eksisterende.loc[berort.to_numpy()]
+    rader = nye if gamle.empty else pd.concat([gamle.drop(columns="radid"), nye], ignore_index=True)
+    perioder = _kompakter_rader(rader)
+
+    conn.executemany("DELETE FROM short_positions WHERE rowid = ?", [(int(r),) for r in gamle["radid"]])
+    _sett_inn_rader(conn, perioder)
+    return nye
 
 
 def lagre_i_database(df, db_path=DB_PATH):
     """Lagrer bare nye rader. Skriving serialiseres for å unngå SQLite-låsing."""
+    return len(_lagre_nye_rader(df, db_path))
+
+
+def _lagre_nye_rader(df, db_path=DB_PATH):
+    """Som lagre_i_database, men returnerer radene som faktisk var nye."""
     if df is None or df.empty:
-        return 0
+        return pd.DataFrame(columns=_RAD_KOLONNER)
 
-    columns = ["isin", "issuerName", "positionHolder", "date", "shortPercent", "shares"]
-    clean = df.copy()
-    for column in columns:
-        if column not in clean.columns:
-            clean[column] = None
-    clean = clean[columns].drop_duplicates()
+    clean = _klargjor_rader(df)
 
-    with _DB_LOCK:
-        conn = _connect(db_path)
-        _ensure_schema(conn)
-        try:
-            existing = pd.read_sql_query(
-                "SELECT isin, issuerName, positionHolder, date, shortPercent, shares FROM short_positions",
-                conn,
-            )
+    def skriv(conn):
+        if _lagringsmodus(conn) == "kompakt":
+            nye = _lagre_kompakt(conn, clean)
+            _merk_kompakt(conn)
+        else:
+            nye = _bare_nye_rader(clean, _les_radnokler(conn))
+            if not nye.empty:
+                nye.to_sql("short_positions", conn, if_exists="append", index=False, method="multi", chunksize=1000)
 
-            compare_cols = columns
-            left = clean.copy()
-            right = existing.copy()
-            for column in ["isin", "issuerName", "positionHolder", "date"]:
-                left[column] = left[column].fillna("").astype(str)
-                right[column] = right[column].fillna("").astype(str)
-            for column in ["shortPercent", "shares"]:
-                left[column] = pd.to_numeric(left[column], errors="coerce")
-                right[column] = pd.to_numeric(right[column], errors="coerce")
-
-            if not right.empty:
-                marker = right.drop_duplicates(compare_cols)
-                merged = left.merge(marker, on=compare_cols, how="left", indicator=True)
-                new_mask = merged["_merge"].eq("left_only").to_numpy()
-                clean = clean.loc[new_mask].copy()
-
-            if clean.empty:
-                new_rows = 0
-            else:
-                clean.to_sql("short_positions", conn, if_exists="append", index=False, method="multi", chunksize=1000)
-                new_rows = len(clean)
-
-            pd.DataFrame(
-                [{
-                    "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "new_rows": int(new_rows),
-                }]
-            ).to_sql("updates_log", conn, if_exists="append", index=False)
-            conn.commit()
-        finally:
-            conn.close()
+        pd.DataFrame(
+            [{
+                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "new_rows": int(len(nye)),
+            }]
+        ).to_sql("updates_log", conn, if_exists="append", index=False)
+        conn.commit()
+        return nye
+
+    with ssr_ytelse.spenn("sqlite:lagre", rader_inn=len(clean)):
+        clean = _skriv(db_path, skriv)
 
     _clear_database_cache()
-    return int(new_rows)
+    return clean
+
+
+def _normaliser_fil(sti):
+    """Leser og normaliserer én arkivert export-json-fil. Kjøres i en egen prosess."""
+    try:
+        apne = gzip.open if sti.endswith(".gz") else open
+        with apne(sti, "rb") as fil:
+            data = json.load(fil)
+        return _normaliser_payload(data), None
+    except Exception as exc:
+        return None, str(exc)
+
+
+def _skriv_backfill(conn, ventende, kompakt=False):
+    """
+    Skriver nye rader og ferdige filer i én transaksjon, slik at en avbrutt
+    kjøring kan fortsette. I en kompakt database flettes radene inn i periodene.
+    """
+    nye = pd.concat([rader for _, _, rader in ventende], ignore_index=True)
+    tidspunkt = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with conn:
+        if kompakt:
+            nye = _lagre_kompakt(conn, nye)
+            _merk_kompakt(conn)
+        else:
+            _sett_inn_rader(conn, nye)
+        conn.executemany(
+            "INSERT OR REPLACE INTO backfill_files (filename, rows_read, new_rows, timestamp) VALUES (?, ?, ?, ?)",
+            [(navn, lest, len(rader), tidspunkt) for navn, lest, rader in ventende],
+        )
+        conn.execute("INSERT INTO updates_log (timestamp, new_rows) VALUES (?, ?)", (tidspunkt, len(nye)))
+    return len(nye)
+
+
+def backfill(katalog, db_path=DB_PATH, arbeidere=None, batch_rader=200_000):
+    """
+    Leser inn arkiverte export-json-filer (.json eller .json.gz) fra katalog.
+
+    Filene normaliseres parallelt i en prosesspool, mens denne prosessen er
+    eneste skriver. Filene behandles i navnerekkefølge og dedupliseres som om
+    lagre_i_database var kalt for hver fil. Ferdige filer føres i
+    backfill_files, så en ny kjøring hopper over dem.
+    """
+    filer = sorted(p for p in Path(katalog).iterdir() if p.name.endswith((".json", ".json.gz")))
+    conn = _connect(db_path)
+    _ensure_schema(conn)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backfill_files (
+            filename TEXT PRIMARY KEY,
+            rows_read INTEGER,
+            new_rows INTEGER,
+            timestamp TEXT
+        )
+        """
+    )
+    ferdige = {rad[0] for rad in conn.execute("SELECT filename FROM backfill_files")}
+    gjenstaende = [p for p in filer if p.name not in ferdige]
+    kjente = _les_radnokler(conn)
+    # I en kompaktert database ligger de fleste observasjonene inne i en periode.
+    kompakt = _lagringsmodus(conn) == "kompakt"
+    perioder = (
+        pd.read_sql_query(
+            "SELECT isin, issuerName, positionHolder, date, shortPercent, shares, source, valid_to FROM short_positions",
+            conn,
+        )
+        if kompakt
+        else None
+    )
+
+    resultat = {"filer": 0, "hoppet_over": len(filer) - len(gjenstaende), "feilet": [], "rader_lest": 0, "nye_rader": 0}
+    start = time.perf_counter()
+    ventende = []
+    ventende_rader = 0
+
+    def skriv():
+        nonlocal ventende, ventende_rader
+        if ventende:
+            resultat["nye_rader"] += _skriv_backfill(conn, ventende, kompakt)
+            resultat["filer"] += len(ventende)
+            sekunder = time.perf_counter() - start
+            print(
+                json.dumps(
+                    {
+                        "backfill_filer": resultat["filer"],
+                        "nye_rader": resultat["nye_rader"],
+                        "rader_per_sekund": round(resultat["rader_lest"] / sekunder, 1),
+                    }
+                ),
+                flush=True,
+            )
+        ventende, ventende_rader = [], 0
+
+    try:
+        with ProcessPoolExecutor(max_workers=arbeidere) as pool:
+            for sti, (df, feil) in zip(gjenstaende, pool.map(_normaliser_fil, map(str, gjenstaende))):
+                if feil is not None:
+                    print(f"Hopper over {sti.name}: {feil}")
+                    resultat["feilet"].append(sti.name)
+                    continue
+                resultat["rader_lest"] += len(df)
+                nye = _klargjor_rader(df)
+                if perioder is not None:
+                    nye = _udekkede_rader(nye, perioder)
+                nye = _bare_nye_rader(nye, kjente)
+                ventende.append((sti.name, len(df), nye))
+                ventende_rader += len(nye)
+                if ventende_rader >= batch_rader:
+                    skriv()
+            skriv()
+    finally:
+        conn.close()
+
+    sekunder = time.perf_counter() - start
+    resultat["sekunder"] = round(sekunder, 2)
+    resultat["filer_per_sekund"] = round(resultat["filer"] / sekunder, 2) if sekunder else 0.0
+    resultat["rader_per_sekund"] = round(resultat["rader_lest"] / sekunder, 1) if sekunder else 0.0
+    return resultat
+
+
+HENDELSE_KOLONNER = [
+    "event_date",
+    "detected_at",
+    "issuerName",
+    "isin",
+    "positionHolder",
+    "event_type",
+    "previous_percent",
+    "new_percent",
+    "previous_shares",
+    "new_shares",
+]
+
+
+def _gjeldende_posisjoner(df_holders):
+    """
+    Posisjonene i hvert selskaps siste event, én per posisjonsholder. En
+    holder som har falt ut av activePositions, er ikke lenger med. Datasett
+    uten latestEvent (eldre cacher) faller tilbake på siste rad per holder.
+    """
+    if "latestEvent" in df_holders.columns:
+        df_holders = df_holders.loc[df_holders["latestEvent"].fillna(False).astype(bool)]
+    data = df_holders[["issuerName", "positionHolder", "isin", "date", "shortPercent", "shares"]].assign(
+        shortPercent=lambda d: pd.to_numeric(d["shortPercent"], errors="coerce"),
+        shares=lambda d: pd.to_numeric(d["shares"], errors="coerce"),
+    )
+    data = data.dropna(subset=["issuerName", "positionHolder", "date", "shortPercent"])
+    return (
+        data.sort_values("date", kind="stable")
+        .groupby(["issuerName", "positionHolder"], as_index=False)
+        .tail(1)
+        .reset_index(drop=True)
+    )
+
+
+def _posisjonsoverganger(forrige, naa, oppdaget):
+    """
+    Sammenligner forrige og nåværende posisjoner per selskap og holder.
+    En posisjon er åpen når den er på eller over publiseringsterskelen.
+    """
+    sammen = forrige.merge(
+        naa, on=["issuerName", "positionHolder"], how="outer", suffixes=("_forrige", "")
+    )
+    for_pct = sammen["shortPercent_forrige"].round(6)
+    naa_pct = sammen["shortPercent"].round(6)
+    apen_for = for_pct.ge(PUBLISERINGSTERSKEL).to_numpy()
+    apen_naa = naa_pct.ge(PUBLISERINGSTERSKEL).to_numpy()
+    begge = apen_for & apen_naa
+    sammen["event_type"] = np.select(
+        [
+            ~apen_for & apen_naa,
+            apen_for & ~apen_naa,
+            begge & (naa_pct > for_pct).to_numpy(),
+            begge & (naa_pct < for_pct).to_numpy(),
+        ],
+        ["opened", "closed", "increased", "reduced"],
+        default="",
+    )
+    # En posisjon som har forsvunnet fra registeret, lukkes den dagen vi oppdager det.
+    hendelser = sammen.loc[sammen["event_type"] != ""].assign(
+        event_date=lambda d: d["date"].fillna(oppdaget[:10]),
+        isin=lambda d: d["isin"].fillna(d["isin_forrige"]),
+        detected_at=oppdaget,
+    )
+    hendelser = hendelser.rename(
+        columns={
+            "shortPercent_forrige": "previous_percent",
+            "shortPercent": "new_percent",
+            "shares_forrige": "previous_shares",
+            "shares": "new_shares",
+        }
+    )
+    return hendelser[HENDELSE_KOLONNER].sort_values(["event_date", "issuerName", "positionHolder"])
+
+
+def registrer_posisjonshendelser(df_holders, db_path=DB_PATH):
+    """
+    Finner åpnede, økte, reduserte og lukkede posisjoner siden forrige lagring
+    og fører dem i position_events. Bare gjeldende posisjoner sammenlignes,
+    mot øyeblikksbildet i holder_snapshot, ikke hele historikken.
+
+    Første gang lagres bare øyeblikksbildet, så eksisterende posisjoner ikke
+    registreres som nye. Returnerer antall hendelser.
+    """
+    return len(_registrer_posisjonshendelser(df_holders, db_path))
+
+
+def _registrer_posisjonshendelser(df_holders, db_path=DB_PATH):
+    if df_holders is None or df_holders.empty:
+        return pd.DataFrame(columns=HENDELSE_KOLONNER)
+
+    naa = _gjeldende_posisjoner(df_holders)
+    oppdaget = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def skriv(conn):
+        forrige = pd.read_sql_query(
+            "SELECT issuerName, positionHolder, isin, date, shortPercent, shares FROM holder_snapshot",
+            conn,
+        )
+        if forrige.empty:
+            hendelser = pd.DataFrame(columns=HENDELSE_KOLONNER)
+        else:
+            hendelser = _posisjonsoverganger(forrige, naa, oppdaget)
+
+        with conn:
+            if not hendelser.empty:
+                verdier = hendelser.astype(object).where(hendelser.notna(), None)
+                conn.executemany(
+                    f"INSERT INTO position_events ({', '.join(HENDELSE_KOLONNER)}) "
+                    f"VALUES ({', '.join('?' * len(HENDELSE_KOLONNER))})",
+                    verdier.itertuples(index=False, name=None),
+                )
+            conn.execute("DELETE FROM holder_snapshot")
+            conn.executemany(
+                "INSERT INTO holder_snapshot (issuerName, positionHolder, isin, date, shortPercent, shares) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                naa.astype(object).where(naa.notna(), None).itertuples(index=False, name=None),
+            )
+        return hendelser
+
+    with ssr_ytelse.spenn("sqlite:posisjonshendelser", posisjoner=len(naa)) as maling:
+        hendelser = _skriv(db_path, skriv)
+        maling["hendelser"] = len(hendelser)
+
+    return hendelser
+
+
+VARSEL_FIL = os.environ.get("SHORTSALG_ALERT_FILE")
+# Regeltyper: selskapets samlede shortandel krysser terskelen oppover eller
+# nedover, eller en posisjonsholder åpner eller lukker en posisjon.
+VARSELTYPER = ("over", "under", "apnet", "lukket")
+_HENDELSE_FOR_REGEL = {"apnet": "opened", "lukket": "closed"}
+
+
+def _ensure_varsel_schema(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS watch_rules (
+            id INTEGER PRIMARY KEY,
+            rule_type TEXT NOT NULL,
+            issuerName TEXT,
+            positionHolder TEXT,
+            threshold REAL,
+            note TEXT,
+            active INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS alert_outbox (
+            id INTEGER PRIMARY KEY,
+            rule_id INTEGER,
+            fired_at TEXT,
+            event_date TEXT,
+            rule_type TEXT,
+            issuerName TEXT,
+            positionHolder TEXT,
+            threshold REAL,
+            previous_percent REAL,
+            new_percent REAL,
+            message TEXT,
+            delivered INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS issuer_levels (
+            issuerName TEXT PRIMARY KEY,
+            date TEXT,
+            shortPercent REAL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rules_issuer ON watch_rules (issuerName)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rules_holder ON watch_rules (positionHolder)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_fired ON alert_outbox (fired_at)")
+
+
+def _midlertidige_navn(conn, tabell, navn):
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {tabell} (navn TEXT PRIMARY KEY)")
+    conn.execute(f"DELETE FROM {tabell}")
+    conn.executemany(f"INSERT OR IGNORE INTO {tabell} (navn) VALUES (?)", [(str(n),) for n in navn])
+
+
+def _nivaer_fra_historikk(conn, navn, nye_rader):
+    """
+    Siste samlede shortandel i short_positions for selskapene i navn, uten
+    radene fra denne lagringen. Brukes for selskaper som mangler i
+    issuer_levels, f.eks. første gang eller etter backfill.
+    """
+    _midlertidige_navn(conn, "varsel_uten_niva", navn)
+    rader = _utvid_perioder(
+        pd.read_sql_query(
+            "SELECT isin, issuerName, positionHolder, date, shortPercent, shares, source, valid_to "
+            "FROM short_positions WHERE issuerName IN (SELECT navn FROM varsel_uten_niva)",
+            conn,
+        )
+    )
+    rader = rader.loc[~_radnokler(rader).isin(set(_radnokler(_klargjor_rader(nye_rader)))).to_numpy()]
+    siste = hent_siste_posisjon_per_selskap(rader)
+    if siste.empty:
+        return pd.DataFrame(columns=["issuerName", "forrige_dato", "previous_percent"])
+    return pd.DataFrame(
+        {
+            "issuerName": siste["issuerName"],
+            "forrige_dato": siste["date"].dt.strftime("%Y-%m-%d"),
+            "previous_percent": siste["shortPercent"],
+        }
+    )
+
+
+def _endrede_nivaer(conn, nye_rader):
+    """
+    Ny og forrige samlede shortandel for selskapene som fikk nye rader.
+    issuer_levels holder siste kjente nivå; bare selskaper som mangler der
+    slås opp i historikken. Selskaper uten tidligere nivå er nye i registeret
+    og regnes fra 0, som i finn_nye_shortposisjoner. Unntaket er første
+    lagring i en tom database, der alle selskapene ville vært nye.
+    """
+    tom = pd.DataFrame(columns=["issuerName", "date", "previous_percent", "new_percent"])
+    siste = hent_siste_posisjon_per_selskap(nye_rader)
+    if siste.empty:
+        return tom
+    siste = siste.assign(date=siste["date"].dt.strftime("%Y-%m-%d")).rename(columns={"shortPercent": "new_percent"})
+
+    _midlertidige_navn(conn, "varsel_selskaper", siste["issuerName"])
+    forrige = pd.read_sql_query(
+        "SELECT issuerName, date AS forrige_dato, shortPercent AS previous_percent FROM issuer_levels "
+        "WHERE issuerName IN (SELECT navn FROM varsel_selskaper)",
+        conn,
+    )
+    mangler = siste.loc[~siste["issuerName"].isin(forrige["issuerName"]), "issuerName"]
+    if not mangler.empty:
+        fra_historikk = _nivaer_fra_historikk(conn, mangler, nye_rader)
+        if not fra_historikk.empty:
+            forrige = pd.concat([forrige, fra_historikk], ignore_index=True) if not forrige.empty else fra_historikk
+
+    forste_lagring = forrige.empty and conn.execute(
+        "SELECT 1 FROM short_positions WHERE issuerName NOT IN (SELECT navn FROM varsel_selskaper) LIMIT 1"
+    ).fetchone() is None
+
+    endret = siste.merge(forrige, on="issuerName", how="left")
+    endret = endret.loc[endret["forrige_dato"].isna() | (endret["date"] >= endret["forrige_dato"])]
+    conn.executemany(
+        "INSERT OR REPLACE INTO issuer_levels (issuerName, date, shortPercent) VALUES (?, ?, ?)",
+        endret[["issuerName", "date", "new_percent"]].itertuples(index=False, name=None),
+    )
+    if forste_lagring:
+        return tom
+    return endret.assign(previous_percent=endret["previous_percent"].astype(float).fillna(0.0))[tom.columns]
+
+
+def _nivaavarsler(conn, nivaer):
+    if nivaer.empty:
+        return pd.DataFrame()
+    regler = pd.read_sql_query(
+        "SELECT id AS rule_id, rule_type, issuerName AS regel_selskap, threshold FROM watch_rules "
+        "WHERE active = 1 AND rule_type IN ('over', 'under') "
+        "AND (issuerName IS NULL OR issuerName IN (SELECT navn FROM varsel_selskaper))",
+        conn,
+    )
+    if regler.empty:
+        return pd.DataFrame()
+    treff = nivaer.merge(regler, how="cross")
+    treff = treff.loc[treff["regel_selskap"].isna() | treff["regel_selskap"].eq(treff["issuerName"])]
+    forrige = treff["previous_percent"].round(6)
+    naa = treff["new_percent"].round(6)
+    over = treff["rule_type"].eq("over") & (forrige < treff["threshold"]) & (naa >= treff["threshold"])
+    under = treff["rule_type"].eq("under") & (forrige >= treff["threshold"]) & (naa < treff["threshold"])
+    treff = treff.loc[over | under].rename(columns={"date": "event_date"})
+    treff["positionHolder"] = None
+    treff["message"] = [
+        f"{rad.issuerName} krysset {rad.threshold:.2f} % {'oppover' if rad.rule_type == 'over' else 'nedover'}: "
+        f"{rad.previous_percent:.2f} % → {rad.new_percent:.2f} %"
+        for rad in treff.itertuples()
+    ]
+    return treff
+
+
+def _hendelsesvarsler(conn, hendelser):
+    hendelser = hendelser.loc[hendelser["event_type"].isin(_HENDELSE_FOR_REGEL.values())]
+    if hendelser.empty:
+        return pd.DataFrame()
+    _midlertidige_navn(conn, "varsel_hendelse_selskaper", hendelser["issuerName"])
+    _midlertidige_navn(conn, "varsel_holdere", hendelser["positionHolder"])
+    regler = pd.read_sql_query(
+        "SELECT id AS rule_id, rule_type, issuerName AS regel_selskap, positionHolder AS regel_holder, threshold "
+        "FROM watch_rules WHERE active = 1 AND rule_type IN ('apnet', 'lukket') "
+        "AND (issuerName IS NULL OR issuerName IN (SELECT navn FROM varsel_hendelse_selskaper)) "
+        "AND (positionHolder IS NULL OR positionHolder IN (SELECT navn FROM varsel_holdere))",
+        conn,
+    )
+    if regler.empty:
+        return pd.DataFrame()
+    regler["event_type"] = regler["rule_type"].map(_HENDELSE_FOR_REGEL)
+    treff = hendelser.merge(regler, on="event_type")
+    treff = treff.loc[
+        (treff["regel_selskap"].isna() | treff["regel_selskap"].eq(treff["issuerName"]))
+        & (treff["regel_holder"].isna() | treff["regel_holder"].eq(treff["positionHolder"]))
+    ]
+    treff["message"] = [
+        f"{rad.positionHolder} {'åpnet' if rad.rule_type == 'apnet' else 'lukket'} posisjon i {rad.issuerName}"
+        for rad in treff.itertuples()
+    ]
+    return treff
+
+
+def evaluer_varsler(nye_rader, hendelser, db_path=DB_PATH):
+    """
+    Sjekker overvåkingsreglene mot radene og hendelsene fra én lagring.
+    Bare regler for berørte selskaper og posisjonsholdere leses, så antall
+    regler har lite å si for tiden. Utløste varsler legges i alert_outbox
+    (og SHORTSALG_ALERT_FILE som JSON-linjer, hvis satt). Returnerer antall.
+    """
+    fyrt = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    kolonner = [
+        "rule_id", "event_date", "rule_type", "issuerName", "positionHolder",
+        "threshold", "previous_percent", "new_percent", "message",
+    ]
+
+    def skriv(conn):
+        with conn:
+            deler = [
+                _nivaavarsler(conn, _endrede_nivaer(conn, nye_rader)),
+                _hendelsesvarsler(conn, hendelser),
+            ]
+            deler = [d[kolonner].astype(object) for d in deler if not d.empty]
+            varsler = pd.concat(deler, ignore_index=True) if deler else pd.DataFrame(columns=kolonner)
+            if not varsler.empty:
+                conn.executemany(
+                    f"INSERT INTO alert_outbox (fired_at, {', '.join(kolonner)}) "
+                    f"VALUES (?, {', '.join('?' * len(kolonner))})",
+                    (
+                        (fyrt, *rad)
+                        for rad in varsler.astype(object).where(varsler.notna(), None).itertuples(
+                            index=False, name=None
+                        )
+                    ),
+                )
+        return varsler
+
+    with ssr_ytelse.spenn("varsler:evaluer", rader=len(nye_rader), hendelser=len(hendelser)) as maling:
+        varsler = _skriv(db_path, skriv)
+        maling["varsler"] = len(varsler)
+
+    if VARSEL_FIL and not varsler.empty:
+        with open(VARSEL_FIL, "a", encoding="utf-8") as fil:
+            for rad in varsler.astype(object).where(varsler.notna(), None).to_dict("records"):
+                fil.write(json.dumps({"fired_at": fyrt, **rad}, ensure_ascii=False) + "\n")
+    return len(varsler)
+
+
+def legg_til_varselregel(rule_type, issuerName=None, positionHolder=None, threshold=None, note=None, db_path=DB_PATH):
+    """Legger til en overvåkingsregel og returnerer id-en."""
+    if rule_type not in VARSELTYPER:
+        raise ValueError(f"Ukjent regeltype {rule_type!r}. Gyldige: {', '.join(VARSELTYPER)}.")
+    if rule_type in ("over", "under") and threshold is None:
+        raise ValueError("Regler for terskler må ha en terskel.")
+
+    def skriv(conn):
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO watch_rules (rule_type, issuerName, positionHolder, threshold, note, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    rule_type,
+                    issuerName or None,
+                    positionHolder or None,
+                    threshold,
+                    note,
+                    datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                ),
+            )
+        return cursor.lastrowid
+
+    return _skriv(db_path, skriv)
+
+
+def slett_varselregel(regel_id, db_path=DB_PATH):
+    def skriv(conn):
+        with conn:
+            conn.execute("DELETE FROM watch_rules WHERE id = ?", (int(regel_id),))
+
+    _skriv(db_path, skriv)
+
+
+def hent_varselregler(db_path=DB_PATH):
+    return _les_tabell(
+        "SELECT id, rule_type, issuerName, positionHolder, threshold, note, created_at "
+        "FROM watch_rules WHERE active = 1 ORDER BY id",
+        db_path,
+    )
+
+
+def hent_varsler(grense=200, db_path=DB_PATH):
+    """Siste utløste varsler, nyeste først."""
+    return _les_tabell(
+        "SELECT id, fired_at, event_date, rule_type, issuerName, positionHolder, threshold, "
+        "previous_percent, new_percent, message FROM alert_outbox ORDER BY id DESC LIMIT ?",
+        db_path,
+        params=(int(grense),),
+    )
+
+
+def _les_tabell(sql, db_path, params=()):
+    try:
+        with _leser(db_path) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+    except Exception as exc:
+        print(f"Feil ved lesing fra databasen: {exc}")
+        return pd.DataFrame()
+
+
+def oppdater_historikk(df_live, df_holders, db_path=DB_PATH):
+    """
+    Lagrer nye registerrader og posisjonsendringer, og sjekker overvåkingsreglene
+    mot akkurat disse. Returnerer (nye rader, hendelser, varsler).
+    """
+    nye_rader = _lagre_nye_rader(df_live, db_path=db_path)
+    hendelser = _registrer_posisjonshendelser(df_holders, db_path=db_path)
+    varsler = evaluer_varsler(nye_rader, hendelser, db_path=db_path)
+    return len(nye_rader), len(hendelser), varsler
+
+
+def siste_hendelsesdato(db_path=DB_PATH):
+    try:
+        with _leser(db_path) as conn:
+            return conn.execute("SELECT MAX(event_date) FROM position_events").fetchone()[0]
+    except Exception as exc:
+        print(f"Feil ved henting av posisjonshendelser: {exc}")
+        return None
+
+
+def hent_posisjonshendelser(fra_dato, til_dato, typer=None, db_path=DB_PATH, grense=5000):
+    """Posisjonshendelser med event_date i intervallet, nyeste først. Leses via indeksen på dato."""
+    sql = f"SELECT {', '.join(HENDELSE_KOLONNER)} FROM position_events WHERE event_date BETWEEN ? AND ?"
+    params = [pd.Timestamp(fra_dato).strftime("%Y-%m-%d"), pd.Timestamp(til_dato).strftime("%Y-%m-%d")]
+    if typer:
+        sql += f" AND event_type IN ({', '.join('?' * len(typer))})"
+        params.extend(typer)
+    sql += " ORDER BY event_date DESC, rowid DESC LIMIT ?"
+    params.append(int(grense))
+    try:
+        with ssr_ytelse.spenn("sqlite:posisjonshendelser_les") as maling, _leser(db_path) as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+            maling["rader"] = len(df)
+        return df
+    except Exception as exc:
+        print(f"Feil ved henting av posisjonshendelser: {exc}")
+        return pd.DataFrame(columns=HENDELSE_KOLONNER)
 
 
 def hent_siste_oppdatering(db_path=DB_PATH):
     try:
-        with _DB_LOCK:
-            conn = _connect(db_path)
-            _ensure_schema(conn)
+        with ssr_ytelse.spenn("sqlite:status"), _leser(db_path) as conn:
             row = conn.execute(
                 "SELECT timestamp FROM updates_log ORDER BY rowid DESC LIMIT 1"
             ).fetchone()
             total = conn.execute("SELECT COUNT(*) FROM short_positions").fetchone()[0]
-            conn.close()
         return (row[0] if row else None), int(total)
     except Exception as exc:
         print(f"Feil ved henting av oppdateringsinfo: {exc}")
         return None, 0
+
+
+# Hopper fra selskap til selskap i indeksen i stedet for å lese hele tabellen,
+# slik at spørringen koster omtrent like mye uansett hvor lang historikken er.
+_SELSKAPER_SQL = """
+    selskap(navn) AS (
+        SELECT MIN(issuerName) FROM short_positions
+        UNION ALL
+        SELECT (SELECT MIN(issuerName) FROM short_positions WHERE issuerName > selskap.navn)
+        FROM selskap WHERE selskap.navn IS NOT NULL
+    )
+"""
+
+_PER_DATO_SELSKAP_SQL = f"""
+    WITH RECURSIVE {_SELSKAPER_SQL}
+    SELECT p.isin, p.issuerName, p.positionHolder, p.date, p.shortPercent, p.shares, p.source
+    FROM selskap
+    JOIN short_positions AS p INDEXED BY idx_short_issuer_date
+      ON p.issuerName = selskap.navn
+     AND p.date = (
+        SELECT MAX(date) FROM short_positions INDEXED BY idx_short_issuer_date
+        WHERE issuerName = selskap.navn AND date <= :dato
+     )
+"""
+
+_PER_DATO_HOLDER_SQL = f"""
+    WITH RECURSIVE {_SELSKAPER_SQL},
+    par(issuer, holder) AS (
+        SELECT navn, (
+            SELECT MIN(positionHolder) FROM short_positions
+            WHERE issuerName = selskap.navn AND positionHolder >= ''
+        )
+        FROM selskap WHERE navn IS NOT NULL
+        UNION ALL
+        SELECT issuer, (
+            SELECT MIN(positionHolder) FROM short_positions
+            WHERE issuerName = par.issuer AND positionHolder > par.holder
+        )
+        FROM par WHERE holder IS NOT NULL
+    )
+    SELECT p.isin, p.issuerName, p.positionHolder, p.date, p.shortPercent, p.shares, p.source
+    FROM par
+    JOIN short_positions AS p ON p.rowid = (
+        SELECT rowid FROM short_positions INDEXED BY idx_short_issuer_holder_date
+        WHERE issuerName = par.issuer AND positionHolder = par.holder AND date <= :dato
+        ORDER BY date DESC, rowid DESC LIMIT 1
+    )
+    WHERE par.holder IS NOT NULL
+"""
+
+
+def hent_register_per_dato(dato, per_holder=False, db_path=DB_PATH):
+    """
+    Registeret slik det så ut på en gitt dato: siste registrering på eller før
+    datoen for hvert selskap, eller for hvert selskap og posisjonsholder.
+
+    Per selskap aggregeres radene på siste dato som i _agg_issuer_date, slik at
+    resultatet for dagens dato er det samme som hent_siste_posisjon_per_selskap.
+    """
+    dato = pd.Timestamp(dato).strftime("%Y-%m-%d")
+    try:
+        with ssr_ytelse.spenn("sqlite:per_dato", per_holder=per_holder) as maling, _leser(db_path) as conn:
+            df = pd.read_sql_query(
+                _PER_DATO_HOLDER_SQL if per_holder else _PER_DATO_SELSKAP_SQL,
+                conn,
+                params={"dato": dato},
+            )
+            maling["rader"] = len(df)
+    except Exception as exc:
+        print(f"Feil ved oppslag per dato: {exc}")
+        df = pd.DataFrame(columns=_RAD_KOLONNER)
+
+    if per_holder:
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        return df.sort_values(["issuerName", "shortPercent"], ascending=[True, False], ignore_index=True)
+    return hent_siste_posisjon_per_selskap(df)
+
+
+@ssr_ytelse.cache_data(ttl=3600, max_entries=4, show_spinner=False)
+def _beregn_analyser(versjon, _df):
+    return {
+        "siste_per_selskap": hent_siste_posisjon_per_selskap(_df),
+        "endringer": beregn_storste_endringer(_df),
+        "nye_posisjoner": finn_nye_shortposisjoner(_df),
+    }
+
+
+def hent_analyser(df):
+    """Nøkkeltall og markedssignaler for datasettet, beregnet én gang per dataversjon."""
+    return _beregn_analyser(dataversjon(df), df)
+
+
+def varm_opp():
+    """
+    Fyller de delte cachene og analysene før første besøkende kommer. Et tomt
+    register regnes som feilet, siden en kilde som ikke svarer gir tomt datasett.
+    """
+    df_live = hent_fullt_register()
+    if df_live.empty:
+        raise HentingFeilet("Registeret er tomt eller kunne ikke lastes ned")
+    hent_posisjonsholdere()
+    df_db = hent_database_data()
+    hent_analyser(df_live)
+    hent_analyser(df_db)
+    hent_siste_oppdatering()
+    return len(df_live), len(df_db)
+
+
+def _filstorrelse_mb(db_path):
+    return sum(
+        os.path.getsize(sti) for sti in [db_path, f"{db_path}-wal"] if os.path.exists(sti)
+    ) / 1_048_576
+
+
+def kompakter(db_path=DB_PATH):
+    """
+    Skriver hele short_positions om til komprimerte perioder og krymper filen.
+    Kan kjøres flere ganger; allerede komprimerte perioder slås sammen på nytt.
+    """
+    start = time.perf_counter()
+
+    def skriv(conn):
+        mb_for = _filstorrelse_mb(db_path)
+        rader = pd.read_sql_query(
+            "SELECT isin, issuerName, positionHolder, date, shortPercent, shares, source, valid_to FROM short_positions",
+            conn,
+        )
+        perioder = _kompakter_rader(rader)
+        with conn:
+            conn.execute("DELETE FROM short_positions")
+            _sett_inn_rader(conn, perioder)
+            _merk_kompakt(conn)
+            conn.execute(
+                "INSERT INTO updates_log (timestamp, new_rows) VALUES (?, 0)",
+                (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),),
+            )
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return mb_for, rader, perioder, _filstorrelse_mb(db_path)
+
+    mb_for, rader, perioder, mb_etter = _skriv(db_path, skriv)
+    _clear_database_cache()
+    return {
+        "rader_for": len(rader),
+        "rader_etter": len(perioder),
+        "mb_for": round(mb_for, 2),
+        "mb_etter": round(mb_etter, 2),
+        "sekunder": round(time.perf_counter() - start, 2),
+    }
+
+
+EKSPORTFORMATER = ("csv", "parquet", "jsonl")
+_EKSPORT_SKJEMA = {
+    "isin": "string",
+    "issuerName": "string",
+    "positionHolder": "string",
+    "date": "string",
+    "shortPercent": "float64",
+    "shares": "float64",
+    "source": "string",
+}
+
+
+def _eksportformat(utfil, format=None):
+    if format is None:
+        navn = str(utfil).lower().removesuffix(".gz")
+        format = {".csv": "csv", ".parquet": "parquet", ".jsonl": "jsonl", ".ndjson": "jsonl"}.get(
+            Path(navn).suffix
+        )
+    if format not in EKSPORTFORMATER:
+        raise ValueError(f"Ukjent eksportformat for {utfil}; bruk en av {', '.join(EKSPORTFORMATER)}.")
+    return format
+
+
+def _eksport_sql(fra_dato, til_dato, selskap, holder):
+    """
+    Spørring og parametre for utvalget. En komprimert periode tas med når den
+    overlapper datointervallet, og rader utenfor filtreres bort etter utvidelsen.
+    """
+    vilkar, params = [], []
+    if til_dato is not None:
+        vilkar.append("date <= ?")
+        params.append(til_dato)
+    if fra_dato is not None:
+        vilkar.append("COALESCE(valid_to, date) >= ?")
+        params.append(fra_dato)
+    if selskap:
+        vilkar.append("issuerName = ?")
+        params.append(selskap)
+    if holder:
+        vilkar.append("positionHolder = ?")
+        params.append(holder)
+    sql = "SELECT isin, issuerName, positionHolder, date, shortPercent, shares, source, valid_to FROM short_positions"
+    if vilkar:
+        sql += " WHERE " + " AND ".join(vilkar)
+    return sql + " ORDER BY rowid", params
+
+
+def _eksport_deler(conn, sql, params, fra_dato, til_dato, chunk_rader):
+    for del_ in pd.read_sql_query(sql, conn, params=params, chunksize=chunk_rader):
+        del_ = _utvid_perioder(del_)
+        if fra_dato is not None:
+            del_ = del_.loc[del_["date"] >= fra_dato]
+        if til_dato is not None:
+            del_ = del_.loc[del_["date"] <= til_dato]
+        if not del_.empty:
+            yield del_.astype(_EKSPORT_SKJEMA)
+
+
+def eksporter(
+    utfil,
+    format=None,
+    fra_dato=None,
+    til_dato=None,
+    selskap=None,
+    holder=None,
+    db_path=DB_PATH,
+    chunk_rader=50_000,
+):
+    """
+    Strømmer short_positions til CSV, Parquet eller JSON Lines i biter på
+    chunk_rader rader, så minnebruken er den samme uansett tabellstørrelse.
+    Komprimerte perioder skrives ut som vanlige rader, slik appen ser dem.
+    Filer som slutter på .gz komprimeres (CSV og JSON Lines).
+    """
+    format = _eksportformat(utfil, format)
+    fra_dato = pd.Timestamp(fra_dato).strftime("%Y-%m-%d") if fra_dato else None
+    til_dato = pd.Timestamp(til_dato).strftime("%Y-%m-%d") if til_dato else None
+    sql, params = _eksport_sql(fra_dato, til_dato, selskap, holder)
+
+    start = time.perf_counter()
+    rader = 0
+    # WAL gir lesingen et fast øyeblikksbilde, uten å stenge ute lagringer.
+    with _leser(db_path) as conn:
+        deler = _eksport_deler(conn, sql, params, fra_dato, til_dato, chunk_rader)
+        tmp = Path(f"{utfil}.tmp")
+        if format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            tom = pd.DataFrame(columns=_RAD_KOLONNER).astype(_EKSPORT_SKJEMA)
+            skjema = pa.Schema.from_pandas(tom, preserve_index=False)
+            with pq.ParquetWriter(tmp, skjema, compression="zstd") as writer:
+                for del_ in deler:
+                    writer.write_table(pa.Table.from_pandas(del_, schema=skjema, preserve_index=False))
+                    rader += len(del_)
+        else:
+            apne = gzip.open if str(utfil).lower().endswith(".gz") else open
+            with apne(tmp, "wt", encoding="utf-8", newline="") as fil:
+                if format == "csv":
+                    fil.write(",".join(_RAD_KOLONNER) + "\n")
+                for del_ in deler:
+                    if format == "csv":
+                        del_.to_csv(fil, header=False, index=False)
+                    else:
+                        # to_json med lines=True avslutter selv med linjeskift.
+                        fil.write(del_.to_json(orient="records", lines=True, force_ascii=False))
+                    rader += len(del_)
+        os.replace(tmp, utfil)
+
+    return {
+        "fil": str(utfil),
+        "format": format,
+        "rader": rader,
+        "mb": round(os.path.getsize(utfil) / 1_048_576, 2),
+        "sekunder": round(time.perf_counter() - start, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vedlikehold av shortsalg-databasen.")
+    kommandoer = parser.add_subparsers(dest="kommando", required=True)
+
+    backfill_parser = kommandoer.add_parser("backfill", help="Les inn arkiverte export-json-filer fra en katalog.")
+    backfill_parser.add_argument("katalog")
+    backfill_parser.add_argument("--db", default=DB_PATH, help="SQLite-databasen som skal fylles.")
+    backfill_parser.add_argument("--arbeidere", type=int, help="Antall prosesser som normaliserer filer.")
+    backfill_parser.add_argument("--batch-rader", type=int, default=200_000, help="Nye rader per transaksjon.")
+
+    kompakter_parser = kommandoer.add_parser(
+        "kompakter", help="Slå sammen uendrede observasjoner til perioder med valid_to."
+    )
+    kompakter_parser.add_argument("--db", default=DB_PATH, help="SQLite-databasen som skal komprimeres.")
+
+    eksport_parser = kommandoer.add_parser("eksport", help="Strøm historikken til CSV, Parquet eller JSON Lines.")
+    eksport_parser.add_argument("utfil", help="Målfil; formatet leses fra endelsen (.csv, .parquet, .jsonl, evt. .gz).")
+    eksport_parser.add_argument("--format", choices=EKSPORTFORMATER)
+    eksport_parser.add_argument("--fra", help="Første dato (ÅÅÅÅ-MM-DD).")
+    eksport_parser.add_argument("--til", help="Siste dato (ÅÅÅÅ-MM-DD).")
+    eksport_parser.add_argument("--selskap", help="Bare dette selskapet (issuerName).")
+    eksport_parser.add_argument("--holder", help="Bare denne posisjonsholderen.")
+    eksport_parser.add_argument("--db", default=DB_PATH, help="SQLite-databasen som skal eksporteres.")
+    eksport_parser.add_argument("--chunk-rader", type=int, default=50_000, help="Rader som leses om gangen.")
+
+    args = parser.parse_args(argv)
+    bruk_copy_on_write()
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    if args.kommando == "backfill":
+        resultat = backfill(args.katalog, db_path=args.db, arbeidere=args.arbeidere, batch_rader=args.batch_rader)
+        print(json.dumps(resultat, ensure_ascii=False))
+    elif args.kommando == "kompakter":
+        print(json.dumps(kompakter(db_path=args.db), ensure_ascii=False))
+    elif args.kommando == "eksport":
+        resultat = eksporter(
+            args.utfil,
+            format=args.format,
+            fra_dato=args.fra,
+            til_dato=args.til,
+            selskap=args.selskap,
+            holder=args.holder,
+            db_path=args.db,
+            chunk_rader=args.chunk_rader,
+        )
+        print(json.dumps(resultat, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
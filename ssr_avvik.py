@@ -0,0 +1,148 @@
+"""
+Uvanlige bevegelser: hvor stor siste endring i shortandel er, målt mot
+selskapets egne endringer før den.
+
+For hver observasjon regnes snitt og standardavvik av de inntil VINDU
+foregående endringene i samme selskap, med kumulative summer over alle
+selskapene i én operasjon. Z-skåren og persentilen (andelen av de
+foregående endringene som er mindre i absoluttverdi) sier om en bevegelse
+er uvanlig for akkurat dette selskapet, også når den er liten i
+prosentpoeng, og skiller den fra store, men vanlige bevegelser.
+
+Bygger på observasjonene i det daglige panelet (ssr_panel). Når panelet er
+utvidet med nye rader, regnes bare selskapene som fikk nye observasjoner
+på nytt.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+import ssr_panel
+import ssr_ytelse
+
+VINDU = 60
+MIN_ENDRINGER = 5
+# Registeret oppgis med to desimaler; et selskap som aldri har beveget seg får ikke uendelig z-skår.
+MIN_STD = 0.01
+
+KOLONNER = [
+    "issuerName",
+    "date",
+    "forrige_short",
+    "shortPercent",
+    "endring",
+    "snitt",
+    "std",
+    "zscore",
+    "persentil",
+    "endringer",
+]
+
+
+def rullerende_skarer(selskap, verdi, vindu=VINDU):
+    """
+    Endring, snitt, standardavvik og antall av de foregående endringene, og
+    z-skår, for hver observasjon. Observasjonene må være sortert etter
+    selskap og dato. Første observasjon i et selskap har ingen endring (NaN).
+    """
+    n = len(verdi)
+    indeks = np.arange(n)
+    forst = np.r_[True, selskap[1:] != selskap[:-1]] if n else np.zeros(0, dtype=bool)
+    verdi = verdi.astype(np.float64)
+    endring = np.where(forst, 0.0, verdi - np.r_[0.0, verdi[:-1]])
+
+    sum1 = np.r_[0.0, np.cumsum(endring)]
+    sum2 = np.r_[0.0, np.cumsum(endring**2)]
+    telt = np.r_[0, np.cumsum(~forst)]
+    start = np.maximum.accumulate(np.where(forst, indeks, 0))
+    fra = np.maximum(start, indeks - vindu)
+
+    antall = telt[indeks] - telt[fra]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        snitt = (sum1[indeks] - sum1[fra]) / antall
+        varians = (sum2[indeks] - sum2[fra] - antall * snitt**2) / (antall - 1)
+        std = np.sqrt(np.maximum(varians, 0.0))
+        zscore = (endring - snitt) / np.maximum(std, MIN_STD)
+    zscore[(antall < MIN_ENDRINGER) | forst] = np.nan
+    endring[forst] = np.nan
+    return endring, snitt, std, antall, zscore, fra
+
+
+def _persentil(endring, fra, rader, vindu=VINDU):
+    """Andelen av de foregående endringene som er mindre i absoluttverdi (likhet teller halvt)."""
+    absolutt = np.abs(endring)
+    vinduer = fra[rader, None] + np.arange(vindu)
+    tidligere = absolutt[np.minimum(vinduer, len(endring) - 1)]
+    gyldig = (vinduer < rader[:, None]) & ~np.isnan(tidligere)
+    naa = absolutt[rader, None]
+    mindre = (gyldig & (tidligere < naa)).sum(axis=1) + 0.5 * (gyldig & (tidligere == naa)).sum(axis=1)
+    antall = gyldig.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(antall >= MIN_ENDRINGER, mindre / antall, np.nan)
+
+
+def beregn_avvik(panel, selskaper=None):
+    """
+    Siste endring per selskap med skårene over, for selskapskodene i
+    `selskaper` (alle hvis None). Selskaper med bare én observasjon er utelatt.
+    """
+    utvalg = slice(None) if selskaper is None else np.isin(panel.obs_selskap, selskaper)
+    selskap = panel.obs_selskap[utvalg]
+    if not len(selskap):
+        return pd.DataFrame(columns=KOLONNER)
+    verdi = panel.obs_verdi[utvalg]
+    endring, snitt, std, antall, zscore, fra = rullerende_skarer(selskap, verdi)
+
+    siste = np.flatnonzero(np.r_[selskap[1:] != selskap[:-1], True])
+    siste = siste[~np.isnan(endring[siste])]
+    return pd.DataFrame(
+        {
+            "issuerName": panel.selskaper[selskap[siste]],
+            "date": pd.to_datetime(panel.obs_dato[utvalg][siste]),
+            "forrige_short": verdi[siste] - endring[siste],
+            "shortPercent": verdi[siste],
+            "endring": endring[siste],
+            "snitt": snitt[siste],
+            "std": std[siste],
+            "zscore": zscore[siste],
+            "persentil": _persentil(endring, fra, siste),
+            "endringer": antall[siste],
+        }
+    )
+
+
+def _sorter(avvik):
+    rekkefolge = avvik["zscore"].abs().sort_values(ascending=False, na_position="last").index
+    return avvik.loc[rekkefolge].reset_index(drop=True)
+
+
+_LOCK = threading.Lock()
+_avvik = {}
+
+
+def hent_avvik(df, navn="historikk"):
+    """
+    Skårene for datasettet, sortert etter absolutt z-skår. Er panelet utvidet
+    fra det forrige skårene ble regnet på, regnes bare de berørte selskapene.
+    """
+    panel = ssr_panel.hent_panel(df, navn)
+    with _LOCK:
+        forrige = _avvik.get(navn)
+    if forrige is not None and forrige["panel"] is panel:
+        return forrige["avvik"]
+
+    if forrige is not None and panel.utvidet_fra is not None and panel.utvidet_fra() is forrige["panel"]:
+        with ssr_ytelse.spenn("avvik:oppdater", selskaper=len(panel.berorte)):
+            gamle = forrige["avvik"]
+            beholdes = ~gamle["issuerName"].isin(panel.selskaper[panel.berorte])
+            nye = beregn_avvik(panel, panel.berorte)
+            avvik = _sorter(pd.concat([gamle.loc[beholdes], nye], ignore_index=True) if not nye.empty else gamle.loc[beholdes])
+    else:
+        with ssr_ytelse.spenn("avvik:beregn", selskaper=panel.form[0]):
+            avvik = _sorter(beregn_avvik(panel))
+
+    with _LOCK:
+        _avvik[navn] = {"panel": panel, "avvik": avvik}
+    return avvik
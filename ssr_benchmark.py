@@ -0,0 +1,489 @@
+"""
+Ytelsesmåling av innlesing, lagring og analyser på syntetiske data.
+
+Eksempel:
+    python ssr_benchmark.py --storrelser 50x20x3,200x60x5 --aar 1,3 --json resultater.json
+    python ssr_benchmark.py --rerun 200x60x5 --aar 3
+    python ssr_benchmark.py --samtidighet --aar 5
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import ssr_api
+from ssr_analyse import (
+    _agg_issuer_date,
+    beregn_storste_endringer,
+    bruk_copy_on_write,
+    finn_nye_shortposisjoner,
+    hent_siste_posisjon_per_selskap,
+)
+
+HANDELSDAGER_PER_AAR = 250
+_FOND = [
+    "Marshall Wace LLP", "AQR Capital Management", "Citadel Advisors", "Millennium Partners",
+    "Qube Research & Technologies", "Two Sigma Investments", "Worldquant LLC", "Kite Lake Capital",
+    "Voleon Capital", "GLG Partners", "Point72 Asset Management", "Lansdowne Partners",
+]
+
+
+def _handelsdager(slutt, antall):
+    dager = pd.bdate_range(end=slutt, periods=antall)
+    return [dag.strftime("%Y-%m-%d") for dag in dager]
+
+
+def lag_syntetisk_payload(instrumenter=50, hendelser=20, posisjoner=3, seed=1, slutt="2025-06-30"):
+    """
+    Lager en deterministisk payload med samme form som Finanstilsynets export-json:
+    instrumenter × hendelser × activePositions.
+    """
+    rng = random.Random(seed)
+    dager = _handelsdager(slutt, hendelser)
+    payload = []
+    for i in range(instrumenter):
+        nivaa = rng.uniform(0.5, 8.0)
+        aksjer_totalt = rng.randint(10, 500) * 1_000_000
+        events = []
+        for dag in dager:
+            nivaa = max(0.0, nivaa + rng.gauss(0, 0.15))
+            aktive = []
+            for p in range(posisjoner):
+                andel = round(rng.uniform(0.5, max(0.6, nivaa / max(posisjoner, 1))), 2)
+                aktive.append(
+                    {
+                        "positionHolder": _FOND[(i + p) % len(_FOND)],
+                        "date": dag,
+                        "shortPercent": andel,
+                        "shares": int(aksjer_totalt * andel / 100),
+                    }
+                )
+            events.append(
+                {
+                    "date": dag,
+                    "shortPercent": round(nivaa, 2),
+                    "shares": int(aksjer_totalt * nivaa / 100),
+                    "activePositions": aktive,
+                }
+            )
+        payload.append(
+            {
+                "isin": f"NO{10_000_000 + i:010d}",
+                "issuerName": f"SYNTETISK SELSKAP {i:04d} ASA",
+                "events": events,
+            }
+        )
+    return payload
+
+
+def lag_syntetisk_database(db_path, aar=1, instrumenter=200, hendelsesandel=0.3, seed=1, slutt="2025-06-30"):
+    """
+    Fyller en SQLite-database med `aar` års historikk. Hvert selskap får en
+    registrering på omtrent `hendelsesandel` av handelsdagene.
+    """
+    rng = random.Random(seed)
+    dager = _handelsdager(slutt, aar * HANDELSDAGER_PER_AAR)
+    rows = []
+    for i in range(instrumenter):
+        nivaa = rng.uniform(0.5, 8.0)
+        aksjer_totalt = rng.randint(10, 500) * 1_000_000
+        for dag in dager:
+            if rng.random() > hendelsesandel:
+                continue
+            nivaa = max(0.0, nivaa + rng.gauss(0, 0.15))
+            rows.append(
+                (
+                    f"NO{10_000_000 + i:010d}",
+                    f"SYNTETISK SELSKAP {i:04d} ASA",
+                    None,
+                    dag,
+                    round(nivaa, 2),
+                    float(int(aksjer_totalt * nivaa / 100)),
+                )
+            )
+
+    conn = sqlite3.connect(db_path)
+    try:
+        ssr_api._ensure_schema(conn)
+        conn.executemany(
+            "INSERT INTO short_positions (isin, issuerName, positionHolder, date, shortPercent, shares) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return len(rows)
+
+
+def _mal(funksjon, repetisjoner, forbered=None):
+    """Returnerer (median sekunder, toppminne i byte) for funksjonen."""
+    tider = []
+    for _ in range(repetisjoner):
+        if forbered:
+            forbered()
+        gc.collect()
+        start = time.perf_counter()
+        funksjon()
+        tider.append(time.perf_counter() - start)
+
+    if forbered:
+        forbered()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        funksjon()
+        _, topp = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(tider), topp
+
+
+def _kopier_database(kilde, maal):
+    with sqlite3.connect(kilde) as fra, sqlite3.connect(maal) as til:
+        fra.backup(til)
+
+
+def kjor_benchmark(storrelser, aar_liste, repetisjoner=3, instrumenter_historikk=200, seed=1):
+    resultater = []
+
+    def registrer(steg, storrelse, rader, sekunder, topp):
+        resultater.append(
+            {
+                "steg": steg,
+                "storrelse": storrelse,
+                "rader": int(rader),
+                "sekunder": round(sekunder, 6),
+                "toppminne_mb": round(topp / 1_048_576, 3),
+            }
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for instrumenter, hendelser, posisjoner in storrelser:
+            navn = f"{instrumenter}x{hendelser}x{posisjoner}"
+            payload = lag_syntetisk_payload(instrumenter, hendelser, posisjoner, seed=seed)
+
+            register = ssr_api._normaliser_payload(payload)
+            sek, topp = _mal(lambda: ssr_api._normaliser_payload(payload), repetisjoner)
+            registrer("_normaliser_payload", navn, len(register), sek, topp)
+
+            holdere = ssr_api._normaliser_posisjonsholdere(payload)
+            sek, topp = _mal(lambda: ssr_api._normaliser_posisjonsholdere(payload), repetisjoner)
+            registrer("_normaliser_posisjonsholdere", navn, len(holdere), sek, topp)
+
+        for aar in aar_liste:
+            navn = f"{aar} år"
+            mal_db = os.path.join(tmp, f"historikk_{aar}.db")
+            antall = lag_syntetisk_database(mal_db, aar=aar, instrumenter=instrumenter_historikk, seed=seed)
+            arbeids_db = os.path.join(tmp, f"arbeid_{aar}.db")
+
+            # Et nytt snapshot med 20 hendelser per selskap flettes inn i historikken.
+            nytt = ssr_api._normaliser_payload(
+                lag_syntetisk_payload(instrumenter_historikk, 20, 0, seed=seed + aar)
+            )
+
+            sek, topp = _mal(
+                lambda: ssr_api.lagre_i_database(nytt, db_path=arbeids_db),
+                repetisjoner,
+                forbered=lambda: _kopier_database(mal_db, arbeids_db),
+            )
+            registrer("lagre_i_database", navn, antall, sek, topp)
+
+            sek, topp = _mal(
+                lambda: ssr_api.hent_database_data(db_path=mal_db),
+                repetisjoner,
+                forbered=ssr_api._clear_database_cache,
+            )
+            registrer("hent_database_data", navn, antall, sek, topp)
+
+            historikk = ssr_api.hent_database_data(db_path=mal_db)
+            for steg, funksjon in [
+                ("_agg_issuer_date", _agg_issuer_date),
+                ("hent_siste_posisjon_per_selskap", hent_siste_posisjon_per_selskap),
+                ("beregn_storste_endringer", beregn_storste_endringer),
+                ("finn_nye_shortposisjoner", finn_nye_shortposisjoner),
+            ]:
+                sek, topp = _mal(lambda: funksjon(historikk), repetisjoner)
+                registrer(steg, navn, len(historikk), sek, topp)
+
+    return resultater
+
+
+APP_PATH = str(Path(__file__).with_name("shortsalg_app.py"))
+RERUN_SIDER = ("live", "sok")
+
+
+def bytt_side(at, side):
+    """
+    Velger siden med url_path `side` før neste at.run(). AppTest.switch_page
+    tar bare sidefiler (og avviser "live" med ValueError), mens appens sider
+    er funksjoner i st.navigation. Vi setter derfor sidens hash slik
+    switch_page selv gjør, md5 av sidenavnet, og feiler tydelig om AppTest
+    har endret seg.
+    """
+    from streamlit.util import calc_md5
+
+    if not hasattr(at, "_page_hash"):
+        raise RuntimeError("Denne versjonen av AppTest lar seg ikke styre til en side uten sidefil.")
+    at._page_hash = calc_md5(side)
+    return at
+
+
+def _mal_reruns(copy_on_write, repetisjoner):
+    """
+    Kjøres i en egen prosess med SHORTSALG_DB_PATH og SHORTSALG_API_URL satt.
+    Varmer opp hver side og måler deretter tid og toppminne for én rerun.
+    """
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    warnings.simplefilter("ignore")
+    from streamlit.testing.v1 import AppTest
+
+    # Appen slår copy-on-write av eller på etter denne ved hver rerun.
+    os.environ["SHORTSALG_COPY_ON_WRITE"] = "1" if copy_on_write else "0"
+    at = AppTest.from_file(APP_PATH, default_timeout=120).run()
+    resultater = {}
+    for side in RERUN_SIDER:
+        bytt_side(at, side).run()
+        sek, topp = _mal(at.run, repetisjoner)
+        if at.exception:
+            raise RuntimeError(f"Siden {side} feilet: {at.exception[0].message}")
+        resultater[side] = (sek, topp)
+    return resultater
+
+
+class _PayloadHandler(BaseHTTPRequestHandler):
+    body = b"[]"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_payloadserver(payload):
+    """Serverer payloaden som export-json på en ledig lokal port i en bakgrunnstråd."""
+    handler = type("Payload", (_PayloadHandler,), {"body": json.dumps(payload).encode("utf-8")})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def kjor_rerun_benchmark(storrelse, aar, repetisjoner=3, instrumenter_historikk=200, seed=1):
+    """
+    Toppminne per rerun av appen med og uten pandas copy-on-write, mot en
+    syntetisk payload servert lokalt og en syntetisk historikk. Hver modus
+    kjøres i en ny prosess, slik at cachene og innstillingen starter likt.
+    """
+    instrumenter, hendelser, posisjoner = storrelse
+    navn = f"{instrumenter}x{hendelser}x{posisjoner}, {aar} år"
+    server = start_payloadserver(lag_syntetisk_payload(instrumenter, hendelser, posisjoner, seed=seed))
+
+    resultater = []
+    miljo = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "rerun.db")
+            antall = lag_syntetisk_database(db_path, aar=aar, instrumenter=instrumenter_historikk, seed=seed)
+            for nokkel, verdi in {
+                "SHORTSALG_DB_PATH": db_path,
+                "SHORTSALG_API_URL": f"http://127.0.0.1:{server.server_port}/",
+                "SHORTSALG_PERF_LOG": "0",
+            }.items():
+                miljo[nokkel] = os.environ.get(nokkel)
+                os.environ[nokkel] = verdi
+
+            for copy_on_write in (False, True):
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    maalinger = pool.submit(_mal_reruns, copy_on_write, repetisjoner).result()
+                modus = "copy-on-write" if copy_on_write else "uten copy-on-write"
+                for side, (sek, topp) in maalinger.items():
+                    resultater.append(
+                        {
+                            "steg": f"rerun:{side} ({modus})",
+                            "storrelse": navn,
+                            "rader": int(antall),
+                            "sekunder": round(sek, 6),
+                            "toppminne_mb": round(topp / 1_048_576, 3),
+                        }
+                    )
+    finally:
+        server.shutdown()
+        for nokkel, verdi in miljo.items():
+            if verdi is None:
+                os.environ.pop(nokkel, None)
+            else:
+                os.environ[nokkel] = verdi
+    return resultater
+
+
+def _les_under(les, stopp, pause=0.005):
+    """Kaller les() gjentatte ganger til stopp er satt. Returnerer ventetidene i ms."""
+    tider = []
+    while not stopp.is_set():
+        start = time.perf_counter()
+        les()
+        tider.append((time.perf_counter() - start) * 1000)
+        time.sleep(pause)
+    return tider
+
+
+def kjor_samtidighetsbenchmark(aar, instrumenter_historikk=200, nye_hendelser=250, lesere=4, seed=1):
+    """
+    Ventetid for lesinger (statuslinjen og oppslag per dato) mens en stor
+    lagring pågår, sammenlignet med de samme lesingene uten skriving.
+    Lesingene går på egne forbindelser, så de skal ikke vente på skrivetråden.
+    """
+    navn = f"{aar} år, {lesere} lesere"
+    resultater = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "samtidighet.db")
+        antall = lag_syntetisk_database(db_path, aar=aar, instrumenter=instrumenter_historikk, seed=seed)
+        nytt = ssr_api._normaliser_payload(
+            lag_syntetisk_payload(instrumenter_historikk, nye_hendelser, 0, seed=seed + 1, slutt="2026-06-30")
+        )
+        lesinger = {
+            "hent_siste_oppdatering": lambda: ssr_api.hent_siste_oppdatering(db_path=db_path),
+            "hent_register_per_dato": lambda: ssr_api.hent_register_per_dato("2025-01-02", db_path=db_path),
+        }
+        lesinger["hent_siste_oppdatering"]()
+
+        for steg, les in lesinger.items():
+            for modus in ("uten skriving", "under lagring"):
+                stopp = threading.Event()
+                with ThreadPoolExecutor(lesere) as pool:
+                    fremtider = [pool.submit(_les_under, les, stopp) for _ in range(lesere)]
+                    start = time.perf_counter()
+                    if modus == "under lagring":
+                        ssr_api.lagre_i_database(nytt, db_path=db_path)
+                    else:
+                        time.sleep(1.0)
+                    skrivetid = time.perf_counter() - start
+                    stopp.set()
+                    tider = [t for f in fremtider for t in f.result()]
+                resultater.append(
+                    {
+                        "steg": f"{steg} ({modus})",
+                        "storrelse": navn,
+                        "rader": int(antall),
+                        "sekunder": round(statistics.median(tider) / 1000, 6),
+                        "toppminne_mb": 0.0,
+                        "p99_ms": round(float(np.percentile(tider, 99)), 2),
+                        "maks_ms": round(max(tider), 2),
+                        "lesinger": len(tider),
+                        "skriving_ms": round(skrivetid * 1000, 1) if modus == "under lagring" else None,
+                    }
+                )
+                # Neste runde skal lagre like mange nye rader.
+                if modus == "under lagring":
+                    with sqlite3.connect(db_path) as conn:
+                        conn.execute("DELETE FROM short_positions WHERE date > '2025-06-30'")
+    return resultater
+
+
+def _tolk_storrelser(tekst):
+    storrelser = []
+    for del_ in tekst.split(","):
+        instrumenter, hendelser, posisjoner = (int(x) for x in del_.lower().split("x"))
+        storrelser.append((instrumenter, hendelser, posisjoner))
+    return storrelser
+
+
+def _skriv_tabell(resultater):
+    tabell = pd.DataFrame(resultater)
+    tabell["ms"] = (tabell["sekunder"] * 1000).round(2)
+    ekstra = [k for k in ("p99_ms", "maks_ms", "skriving_ms") if k in tabell.columns]
+    print(
+        tabell[["steg", "storrelse", "rader", "ms", "toppminne_mb", *ekstra]]
+        .to_string(index=False)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--storrelser",
+        default="50x20x3,100x40x4,200x60x5",
+        help="Payload-størrelser som instrumenter×hendelser×activePositions, kommaseparert.",
+    )
+    parser.add_argument("--aar", default="1,3,5", help="Antall års historikk i SQLite, kommaseparert.")
+    parser.add_argument("--instrumenter", type=int, default=200, help="Antall selskaper i historikken.")
+    parser.add_argument("--repetisjoner", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Skriv resultatene til denne filen i tillegg.")
+    parser.add_argument(
+        "--rerun",
+        metavar="STORRELSE",
+        help="Mål toppminne per rerun av appen med og uten copy-on-write for denne payload-størrelsen "
+        "og første verdi i --aar, i stedet for de vanlige stegene.",
+    )
+    parser.add_argument(
+        "--samtidighet",
+        action="store_true",
+        help="Mål ventetiden for lesinger mens en stor lagring pågår, for første verdi i --aar.",
+    )
+    args = parser.parse_args(argv)
+
+    bruk_copy_on_write()
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    if args.samtidighet:
+        resultater = kjor_samtidighetsbenchmark(
+            int(args.aar.split(",")[0]), instrumenter_historikk=args.instrumenter, seed=args.seed
+        )
+    elif args.rerun:
+        resultater = kjor_rerun_benchmark(
+            _tolk_storrelser(args.rerun)[0],
+            int(args.aar.split(",")[0]),
+            repetisjoner=args.repetisjoner,
+            instrumenter_historikk=args.instrumenter,
+            seed=args.seed,
+        )
+    else:
+        resultater = kjor_benchmark(
+            _tolk_storrelser(args.storrelser),
+            [int(x) for x in args.aar.split(",")],
+            repetisjoner=args.repetisjoner,
+            instrumenter_historikk=args.instrumenter,
+            seed=args.seed,
+        )
+    _skriv_tabell(resultater)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fil:
+            json.dump(
+                {
+                    "tidspunkt": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "argumenter": vars(args),
+                    "resultater": resultater,
+                },
+                fil,
+                ensure_ascii=False,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
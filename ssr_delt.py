@@ -0,0 +1,162 @@
+"""
+Delt datalager for flere Streamlit-replikaer på samme maskin.
+
+Normaliserte datasett publiseres som Arrow IPC-filer i SHORTSALG_SHARED_DIR.
+En peker-fil per gruppe (f.eks. api.current) sier hvilken versjon som gjelder,
+og byttes atomisk med os.replace. Replikaene leser filene minnekartlagt, og en
+fillås sørger for at bare én prosess henter og publiserer en ny versjon.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pyarrow as pa
+
+DELT_DIR = os.environ.get("SHORTSALG_SHARED_DIR")
+
+# Prosessens egne pandas-frames per gruppe, gjenbrukt så lenge pekeren står stille.
+_minne = {}
+_minne_lock = threading.Lock()
+
+
+def aktiv():
+    return bool(DELT_DIR)
+
+
+def gruppenavn(prefiks, nokkel):
+    """Stabilt gruppenavn for f.eks. én bestemt databasefil."""
+    return f"{prefiks}-{hashlib.md5(str(nokkel).encode('utf-8')).hexdigest()[:10]}"
+
+
+def _mappe():
+    mappe = Path(DELT_DIR)
+    mappe.mkdir(parents=True, exist_ok=True)
+    return mappe
+
+
+@contextmanager
+def eksklusiv(gruppe):
+    """Fillås på tvers av prosesser (og tråder) for én gruppe."""
+    with open(_mappe() / f"{gruppe}.lock", "a+") as fil:
+        fcntl.flock(fil, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fil, fcntl.LOCK_UN)
+
+
+def les_peker(gruppe):
+    try:
+        return json.loads((_mappe() / f"{gruppe}.current").read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _gyldig(peker, versjon, maks_alder):
+    if peker is None:
+        return False
+    if versjon is not None and peker["versjon"] != str(versjon):
+        return False
+    if maks_alder is not None and time.time() - peker["publisert"] >= maks_alder:
+        return False
+    return True
+
+
+def _skriv_atomisk(sti, skriv):
+    tmp = sti.with_name(f".{sti.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as fil:
+        skriv(fil)
+        fil.flush()
+        os.fsync(fil.fileno())
+    os.replace(tmp, sti)
+
+
+def _rydd(gruppe, beholdes):
+    """Sletter eldre versjoner. Prosesser som har en fil kartlagt beholder innholdet."""
+    for sti in _mappe().glob(f"{gruppe}-*.arrow"):
+        if sti.name not in beholdes:
+            try:
+                sti.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def publiser(gruppe, frames, versjon=None):
+    """Skriver datasettene som Arrow-filer og flytter pekeren til den nye versjonen."""
+    mappe = _mappe()
+    versjon = str(versjon) if versjon is not None else str(time.time_ns())
+    filer = {}
+    for navn, df in frames.items():
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        filnavn = f"{gruppe}-{navn}-{versjon}.arrow"
+
+        def skriv(fil, table=table):
+            with pa.ipc.new_file(fil, table.schema) as writer:
+                writer.write_table(table)
+
+        _skriv_atomisk(mappe / filnavn, skriv)
+        filer[navn] = filnavn
+
+    forrige = les_peker(gruppe)
+    peker = {"versjon": versjon, "publisert": time.time(), "filer": filer}
+    _skriv_atomisk(
+        mappe / f"{gruppe}.current",
+        lambda fil: fil.write(json.dumps(peker).encode("utf-8")),
+    )
+    _rydd(gruppe, set(filer.values()) | set((forrige or {}).get("filer", {}).values()))
+    return peker
+
+
+def _les(gruppe, peker):
+    frames = {}
+    for navn, filnavn in peker["filer"].items():
+        with pa.memory_map(str(_mappe() / filnavn), "r") as kilde:
+            df = pa.ipc.open_file(kilde).read_all().to_pandas()
+        df.attrs["dataversjon"] = f"{gruppe}:{navn}:{peker['versjon']}"
+        frames[navn] = df
+    return frames
+
+
+def _fra_minne(gruppe, peker):
+    with _minne_lock:
+        lagret = _minne.get(gruppe)
+        if lagret is not None and lagret[0] == peker["versjon"]:
+            return lagret[1]
+    frames = _les(gruppe, peker)
+    with _minne_lock:
+        _minne[gruppe] = (peker["versjon"], frames)
+    return frames
+
+
+def hent(gruppe, last, versjon=None, maks_alder=None):
+    """
+    Returnerer datasettene i gruppen.
+
+    Er den publiserte versjonen gyldig (riktig versjon og ikke eldre enn
+    maks_alder sekunder), leses den fra lageret. Ellers tar én prosess låsen,
+    kaller last() og publiserer resultatet, mens de andre venter og leser det.
+    Feiler last(), brukes forrige publiserte versjon hvis den finnes.
+    """
+    peker = les_peker(gruppe)
+    if _gyldig(peker, versjon, maks_alder):
+        return _fra_minne(gruppe, peker)
+
+    with eksklusiv(gruppe):
+        peker = les_peker(gruppe)
+        if _gyldig(peker, versjon, maks_alder):
+            return _fra_minne(gruppe, peker)
+        try:
+            frames = last()
+        except Exception:
+            if peker is None:
+                raise
+            print(f"Kunne ikke fornye {gruppe}; bruker versjon {peker['versjon']} fra delt lager.")
+            return _fra_minne(gruppe, peker)
+        peker = publiser(gruppe, frames, versjon=versjon)
+    return _fra_minne(gruppe, peker)
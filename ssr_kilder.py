@@ -0,0 +1,113 @@
+"""
+Kildene registeret hentes fra: én adapter per shortregister.
+
+En kilde sier hvor JSON-en hentes, hvor listen med instrumenter ligger i
+svaret og hvilke feltnavn registeret bruker. Hentingen, fristene, cachene og
+normaliseringen i ssr_api er felles, så en ny kilde er bare konfigurasjon.
+
+Finanstilsynet er alltid første kilde. Andre registre med samme oppbygning
+(instrumenter med events og activePositions) legges til med SHORTSALG_SOURCES,
+enten som JSON direkte eller som sti til en JSON-fil:
+
+    [{"navn": "fi-se", "tittel": "Finansinspektionen", "url": "https://…",
+      "liste": "data.instruments", "felt": {"issuerName": ["emittent"]}}]
+
+Felt som ikke er nevnt bruker standardnavnene i FELT.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+
+# Navnene en verdi kan ha i svaret, i prioritert rekkefølge.
+FELT = {
+    "isin": ["isin", "instrumentIsin"],
+    "issuerName": ["issuerName", "issuer", "instrumentName"],
+    "positionHolder": ["positionHolder", "positionHolderName", "holderName", "positionOwner", "ownerName", "holder"],
+    "date": ["date", "positionDate", "disclosureDate"],
+    "shortPercent": ["shortPercent", "netShortPosition", "positionPercent", "percent"],
+    "shares": ["shares", "shortPosition", "position", "numberOfShares"],
+    "events": ["events"],
+    "activePositions": ["activePositions"],
+}
+
+
+class Kilde:
+    """
+    Ett shortregister. `liste` er stien (punktum-separert) til listen med
+    instrumenter når svaret ikke er listen selv, og `felt` overstyrer
+    standardnavnene per felt.
+    """
+
+    def __init__(self, navn, tittel, url, liste=None, felt=None, headers=None):
+        if not re.fullmatch(r"[a-z0-9][a-z0-9_-]*", navn):
+            raise ValueError(f"Ugyldig kildenavn {navn!r}; bruk små bokstaver, tall, - og _.")
+        ukjente = set(felt or {}) - set(FELT)
+        if ukjente:
+            raise ValueError(f"Ukjente felt for kilden {navn}: {', '.join(sorted(ukjente))}")
+        self.navn = navn
+        self.tittel = tittel
+        self.url = url
+        self.liste = liste
+        self.headers = dict(headers or {})
+        self.felt = {
+            felt_navn: [alias] if isinstance(alias, str) else list(alias)
+            for felt_navn, alias in {**FELT, **(felt or {})}.items()
+        }
+
+    def instrumenter(self, data):
+        """Listen med instrumenter i et dekodet svar, eller None hvis den mangler."""
+        for del_ in self.liste.split(".") if self.liste else []:
+            if not isinstance(data, dict):
+                return None
+            data = data.get(del_)
+        return data if isinstance(data, list) else None
+
+    def __repr__(self):
+        return f"Kilde({self.navn!r}, {self.url!r})"
+
+
+FINANSTILSYNET = Kilde(
+    "finanstilsynet",
+    "Finanstilsynet",
+    os.environ.get("SHORTSALG_API_URL", "https://ssr.finanstilsynet.no/api/v2/instruments/export-json"),
+)
+# Rader lagret før kildene ble innført, og arkiverte filer, kommer herfra.
+STANDARDKILDE = FINANSTILSYNET.navn
+
+
+def les_kilder(verdi):
+    """Kildene fra SHORTSALG_SOURCES: JSON-tekst eller sti til en JSON-fil."""
+    if not verdi or not verdi.strip():
+        return []
+    tekst = verdi if verdi.lstrip().startswith("[") else Path(verdi).read_text(encoding="utf-8")
+    kilder = []
+    for oppsett in json.loads(tekst):
+        kilder.append(
+            Kilde(
+                oppsett["navn"],
+                oppsett.get("tittel", oppsett["navn"]),
+                oppsett["url"],
+                liste=oppsett.get("liste"),
+                felt=oppsett.get("felt"),
+                headers=oppsett.get("headers"),
+            )
+        )
+    return kilder
+
+
+KILDER = [FINANSTILSYNET, *les_kilder(os.environ.get("SHORTSALG_SOURCES"))]
+if len({kilde.navn for kilde in KILDER}) != len(KILDER):
+    raise ValueError("Kildenavnene i SHORTSALG_SOURCES må være unike og forskjellige fra finanstilsynet.")
+_ETTER_NAVN = {kilde.navn: kilde for kilde in KILDER}
+
+
+def kilde(navn):
+    return _ETTER_NAVN[navn]
+
+
+def tittel(navn):
+    """Visningsnavnet for en kilde; ukjente navn (f.eks. fra en eldre konfigurasjon) vises som de er."""
+    funnet = _ETTER_NAVN.get(navn)
+    return funnet.tittel if funnet is not None else str(navn)
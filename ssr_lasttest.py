@@ -0,0 +1,270 @@
+"""
+Lasttest av Streamlit-appen med simulerte økter mot et lokalt register og en seedet database.
+
+Eksempel:
+    python ssr_lasttest.py --okter 8 --handlinger 25 --prosesser 2 --json last.json
+
+Hver økt er en AppTest-instans som gjør en vektet blanding av handlinger:
+søk, sidebytte, periodevalg på Topp 10, oppdater-knappen og lagring av
+historikk. AppTest kan ikke kjøre flere scriptkjøringer samtidig i én prosess,
+så øktene i en prosess bytter på å kjøre én handling hver, og deler cachene
+slik brukerne av én server gjør. Flere prosesser gir parallell last, som
+flere replikaer (sett gjerne SHORTSALG_SHARED_DIR).
+
+Rapporten viser persentiler for rerun-tid per handling, gjennomstrømning og
+minne per økt (økningen i RSS delt på antall økter, og størrelsen på
+session_state).
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+APP_PATH = str(Path(__file__).with_name("shortsalg_app.py"))
+SIDER = ("live", "sok", "topp10", "endringer")
+PERIODER = ("30 dager", "90 dager", "180 dager", "365 dager")
+# Relativ vekt for hver handling.
+HANDLINGER = {
+    "sok": 35,
+    "sidebytte": 30,
+    "topp10_periode": 10,
+    "oppdater": 15,
+    "lagre": 10,
+}
+
+
+def _rss_mb():
+    """Nåværende RSS for prosessen, eller toppverdien der /proc mangler."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as fil:
+            return int(fil.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1_048_576
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Okt:
+    """Én simulert bruker med egen AppTest og egen session_state."""
+
+    def __init__(self, okt_id, selskaper, seed):
+        from streamlit.testing.v1 import AppTest
+
+        self.id = okt_id
+        self.rng = random.Random(seed * 1000 + okt_id)
+        self.selskaper = selskaper
+        self.side = "live"
+        self.at = AppTest.from_file(APP_PATH, default_timeout=120)
+
+    def _kjor(self, handling):
+        start = time.perf_counter()
+        handling()
+        ms = (time.perf_counter() - start) * 1000
+        return ms, [str(e.message) for e in self.at.exception]
+
+    def _bytt_side(self, side):
+        import ssr_benchmark
+
+        ssr_benchmark.bytt_side(self.at, side)
+        self.side = side
+        self.at.run()
+
+    def start(self):
+        return "start", *self._kjor(self.at.run)
+
+    def neste(self):
+        handling = self.rng.choices(list(HANDLINGER), weights=list(HANDLINGER.values()))[0]
+        krever = {"sok": "live", "oppdater": "live", "lagre": "live", "topp10_periode": "topp10"}.get(handling)
+        if krever is not None and self.side != krever:
+            return "sidebytte", *self._kjor(lambda: self._bytt_side(krever))
+
+        if handling == "sidebytte":
+            side = self.rng.choice([s for s in SIDER if s != self.side])
+            return handling, *self._kjor(lambda: self._bytt_side(side))
+        if handling == "sok":
+            # Tomt søk nullstiller, ellers et prefiks av et selskapsnavn som om det skrives inn.
+            navn = self.rng.choice(self.selskaper)
+            sok = "" if self.rng.random() < 0.2 else navn[: self.rng.randint(3, len(navn))]
+            return handling, *self._kjor(lambda: self.at.text_input(key="live_search").input(sok).run())
+        if handling == "topp10_periode":
+            periode = self.rng.choice(PERIODER)
+            return handling, *self._kjor(lambda: self.at.selectbox[0].select(periode).run())
+        knapp = "force_refresh" if handling == "oppdater" else "save_live"
+        return handling, *self._kjor(lambda: self.at.button(key=knapp).click().run())
+
+    def session_state_byte(self):
+        import ssr_ytelse
+
+        # Bare verdiene appen selv har satt, ikke widgetenes interne nøkler.
+        return ssr_ytelse.storrelse_i_byte(self.at.session_state.filtered_state)
+
+
+def _kjor_okter(okt_ider, handlinger, tenketid, selskaper, seed):
+    """Kjøres i en egen prosess. Øktene bytter på å gjøre én handling hver."""
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    warnings.simplefilter("ignore")
+
+    # En første kjøring laster moduler og fyller cachene, så minnet per økt
+    # måles fra en varm prosess.
+    _Okt(-1, selskaper, seed).start()
+    gc.collect()
+    rss_for = _rss_mb()
+
+    start = time.perf_counter()
+    okter = [_Okt(okt_id, selskaper, seed) for okt_id in okt_ider]
+    maalinger = []
+    for okt in okter:
+        maalinger.append((okt.id, *okt.start()))
+    for _ in range(handlinger):
+        for okt in okter:
+            maalinger.append((okt.id, *okt.neste()))
+            if tenketid:
+                time.sleep(okt.rng.uniform(0, tenketid) / len(okter))
+    sekunder = time.perf_counter() - start
+
+    gc.collect()
+    return {
+        "maalinger": maalinger,
+        "sekunder": sekunder,
+        "rss_for_mb": rss_for,
+        "rss_etter_mb": _rss_mb(),
+        "session_state_byte": [okt.session_state_byte() for okt in okter],
+    }
+
+
+def kjor_lasttest(okter=8, handlinger=20, prosesser=1, tenketid=0.0, storrelse=(200, 60, 5), aar=1, seed=1):
+    """Starter register og database, kjører øktene og returnerer (per handling, sammendrag)."""
+    import ssr_benchmark
+
+    instrumenter, hendelser, posisjoner = storrelse
+    payload = ssr_benchmark.lag_syntetisk_payload(instrumenter, hendelser, posisjoner, seed=seed)
+    selskaper = [instrument["issuerName"] for instrument in payload]
+    server = ssr_benchmark.start_payloadserver(payload)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "lasttest.db")
+            historikk = ssr_benchmark.lag_syntetisk_database(db_path, aar=aar, instrumenter=instrumenter, seed=seed)
+            # Prosessene startes med spawn og leser miljøet når ssr_api importeres.
+            os.environ["SHORTSALG_DB_PATH"] = db_path
+            os.environ["SHORTSALG_API_URL"] = f"http://127.0.0.1:{server.server_port}/"
+            os.environ.setdefault("SHORTSALG_PERF_LOG", "0")
+
+            fordeling = [list(range(okter))[i::prosesser] for i in range(prosesser)]
+            fordeling = [ider for ider in fordeling if ider]
+            start = time.perf_counter()
+            with ProcessPoolExecutor(len(fordeling), mp_context=multiprocessing.get_context("spawn")) as pool:
+                fremtider = [
+                    pool.submit(_kjor_okter, ider, handlinger, tenketid, selskaper, seed) for ider in fordeling
+                ]
+                resultater = [f.result() for f in fremtider]
+            sekunder = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    maalinger = pd.DataFrame(
+        [m for r in resultater for m in r["maalinger"]],
+        columns=["okt", "handling", "ms", "feil"],
+    )
+    maalinger["feilet"] = maalinger["feil"].map(bool)
+
+    per_handling = (
+        maalinger.groupby("handling")["ms"]
+        .agg(
+            antall="count",
+            p50_ms=lambda ms: np.percentile(ms, 50),
+            p90_ms=lambda ms: np.percentile(ms, 90),
+            p99_ms=lambda ms: np.percentile(ms, 99),
+            maks_ms="max",
+        )
+        .join(maalinger.groupby("handling")["feilet"].sum().rename("feil"))
+        .round(1)
+        .reset_index()
+    )
+    alle = maalinger["ms"].to_numpy()
+    session_state = [b for r in resultater for b in r["session_state_byte"]]
+    sammendrag = {
+        "okter": okter,
+        "prosesser": len(fordeling),
+        "handlinger_per_okt": handlinger,
+        "historikk_rader": historikk,
+        "reruns": len(maalinger),
+        "feil": int(maalinger["feilet"].sum()),
+        "sekunder": round(sekunder, 2),
+        # Prosessene kjører side om side, så gjennomstrømningen er summen av deres.
+        "reruns_per_sekund": round(sum(len(r["maalinger"]) / r["sekunder"] for r in resultater), 2),
+        "p50_ms": round(float(np.percentile(alle, 50)), 1),
+        "p90_ms": round(float(np.percentile(alle, 90)), 1),
+        "p99_ms": round(float(np.percentile(alle, 99)), 1),
+        "rss_per_okt_mb": round(
+            float(np.mean([(r["rss_etter_mb"] - r["rss_for_mb"]) / len(ider) for r, ider in zip(resultater, fordeling)])),
+            2,
+        ),
+        "session_state_kb": round(float(np.median(session_state)) / 1024, 1),
+        "rss_topp_mb": round(max(r["rss_etter_mb"] for r in resultater), 1),
+        "feilmeldinger": sorted({f for feil in maalinger["feil"] for f in feil})[:10],
+    }
+    return per_handling, sammendrag
+
+
+def _tolk_storrelse(tekst):
+    return tuple(int(x) for x in tekst.lower().split("x"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--okter", type=int, default=8, help="Antall simulerte økter.")
+    parser.add_argument("--handlinger", type=int, default=20, help="Handlinger per økt etter første visning.")
+    parser.add_argument("--prosesser", type=int, default=1, help="Prosesser (replikaer) øktene fordeles på.")
+    parser.add_argument("--tenketid", type=float, default=0.0, help="Maks sekunder pause mellom handlingene til en økt.")
+    parser.add_argument(
+        "--storrelse", default="200x60x5", help="Registeret som instrumenter×hendelser×activePositions."
+    )
+    parser.add_argument("--aar", type=int, default=1, help="Antall års historikk i databasen.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Skriv resultatene til denne filen i tillegg.")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    per_handling, sammendrag = kjor_lasttest(
+        okter=args.okter,
+        handlinger=args.handlinger,
+        prosesser=args.prosesser,
+        tenketid=args.tenketid,
+        storrelse=_tolk_storrelse(args.storrelse),
+        aar=args.aar,
+        seed=args.seed,
+    )
+    print(per_handling.to_string(index=False))
+    print(json.dumps(sammendrag, ensure_ascii=False, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fil:
+            json.dump(
+                {
+                    "tidspunkt": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "argumenter": vars(args),
+                    "per_handling": per_handling.to_dict("records"),
+                    "sammendrag": sammendrag,
+                },
+                fil,
+                ensure_ascii=False,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
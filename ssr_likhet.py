@@ -0,0 +1,82 @@
+"""
+Selskaper med lignende utvikling i shortandel.
+
+Fra det daglige panelet (ssr_panel) tas de siste månedene ut og samples
+hver femte handelsdag, så hvert selskap blir én vektor med like mange
+punkter. Vektorene sentreres og normaliseres til lengde 1 én gang per
+dataversjon og periode. Korrelasjonen mellom ett selskap og alle de andre
+er da ett matrise-vektor-produkt, og de k mest like hentes med argpartition.
+
+Dager før første observasjon regnes som 0 (under publiseringsterskelen).
+Selskaper uten bevegelse i perioden har ingen form å sammenligne og er utelatt.
+"""
+
+import numpy as np
+import pandas as pd
+
+import ssr_panel
+import ssr_ytelse
+from ssr_analyse import dataversjon
+
+STEG = 5
+MAANEDER = 12
+
+
+class Likhetsindeks:
+    """Normaliserte forløp, én rad per selskap, over de samme datoene."""
+
+    def __init__(self, selskaper, matrise, dager):
+        self.selskaper = selskaper
+        self.matrise = matrise
+        self.dager = dager
+        self._rad_for = {navn: i for i, navn in enumerate(selskaper)}
+
+    def __len__(self):
+        return len(self.selskaper)
+
+    def __contains__(self, selskap):
+        return selskap in self._rad_for
+
+    def lignende(self, selskap, k=10):
+        """De k selskapene med høyest korrelasjon med `selskap` i perioden."""
+        i = self._rad_for.get(selskap)
+        if i is None:
+            return pd.DataFrame(columns=["issuerName", "korrelasjon"])
+        korrelasjon = self.matrise @ self.matrise[i]
+        korrelasjon[i] = -np.inf
+        k = min(k, len(korrelasjon) - 1)
+        if k <= 0:
+            return pd.DataFrame(columns=["issuerName", "korrelasjon"])
+        beste = np.argpartition(-korrelasjon, k - 1)[:k]
+        beste = beste[np.argsort(-korrelasjon[beste], kind="stable")]
+        return pd.DataFrame({"issuerName": self.selskaper[beste], "korrelasjon": korrelasjon[beste]})
+
+
+def bygg_indeks(panel, maaneder=MAANEDER, steg=STEG):
+    """Indeksen over de siste `maaneder` månedene av panelet, med ett punkt per `steg` handelsdager."""
+    tom = Likhetsindeks(np.array([], dtype=object), np.zeros((0, 0), dtype=np.float32), pd.DatetimeIndex([]))
+    if not panel.form[1]:
+        return tom
+    fra = panel.kolonne(panel.dager[-1] - pd.DateOffset(months=maaneder))
+    # Samples bakover fra siste dag, så siste punkt alltid er dagens register.
+    kolonner = np.arange(panel.form[1] - 1, -1 if fra is None else fra - 1, -steg)[::-1]
+    if len(kolonner) < 3:
+        return tom
+
+    matrise = np.nan_to_num(panel.verdier[:, kolonner], nan=0.0).astype(np.float64)
+    matrise -= matrise.mean(axis=1, keepdims=True)
+    lengde = np.linalg.norm(matrise, axis=1)
+    med = lengde > 1e-9
+    matrise = (matrise[med] / lengde[med, None]).astype(np.float32)
+    return Likhetsindeks(panel.selskaper[med], matrise, panel.dager[kolonner])
+
+
+@ssr_ytelse.cache_resource(ttl=3600, max_entries=8, show_spinner=False)
+def _indeks(versjon, maaneder, _df):
+    with ssr_ytelse.spenn("likhet:bygg", maaneder=maaneder):
+        return bygg_indeks(ssr_panel.hent_panel(_df), maaneder)
+
+
+def hent_indeks(df, maaneder=MAANEDER):
+    """Likhetsindeksen for historikken og perioden, bygget én gang per dataversjon."""
+    return _indeks(dataversjon(df), maaneder, df)
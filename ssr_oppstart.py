@@ -0,0 +1,112 @@
+"""
+Starter Streamlit-appen og varmer opp de delte cachene i samme prosess.
+
+    python ssr_oppstart.py --server.address=0.0.0.0 --server.port=8501
+
+Argumentene sendes videre til `streamlit run shortsalg_app.py`. Et lite
+HTTP-endepunkt på SHORTSALG_READY_PORT svarer 200 på /ready når registeret,
+historikken og analysene ligger i cachen, og 503 før det. /live svarer 200
+så lenge prosessen kjører. Er SHORTSALG_API_PORT satt, startes også JSON-API-et
+fra ssr_server.py i samme prosess, slik at det deler cachene med appen.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+APP_PATH = str(Path(__file__).with_name("shortsalg_app.py"))
+READY_PORT = int(os.environ.get("SHORTSALG_READY_PORT", "8502"))
+
+KLAR = threading.Event()
+
+
+# Sekunder mellom nye forsøk når oppvarmingen feiler, doblet opp til maksimum.
+OPPVARMING_PAUSE = 5
+OPPVARMING_MAKS_PAUSE = 60
+
+
+def _prov_oppvarming():
+    """Ett forsøk på å fylle cachene. Returnerer True hvis det lyktes."""
+    start = time.perf_counter()
+    try:
+        import plotly.express  # noqa: F401  (tung import som ellers rammer første besøkende)
+
+        import ssr_api
+
+        live_rader, historikk_rader = ssr_api.varm_opp()
+    except Exception as exc:
+        print(f"Oppvarming feilet, /ready svarer 503 til et nytt forsøk lykkes: {exc!r}", flush=True)
+        return False
+    print(
+        json.dumps(
+            {
+                "oppvarmet_sekunder": round(time.perf_counter() - start, 2),
+                "live_rader": live_rader,
+                "historikk_rader": historikk_rader,
+            }
+        ),
+        flush=True,
+    )
+    return True
+
+
+def _varm_opp():
+    # Cachene hører til Streamlit-runtimen, så vi venter til den er startet.
+    from streamlit.runtime import Runtime
+
+    while not Runtime.exists():
+        time.sleep(0.1)
+
+    pause = OPPVARMING_PAUSE
+    while not _prov_oppvarming():
+        time.sleep(pause)
+        pause = min(pause * 2, OPPVARMING_MAKS_PAUSE)
+    KLAR.set()
+
+
+class _Helsesjekk(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/ready"):
+            status, tekst = (200, "klar") if KLAR.is_set() else (503, "varmer opp")
+        elif self.path.startswith("/live"):
+            status, tekst = 200, "ok"
+        else:
+            status, tekst = 404, "ukjent"
+        body = tekst.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    from ssr_analyse import bruk_copy_on_write
+
+    # Oppvarmingen og API-et kjører her før appen har lest inn sitt eget oppsett.
+    bruk_copy_on_write()
+    helse = ThreadingHTTPServer(("0.0.0.0", READY_PORT), _Helsesjekk)
+    threading.Thread(target=helse.serve_forever, name="ssr-helsesjekk", daemon=True).start()
+    threading.Thread(target=_varm_opp, name="ssr-oppvarming", daemon=True).start()
+    if os.environ.get("SHORTSALG_API_PORT"):
+        import ssr_server
+
+        ssr_server.start()
+
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", APP_PATH, *argv]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Tett panel med shortandel per selskap og handelsdag.
+
+Shortandelen er en trappefunksjon: den gjelder fra en observasjon til den
+neste. Panelet er en float32-matrise (selskaper × virkedager) der hver celle
+er siste aggregerte observasjon på eller før dagen, og NaN før første
+observasjon. Markedstotaler, rangeringer og øyeblikksbilder for en vilkårlig
+dag blir da summer og utsnitt av matrisen i stedet for groupby over radene.
+
+Nye rader i historikken flettes inn uten å bygge panelet på nytt: bare
+selskapene som har fått nye observasjoner, fylles ut igjen.
+"""
+
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+import ssr_ytelse
+from ssr_analyse import _agg_issuer_date, dataversjon
+
+_EPOKE = np.datetime64("1970-01-01", "D")
+
+
+def _fremoverfyll(rader, dag, verdi, form):
+    """
+    Matrise der hver celle er siste verdi på eller før kolonnen i sin rad.
+    Observasjonene må være sortert etter dato innen hver rad; ved flere på
+    samme dag vinner den siste.
+    """
+    rutenett = np.full(form, np.nan, dtype=np.float32)
+    if not len(verdi):
+        return rutenett
+    nokkel = rader.astype(np.int64) * form[1] + dag
+    siste = np.r_[nokkel[1:] != nokkel[:-1], True]
+    rutenett[rader[siste], dag[siste]] = verdi[siste]
+
+    indeks = np.where(np.isnan(rutenett), 0, np.arange(form[1], dtype=np.int32))
+    np.maximum.accumulate(indeks, axis=1, out=indeks)
+    return rutenett[np.arange(form[0])[:, None], indeks]
+
+
+class Panel:
+    """
+    Selskaper × virkedager. Observasjonene (selskapskode, dato, verdi) tas
+    vare på, slik at utvid kan fylle ut berørte rader på nytt.
+    """
+
+    def __init__(self, selskaper, obs_selskap, obs_dato, obs_verdi, verdier=None, dager=None):
+        rekkefolge = np.lexsort((obs_dato, obs_selskap))
+        self.selskaper = selskaper
+        self.obs_selskap = obs_selskap[rekkefolge]
+        self.obs_dato = obs_dato[rekkefolge]
+        self.obs_verdi = obs_verdi[rekkefolge]
+        if dager is None:
+            dager = self._virkedager(self.obs_dato)
+        self.dager = dager
+        if verdier is None:
+            verdier = _fremoverfyll(self.obs_selskap, self._dagindeks(self.obs_dato), self.obs_verdi, self.form)
+        self.verdier = verdier
+        # Satt av utvid: panelet det ble utvidet fra og selskapene som fikk nye observasjoner.
+        self.utvidet_fra = None
+        self.berorte = None
+
+    @staticmethod
+    def _virkedager(datoer):
+        if not len(datoer):
+            return pd.DatetimeIndex([])
+        # En observasjon i helgen gjelder fra neste virkedag.
+        slutt = pd.offsets.BDay().rollforward(pd.Timestamp(datoer.max()))
+        return pd.bdate_range(pd.Timestamp(datoer.min()), slutt)
+
+    @property
+    def form(self):
+        return (len(self.selskaper), len(self.dager))
+
+    def _dagindeks(self, datoer):
+        return np.searchsorted(self.dager.values.astype("datetime64[D]"), datoer, side="left").astype(np.int32)
+
+    @classmethod
+    def fra_aggregert(cls, agg):
+        """Bygger panelet fra _agg_issuer_date-formen (issuerName, date, shortPercent)."""
+        kode, selskaper = pd.factorize(agg["issuerName"].astype(str), sort=True)
+        return cls(
+            np.asarray(selskaper, dtype=object),
+            kode.astype(np.int32),
+            agg["date"].to_numpy(dtype="datetime64[D]"),
+            agg["shortPercent"].to_numpy(dtype=np.float32),
+        )
+
+    def utvid(self, agg):
+        """
+        Nytt panel med observasjonene i agg lagt til. Observasjoner på samme
+        selskap og dato som en eksisterende legges sammen, som i _agg_issuer_date.
+        Bare selskapene i agg fylles ut på nytt; resten kopieres.
+        """
+        if agg.empty:
+            return self
+        nye_navn = agg["issuerName"].astype(str).to_numpy(dtype=object)
+        selskaper = np.union1d(self.selskaper, nye_navn).astype(object)
+        gammel_kode = np.searchsorted(selskaper, self.selskaper).astype(np.int32)
+        ny_kode = np.searchsorted(selskaper, nye_navn).astype(np.int32)
+
+        obs_selskap = np.r_[gammel_kode[self.obs_selskap], ny_kode]
+        obs_dato = np.r_[self.obs_dato, agg["date"].to_numpy(dtype="datetime64[D]")]
+        obs_verdi = np.r_[self.obs_verdi, agg["shortPercent"].to_numpy(dtype=np.float32)]
+        # Selskap og dag i én int64-nøkkel, så like observasjoner kan summeres med bincount.
+        nokler, invers = np.unique(
+            (obs_selskap.astype(np.int64) << 32) | (obs_dato - _EPOKE).astype(np.int64), return_inverse=True
+        )
+        obs_verdi = np.bincount(invers, weights=obs_verdi, minlength=len(nokler)).astype(np.float32)
+        obs_selskap = (nokler >> 32).astype(np.int32)
+        obs_dato = _EPOKE + (nokler & 0xFFFFFFFF).astype("timedelta64[D]")
+
+        dager = self._virkedager(obs_dato)
+        verdier = np.full((len(selskaper), len(dager)), np.nan, dtype=np.float32)
+        if self.form[1]:
+            # Gamle rader flyttes på plass; dager etter forrige slutt arver siste kolonne.
+            forskyvning = dager.get_loc(self.dager[0])
+            slutt = forskyvning + self.form[1]
+            verdier[gammel_kode, forskyvning:slutt] = self.verdier
+            verdier[gammel_kode, slutt:] = self.verdier[:, -1:]
+
+        panel = Panel(selskaper, obs_selskap, obs_dato, obs_verdi, verdier=verdier, dager=dager)
+        berorte = np.unique(ny_kode)
+        utvalg = np.isin(panel.obs_selskap, berorte)
+        lokale = np.searchsorted(berorte, panel.obs_selskap[utvalg])
+        verdier[berorte] = _fremoverfyll(
+            lokale, panel._dagindeks(panel.obs_dato[utvalg]), panel.obs_verdi[utvalg], (len(berorte), len(dager))
+        )
+        panel.utvidet_fra = weakref.ref(self)
+        panel.berorte = berorte
+        return panel
+
+    def kolonne(self, dato):
+        """Kolonnen for siste virkedag på eller før dato, eller None."""
+        j = int(self.dager.searchsorted(pd.Timestamp(dato), side="right")) - 1
+        return j if j >= 0 else None
+
+    def utsnitt(self, dato):
+        """Shortandel per selskap slik registeret så ut på dato."""
+        j = self.kolonne(dato)
+        if j is None:
+            return pd.Series(dtype="float32", name="shortPercent")
+        verdier = pd.Series(self.verdier[:, j], index=self.selskaper, name="shortPercent")
+        return verdier.dropna()
+
+    def serie(self, selskap):
+        """Daglig shortandel for ett selskap."""
+        i = int(np.searchsorted(self.selskaper, selskap))
+        if i >= len(self.selskaper) or self.selskaper[i] != selskap:
+            return pd.Series(dtype="float32", name="shortPercent")
+        return pd.Series(self.verdier[i], index=self.dager, name="shortPercent").dropna()
+
+    def totalt(self):
+        """Samlet shortandel og antall selskaper med short per virkedag."""
+        return pd.DataFrame(
+            {
+                "date": self.dager,
+                "shortPercent": np.nansum(self.verdier, axis=0, dtype=np.float64),
+                "selskaper": (self.verdier > 0).sum(axis=0),
+            }
+        )
+
+    def rangering(self, dato, mot_dager=20):
+        """
+        Selskapene rangert etter shortandel på dato (1 = høyest), med persentil
+        og endring i plassering mot mot_dager virkedager tidligere.
+        """
+        kolonner = ["issuerName", "shortPercent", "plass", "persentil", "endring_plass"]
+        j = self.kolonne(dato)
+        if j is None:
+            return pd.DataFrame(columns=kolonner)
+        naa = self._plasser(self.verdier[:, j])
+        tidligere = self._plasser(self.verdier[:, max(j - mot_dager, 0)])
+        med = ~np.isnan(self.verdier[:, j])
+        antall = med.sum()
+        df = pd.DataFrame(
+            {
+                "issuerName": self.selskaper[med],
+                "shortPercent": self.verdier[med, j],
+                "plass": naa[med],
+                "persentil": 1 - (naa[med] - 1) / max(antall, 1),
+                "endring_plass": tidligere[med] - naa[med],
+            }
+        )
+        return df.sort_values("plass", ignore_index=True)
+
+    @staticmethod
+    def _plasser(kolonne):
+        """Plass 1..n etter synkende verdi; NaN får NaN."""
+        plass = np.full(len(kolonne), np.nan)
+        med = np.flatnonzero(~np.isnan(kolonne))
+        plass[med[np.argsort(-kolonne[med], kind="stable")]] = np.arange(1, len(med) + 1)
+        return plass
+
+
+_LOCK = threading.Lock()
+_paneler = {}
+
+
+def _fingeravtrykk(df, rader):
+    """Hash av et fast utvalg av de første `rader` radene, for å se at de er uendret."""
+    if not rader:
+        return 0
+    posisjoner = np.unique(np.linspace(0, rader - 1, 64).astype(np.int64))
+    utvalg = df.iloc[posisjoner][["issuerName", "date", "shortPercent"]].astype(str)
+    return int(pd.util.hash_pandas_object(utvalg, index=False).sum())
+
+
+def hent_panel(df, navn="historikk"):
+    """
+    Panelet for historikken, én gang per dataversjon. Har frame-en bare fått
+    nye rader bakerst siden forrige versjon (vanlig lagring), utvides forrige
+    panel med dem; ellers (f.eks. etter kompaktering) bygges det på nytt.
+    """
+    versjon = dataversjon(df)
+    with _LOCK:
+        forrige = _paneler.get(navn)
+    if forrige is not None and forrige["versjon"] == versjon:
+        return forrige["panel"]
+
+    if (
+        forrige is not None
+        and forrige["rader"] <= len(df)
+        and _fingeravtrykk(df, forrige["rader"]) == forrige["fingeravtrykk"]
+    ):
+        with ssr_ytelse.spenn("panel:utvid", rader=len(df) - forrige["rader"]):
+            panel = forrige["panel"].utvid(_agg_issuer_date(df.iloc[forrige["rader"]:]))
+    else:
+        with ssr_ytelse.spenn("panel:bygg", rader=len(df)):
+            agg = _agg_issuer_date(df)
+            panel = Panel.fra_aggregert(agg) if not agg.empty else Panel(
+                np.array([], dtype=object),
+                np.array([], dtype=np.int32),
+                np.array([], dtype="datetime64[D]"),
+                np.array([], dtype=np.float32),
+            )
+
+    with _LOCK:
+        _paneler[navn] = {
+            "versjon": versjon,
+            "rader": len(df),
+            "fingeravtrykk": _fingeravtrykk(df, len(df)),
+            "panel": panel,
+        }
+    return panel
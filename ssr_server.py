@@ -0,0 +1,279 @@
+"""
+Lett, skrivebeskyttet JSON-API over det samme datalaget som appen.
+
+    python ssr_server.py --port 8503
+
+Endepunkter:
+    /api/register                  siste aggregerte shortandel per selskap
+    /api/register/rader            alle aggregerte rader i live-registeret
+    /api/holdere?selskap=…         siste posisjon per selskap og posisjonsholder
+    /api/historikk?selskap=…       aggregert historikk for ett selskap fra SQLite
+    /api/topp?n=10&dager=30        selskapene med høyest snitt i perioden
+    /api/endringer                 største endringer fra siste observasjon
+    /api/hendelser?fra=…&til=…     åpnede, økte, reduserte og lukkede posisjoner
+
+Svarene bygges én gang per dataversjon og adresse og gjenbrukes deretter.
+ETag er avledet av versjonen, så If-None-Match gir 304 uten at noe bygges,
+og gzip er ferdig komprimert når klienten ber om det.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import pandas as pd
+
+import ssr_api
+from ssr_analyse import _agg_issuer_date, _standardiser_shortpercent, bruk_copy_on_write, dataversjon
+
+API_PORT = int(os.environ.get("SHORTSALG_API_PORT", "8503"))
+# Hvor ofte datagrunnlaget sjekkes for en ny versjon.
+DATA_SEKUNDER = 10
+MAKS_SVAR = 256
+
+_LOCK = threading.Lock()
+_data = {"hentet": 0.0}
+_svar = OrderedDict()
+
+
+class UgyldigForesporsel(ValueError):
+    pass
+
+
+def _datagrunnlag():
+    """Frames fra ssr_api, hentet på nytt høyst hvert DATA_SEKUNDER sekund."""
+    with _LOCK:
+        if time.monotonic() - _data["hentet"] < DATA_SEKUNDER:
+            return _data
+    live = ssr_api.hent_fullt_register()
+    holdere = ssr_api.hent_posisjonsholdere()
+    historikk = ssr_api.hent_database_data()
+    hendelser = ssr_api.siste_hendelsesdato()
+    with _LOCK:
+        _data.update(
+            live=live,
+            holdere=holdere,
+            historikk=historikk,
+            hendelser=f"hendelser:{hendelser}:{dataversjon(historikk)}",
+            hentet=time.monotonic(),
+        )
+        return _data
+
+
+def _tekst(params, navn, standard=None):
+    verdi = params.get(navn, standard)
+    if verdi is None:
+        raise UgyldigForesporsel(f"Parameteren '{navn}' mangler.")
+    return verdi
+
+
+def _heltall(params, navn, standard, maks):
+    try:
+        verdi = int(params.get(navn, standard))
+    except ValueError:
+        raise UgyldigForesporsel(f"Parameteren '{navn}' må være et heltall.") from None
+    if not 1 <= verdi <= maks:
+        raise UgyldigForesporsel(f"Parameteren '{navn}' må være mellom 1 og {maks}.")
+    return verdi
+
+
+def _register(data, params):
+    return dataversjon(data["live"]), lambda: ssr_api.hent_analyser(data["live"])["siste_per_selskap"]
+
+
+def _register_rader(data, params):
+    return dataversjon(data["live"]), lambda: data["live"]
+
+
+def _holdere(data, params):
+    selskap = params.get("selskap")
+
+    def bygg():
+        df = data["holdere"]
+        if selskap:
+            df = df.loc[df["issuerName"].str.casefold() == selskap.casefold()]
+        return (
+            df.sort_values("date", kind="stable")
+            .groupby(["issuerName", "positionHolder"], as_index=False)
+            .tail(1)
+            .sort_values(["issuerName", "shortPercent"], ascending=[True, False])
+        )
+
+    return dataversjon(data["holdere"]), bygg
+
+
+def _historikk(data, params):
+    selskap = _tekst(params, "selskap")
+
+    def bygg():
+        df = data["historikk"]
+        return _agg_issuer_date(df.loc[df["issuerName"].str.casefold() == selskap.casefold()])
+
+    return dataversjon(data["historikk"]), bygg
+
+
+def _topp(data, params):
+    n = _heltall(params, "n", 10, 100)
+    dager = _heltall(params, "dager", 30, 3650)
+
+    def bygg():
+        df = _standardiser_shortpercent(data["historikk"])
+        if df.empty:
+            return df
+        datoer = pd.to_datetime(df["date"], errors="coerce")
+        start = pd.Timestamp.today().normalize() - pd.Timedelta(days=dager)
+        return (
+            df.loc[datoer >= start]
+            .groupby("issuerName", as_index=False)["shortPercent"]
+            .mean()
+            .sort_values("shortPercent", ascending=False)
+            .head(n)
+        )
+
+    # Perioden regnes fra dagens dato, så datoen er en del av versjonen.
+    return f"{dataversjon(data['historikk'])}:{pd.Timestamp.today().date()}", bygg
+
+
+def _endringer(data, params):
+    return dataversjon(data["live"]), lambda: ssr_api.hent_analyser(data["live"])["endringer"]
+
+
+def _hendelser(data, params):
+    til = params.get("til") or pd.Timestamp.today().strftime("%Y-%m-%d")
+    fra = params.get("fra") or til
+    try:
+        fra, til = pd.Timestamp(fra), pd.Timestamp(til)
+    except ValueError:
+        raise UgyldigForesporsel("Datoene må være på formen ÅÅÅÅ-MM-DD.") from None
+    # Standardvinduet slutter i dag, så datoene må med i versjonen; ellers gir If-None-Match 304 for gårsdagen.
+    return f"{data['hendelser']}:{fra:%Y-%m-%d}:{til:%Y-%m-%d}", lambda: ssr_api.hent_posisjonshendelser(fra, til)
+
+
+RUTER = {
+    "/api/register": _register,
+    "/api/register/rader": _register_rader,
+    "/api/holdere": _holdere,
+    "/api/historikk": _historikk,
+    "/api/topp": _topp,
+    "/api/endringer": _endringer,
+    "/api/hendelser": _hendelser,
+}
+
+
+def _til_json(versjon, df):
+    datoer = {k: df[k].dt.strftime("%Y-%m-%d") for k in df.columns if pd.api.types.is_datetime64_any_dtype(df[k])}
+    df = df.assign(**datoer)
+    rader = df.to_json(orient="records", force_ascii=False)
+    return f'{{"versjon": {json.dumps(versjon)}, "antall": {len(df)}, "rader": {rader}}}'.encode("utf-8")
+
+
+def _hent_svar(nokkel, versjon, bygg):
+    """Ferdig bygget (body, gzip-body) for adressen og versjonen."""
+    with _LOCK:
+        svar = _svar.get(nokkel)
+        if svar is not None and svar[0] == versjon:
+            _svar.move_to_end(nokkel)
+            return svar[1], svar[2]
+
+    body = _til_json(versjon, bygg())
+    komprimert = gzip.compress(body, compresslevel=6)
+    with _LOCK:
+        _svar[nokkel] = (versjon, body, komprimert)
+        _svar.move_to_end(nokkel)
+        while len(_svar) > MAKS_SVAR:
+            _svar.popitem(last=False)
+    return body, komprimert
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "shortsalg-api/1.0"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        rute = RUTER.get(url.path.rstrip("/"))
+        if rute is None:
+            self._send_json(404, {"feil": f"Ukjent adresse {url.path}", "adresser": sorted(RUTER)})
+            return
+
+        params = dict(parse_qsl(url.query))
+        try:
+            versjon, bygg = rute(_datagrunnlag(), params)
+        except UgyldigForesporsel as exc:
+            self._send_json(400, {"feil": str(exc)})
+            return
+
+        nokkel = f"{url.path.rstrip('/')}?{urlencode(sorted(params.items()))}"
+        etag = '"' + hashlib.md5(f"{versjon}|{nokkel}".encode("utf-8")).hexdigest() + '"'
+        if etag in {e.strip() for e in self.headers.get("If-None-Match", "").split(",")}:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "public, max-age=60")
+            self.end_headers()
+            return
+
+        try:
+            body, komprimert = _hent_svar(nokkel, versjon, bygg)
+        except Exception as exc:
+            print(f"Feil ved bygging av {nokkel}: {exc}")
+            self._send_json(500, {"feil": "Klarte ikke bygge svaret."})
+            return
+
+        bruk_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "public, max-age=60")
+        self.send_header("Vary", "Accept-Encoding")
+        if bruk_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(komprimert if bruk_gzip else body)))
+        self.end_headers()
+        self.wfile.write(komprimert if bruk_gzip else body)
+
+    def _send_json(self, status, innhold):
+        body = json.dumps(innhold, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=API_PORT, host="0.0.0.0"):
+    """Starter API-et i en bakgrunnstråd, f.eks. i samme prosess som appen."""
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    threading.Thread(target=server.serve_forever, name="ssr-api", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args(argv)
+
+    bruk_copy_on_write()
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    print(f"Shortsalg-API lytter på http://{args.host}:{args.port}/api/register", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Crowding: hvor mange som shorter hvert selskap, hvor konsentrert shorten er,
+og hvilke selskaper som shortes av de samme posisjonsholderne.
+
+Gjeldende posisjoner legges i en glissen matrise med én rad per
+posisjonsholder og én kolonne per selskap (verdi = shortandel i prosent).
+Matrisen bygges én gang per dataversjon av posisjonsholder-datasettet, og
+nøkkeltallene er summer og produkter over den i stedet for groupby per visning.
+
+Med scipy installert brukes scipy.sparse for matriseproduktene. Uten scipy
+brukes de samme koordinatlistene (rad, kolonne, verdi) direkte i NumPy.
+"""
+
+import numpy as np
+import pandas as pd
+
+import ssr_ytelse
+from ssr_analyse import dataversjon
+from ssr_api import PUBLISERINGSTERSKEL, _gjeldende_posisjoner
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+class Eksponering:
+    """Posisjonsholder × selskap, lagret som koordinater og (med scipy) som CSC-matrise."""
+
+    def __init__(self, holdere, selskaper, rad, kolonne, verdi):
+        self.holdere = holdere
+        self.selskaper = selskaper
+        self.rad = rad
+        self.kolonne = kolonne
+        self.verdi = verdi
+        self.form = (len(holdere), len(selskaper))
+        self._kolonne_for = {navn: i for i, navn in enumerate(selskaper)}
+        # Antall holdere per selskap brukes av både nøkkeltallene og overlappet.
+        self.holdere_per_selskap = np.bincount(kolonne, minlength=self.form[1])
+        self._binar = None
+        if sparse is not None:
+            self._binar = sparse.csc_matrix(
+                (np.ones(len(rad), dtype=np.float32), (rad, kolonne)), shape=self.form
+            )
+
+    def __len__(self):
+        return len(self.verdi)
+
+    def per_selskap(self):
+        """
+        Antall holdere, samlet short, største enkeltposisjon, største holders
+        andel av shorten og Herfindahl-indeksen over holdernes andeler
+        (1 = én holder står for alt, 1/n = n like store).
+        """
+        n = self.form[1]
+        total = np.bincount(self.kolonne, weights=self.verdi, minlength=n)
+        kvadrat = np.bincount(self.kolonne, weights=self.verdi.astype(np.float64) ** 2, minlength=n)
+        storst = np.zeros(n)
+        np.maximum.at(storst, self.kolonne, self.verdi)
+        med_short = total > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            hhi = np.where(med_short, kvadrat / total**2, np.nan)
+            storst_andel = np.where(med_short, storst / total, np.nan)
+        return (
+            pd.DataFrame(
+                {
+                    "issuerName": self.selskaper,
+                    "holdere": self.holdere_per_selskap,
+                    "shortPercent": total,
+                    "storste_posisjon": storst,
+                    "storste_andel": storst_andel,
+                    "hhi": hhi,
+                }
+            )
+            .loc[med_short]
+            .sort_values(["holdere", "shortPercent"], ascending=False, ignore_index=True)
+        )
+
+    def per_holder(self):
+        """Antall selskaper og samlet short per posisjonsholder."""
+        m = self.form[0]
+        return pd.DataFrame(
+            {
+                "positionHolder": self.holdere,
+                "selskaper": np.bincount(self.rad, minlength=m),
+                "shortPercent": np.bincount(self.rad, weights=self.verdi, minlength=m),
+            }
+        ).sort_values(["selskaper", "shortPercent"], ascending=False, ignore_index=True)
+
+    def _felles_med(self, j):
+        """Antall felles holdere mellom selskap j og alle selskapene."""
+        if self._binar is not None:
+            return np.asarray((self._binar.T @ self._binar[:, j]).todense()).ravel()
+        holdere = self.rad[self.kolonne == j]
+        treff = np.isin(self.rad, holdere)
+        return np.bincount(self.kolonne[treff], minlength=self.form[1])
+
+    def overlapp(self, selskap, n=10):
+        """Selskapene som deler flest posisjonsholdere med `selskap`, med Jaccard-indeks."""
+        j = self._kolonne_for.get(selskap)
+        if j is None:
+            return pd.DataFrame(columns=["issuerName", "felles_holdere", "jaccard"])
+        felles = self._felles_med(j)
+        felles[j] = 0
+        jaccard = felles / np.maximum(self.holdere_per_selskap + self.holdere_per_selskap[j] - felles, 1)
+        utvalg = np.flatnonzero(felles)
+        utvalg = utvalg[np.lexsort((-jaccard[utvalg], -felles[utvalg]))][:n]
+        return pd.DataFrame(
+            {
+                "issuerName": self.selskaper[utvalg],
+                "felles_holdere": felles[utvalg],
+                "jaccard": jaccard[utvalg],
+            }
+        )
+
+    def overlappende_par(self, n=20, minst=2):
+        """Selskapspar med flest felles posisjonsholdere (minst `minst`)."""
+        if self._binar is not None:
+            felles = sparse.triu(self._binar.T @ self._binar, k=1).tocoo()
+            i, j, antall = felles.row, felles.col, felles.data
+        else:
+            # Uten scipy: produktet regnes tett, selskaper × selskaper.
+            binar = np.zeros(self.form, dtype=np.float32)
+            binar[self.rad, self.kolonne] = 1
+            i, j = np.triu_indices(self.form[1], k=1)
+            antall = (binar.T @ binar)[i, j]
+        beholdes = antall >= minst
+        i, j, antall = i[beholdes], j[beholdes], antall[beholdes].astype(np.int64)
+        jaccard = antall / (self.holdere_per_selskap[i] + self.holdere_per_selskap[j] - antall)
+        rekkefolge = np.lexsort((-jaccard, -antall))[:n]
+        return pd.DataFrame(
+            {
+                "selskap_a": self.selskaper[i[rekkefolge]],
+                "selskap_b": self.selskaper[j[rekkefolge]],
+                "felles_holdere": antall[rekkefolge],
+                "jaccard": jaccard[rekkefolge],
+            }
+        )
+
+
+def bygg_eksponering(df_holders, terskel=PUBLISERINGSTERSKEL):
+    """
+    Matrisen for siste registrerte posisjon per selskap og posisjonsholder.
+    Posisjoner under publiseringsterskelen regnes som lukket og tas ikke med.
+    """
+    if df_holders is None or df_holders.empty:
+        data = pd.DataFrame(columns=["issuerName", "positionHolder", "shortPercent"])
+    else:
+        data = _gjeldende_posisjoner(df_holders)
+        data = data.loc[data["shortPercent"] >= terskel]
+    rad, holdere = pd.factorize(data["positionHolder"].astype(str), sort=True)
+    kolonne, selskaper = pd.factorize(data["issuerName"].astype(str), sort=True)
+    return Eksponering(
+        np.asarray(holdere, dtype=object),
+        np.asarray(selskaper, dtype=object),
+        rad.astype(np.int32),
+        kolonne.astype(np.int32),
+        data["shortPercent"].to_numpy(dtype=np.float32),
+    )
+
+
+@ssr_ytelse.cache_resource(ttl=3600, max_entries=4, show_spinner=False)
+def _eksponering(versjon, _df):
+    return bygg_eksponering(_df)
+
+
+def hent_eksponering(df_holders):
+    """Eksponeringsmatrisen for posisjonsholder-datasettet, bygget én gang per dataversjon."""
+    return _eksponering(dataversjon(df_holders), df_holders)
@@ -0,0 +1,297 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import types
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Antall målinger per steg som brukes til persentiler på tvers av reruns.
+HISTORIKK_PER_STEG = 500
+LOGG_JSON = os.environ.get("SHORTSALG_PERF_LOG", "1") != "0"
+# Samlet minnebudsjett for de delte cachene. Når det overskrides, tømmes
+# cachene med lavest verdi (beregningstid × bruk per byte) først.
+CACHE_BUDSJETT_BYTE = int(float(os.environ.get("SHORTSALG_CACHE_BUDGET_MB", "512")) * 1_048_576)
+
+_LOCK = threading.Lock()
+_varigheter = defaultdict(lambda: deque(maxlen=HISTORIKK_PER_STEG))
+_cache_teller = defaultdict(lambda: {"kall": 0, "bom": 0})
+_cacher = {}
+_lokal = threading.local()
+
+
+def _gjeldende():
+    return getattr(_lokal, "rerun", None)
+
+
+def start_rerun(navn):
+    """Starter en ny måling for denne scriptkjøringen."""
+    _lokal.rerun = {
+        "rerun": navn,
+        "start": time.perf_counter(),
+        "tidspunkt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "spenn": [],
+        "cache": defaultdict(lambda: {"kall": 0, "bom": 0}),
+    }
+
+
+def avslutt_rerun():
+    """Avslutter målingen, logger den som én JSON-linje og returnerer den."""
+    rerun = _gjeldende()
+    if rerun is None:
+        return None
+    _lokal.rerun = None
+
+    total_ms = (time.perf_counter() - rerun.pop("start")) * 1000
+    rerun["total_ms"] = round(total_ms, 2)
+    rerun["cache"] = dict(rerun["cache"])
+    with _LOCK:
+        _varigheter["rerun:" + rerun["rerun"]].append(total_ms)
+
+    if LOGG_JSON:
+        print(json.dumps(rerun, ensure_ascii=False), flush=True)
+    return rerun
+
+
+@contextmanager
+def spenn(navn, **felt):
+    """
+    Måler et navngitt steg. Felt som settes på det returnerte objektet,
+    f.eks. spenn["rader"] = len(df), tas med i loggen.
+    """
+    data = dict(felt)
+    start = time.perf_counter()
+    try:
+        yield data
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        with _LOCK:
+            _varigheter[navn].append(ms)
+        rerun = _gjeldende()
+        if rerun is not None:
+            rerun["spenn"].append({"navn": navn, "ms": round(ms, 2), **data})
+
+
+def storrelse_i_byte(verdi):
+    """
+    Omtrentlig minnebruk: dyp memory_usage for DataFrames, JSON-lengden for
+    Plotly-figurer, ellers rekursiv getsizeof, også gjennom attributtene til
+    egne objekter (f.eks. NumPy-arrayene i en glissen matrise).
+    """
+    if isinstance(verdi, pd.DataFrame):
+        return int(verdi.memory_usage(index=True, deep=True).sum())
+    if isinstance(verdi, pd.Series):
+        return int(verdi.memory_usage(index=True, deep=True))
+    if isinstance(verdi, (bytes, bytearray)):
+        return len(verdi)
+    if hasattr(verdi, "to_plotly_json"):
+        return len(verdi.to_json())
+
+    total = 0
+    sett = set()
+    stabel = [verdi]
+    while stabel:
+        objekt = stabel.pop()
+        if id(objekt) in sett:
+            continue
+        sett.add(id(objekt))
+        total += sys.getsizeof(objekt)
+        if isinstance(objekt, dict):
+            stabel.extend(objekt.keys())
+            stabel.extend(objekt.values())
+        elif isinstance(objekt, (list, tuple, set, frozenset)):
+            stabel.extend(objekt)
+        elif isinstance(objekt, (pd.DataFrame, pd.Series)):
+            total += storrelse_i_byte(objekt) - sys.getsizeof(objekt)
+        elif hasattr(objekt, "__dict__") and not isinstance(objekt, (type, types.ModuleType)):
+            stabel.append(vars(objekt))
+    return total
+
+
+def _gyldige_oppforinger(cache, naa):
+    ttl = cache["ttl"]
+    if ttl is not None:
+        cache["oppforinger"] = [o for o in cache["oppforinger"] if naa - o["opprettet"] < ttl]
+    return cache["oppforinger"]
+
+
+def _registrer_oppforing(navn, verdi, beregning_ms):
+    byte = storrelse_i_byte(verdi)
+    with _LOCK:
+        cache = _cacher[navn]
+        oppforinger = _gyldige_oppforinger(cache, time.monotonic())
+        oppforinger.append({"byte": byte, "beregning_ms": beregning_ms, "opprettet": time.monotonic()})
+        if cache["max_entries"] is not None:
+            del oppforinger[:-cache["max_entries"]]
+    _hold_budsjett(unntatt=navn)
+
+
+def _verdi(navn, cache):
+    """Hvor mye cachen sparer per byte: beregningstid vektet med antall treff."""
+    oppforinger = cache["oppforinger"]
+    byte = sum(o["byte"] for o in oppforinger) or 1
+    beregning_ms = sum(o["beregning_ms"] for o in oppforinger)
+    teller = _cache_teller[navn]
+    return beregning_ms * (1 + teller["kall"] - teller["bom"]) / byte
+
+
+def _hold_budsjett(unntatt=None):
+    """Tømmer de minst verdifulle cachene til samlet størrelse er innenfor budsjettet."""
+    with _LOCK:
+        naa = time.monotonic()
+        storrelser = {
+            navn: sum(o["byte"] for o in _gyldige_oppforinger(cache, naa))
+            for navn, cache in _cacher.items()
+        }
+        total = sum(storrelser.values())
+        if total <= CACHE_BUDSJETT_BYTE:
+            return
+        kandidater = sorted(
+            (navn for navn, byte in storrelser.items() if byte and navn != unntatt),
+            key=lambda navn: _verdi(navn, _cacher[navn]),
+        )
+        ofre = []
+        for navn in kandidater:
+            if total <= CACHE_BUDSJETT_BYTE:
+                break
+            total -= storrelser[navn]
+            ofre.append(navn)
+
+    for navn in ofre:
+        print(json.dumps({"cache_utkastet": navn, "byte": storrelser[navn]}), flush=True)
+        _cacher[navn]["clear"]()
+
+
+def cache_data(**cache_kwargs):
+    """
+    Som st.cache_data, men teller kall og bom per funksjon, måler tiden
+    hvert kall tar og fører regnskap over minnet hver oppføring bruker.
+    Treff er kall minus bom.
+    """
+    return _med_regnskap(st.cache_data, cache_kwargs)
+
+
+def cache_resource(**cache_kwargs):
+    """
+    Som cache_data, men over st.cache_resource: treff gir det samme objektet
+    uten pickling. Brukes for objekter som bare leses, f.eks. Plotly-figurer.
+    """
+    return _med_regnskap(st.cache_resource, cache_kwargs)
+
+
+def _med_regnskap(st_cache, cache_kwargs):
+    def dekorator(func):
+        navn = func.__name__
+
+        @functools.wraps(func)
+        def beregn(*args, **kwargs):
+            with _LOCK:
+                _cache_teller[navn]["bom"] += 1
+            rerun = _gjeldende()
+            if rerun is not None:
+                rerun["cache"][navn]["bom"] += 1
+            start = time.perf_counter()
+            resultat = func(*args, **kwargs)
+            _registrer_oppforing(navn, resultat, (time.perf_counter() - start) * 1000)
+            return resultat
+
+        cached = st_cache(**cache_kwargs)(beregn)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _LOCK:
+                _cache_teller[navn]["kall"] += 1
+            rerun = _gjeldende()
+            if rerun is not None:
+                rerun["cache"][navn]["kall"] += 1
+            with spenn("cache:" + navn) as maling:
+                resultat = cached(*args, **kwargs)
+                if isinstance(resultat, pd.DataFrame):
+                    maling["rader"] = len(resultat)
+            return resultat
+
+        def clear():
+            cached.clear()
+            with _LOCK:
+                _cacher[navn]["oppforinger"] = []
+
+        # Funksjoner i selve app-scriptet dekoreres på nytt ved hver rerun,
+        # men deler fortsatt den samme Streamlit-cachen og dermed regnskapet.
+        ttl = cache_kwargs.get("ttl")
+        with _LOCK:
+            cache = _cacher.setdefault(navn, {"oppforinger": []})
+            cache.update(
+                clear=clear,
+                ttl=pd.Timedelta(ttl).total_seconds() if isinstance(ttl, str) else ttl,
+                max_entries=cache_kwargs.get("max_entries"),
+            )
+        wrapper.clear = clear
+        return wrapper
+
+    return dekorator
+
+
+def persentiler():
+    """Persentiler per steg for alle målinger i prosessen."""
+    with _LOCK:
+        malinger = {navn: list(verdier) for navn, verdier in _varigheter.items() if verdier}
+
+    rows = []
+    for navn, verdier in malinger.items():
+        p50, p90, p99 = np.percentile(verdier, [50, 90, 99])
+        rows.append(
+            {
+                "steg": navn,
+                "antall": len(verdier),
+                "p50_ms": round(float(p50), 2),
+                "p90_ms": round(float(p90), 2),
+                "p99_ms": round(float(p99), 2),
+                "maks_ms": round(max(verdier), 2),
+            }
+        )
+    columns = ["steg", "antall", "p50_ms", "p90_ms", "p99_ms", "maks_ms"]
+    return pd.DataFrame(rows, columns=columns).sort_values("p90_ms", ascending=False, ignore_index=True)
+
+
+def cache_statistikk():
+    """Kall, treff og bom per cachet funksjon siden prosessen startet."""
+    with _LOCK:
+        rows = [
+            {"funksjon": navn, "kall": t["kall"], "treff": t["kall"] - t["bom"], "bom": t["bom"]}
+            for navn, t in _cache_teller.items()
+        ]
+    return pd.DataFrame(rows, columns=["funksjon", "kall", "treff", "bom"])
+
+
+def gjeldende_spenn():
+    """Stegene som er målt så langt i denne scriptkjøringen."""
+    rerun = _gjeldende()
+    if rerun is None:
+        return pd.DataFrame(columns=["navn", "ms"])
+    return pd.DataFrame(rerun["spenn"])
+
+
+def cache_minne():
+    """Nåværende minnebruk per cache, sortert etter størrelse."""
+    with _LOCK:
+        naa = time.monotonic()
+        rows = []
+        for navn, cache in _cacher.items():
+            oppforinger = _gyldige_oppforinger(cache, naa)
+            rows.append(
+                {
+                    "cache": navn,
+                    "oppføringer": len(oppforinger),
+                    "MB": round(sum(o["byte"] for o in oppforinger) / 1_048_576, 3),
+                    "beregning_ms": round(sum(o["beregning_ms"] for o in oppforinger), 1),
+                    "verdi": _verdi(navn, cache) if oppforinger else 0.0,
+                }
+            )
+    columns = ["cache", "oppføringer", "MB", "beregning_ms", "verdi"]
+    return pd.DataFrame(rows, columns=columns).sort_values("MB", ascending=False, ignore_index=True)
@@ -0,0 +1,121 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+# Modulene leser miljøet når de importeres.
+os.environ.setdefault("SHORTSALG_PERF_LOG", "0")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ssr_analyse import bruk_copy_on_write  # noqa: E402
+
+# Som i appen og kommandolinjeverktøyene.
+bruk_copy_on_write()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "test.db")
+
+
+@pytest.fixture
+def ren_henting(monkeypatch):
+    """Egne kretsbrytere, kort backoff, tomme cacher og ingen sist vellykkede data fra andre tester."""
+    import ssr_api
+
+    monkeypatch.setattr(ssr_api, "_KRETSBRYTERE", {})
+    monkeypatch.setattr(ssr_api, "_BACKOFF_START", 0.01)
+    monkeypatch.setattr(ssr_api, "_siste_gode", {})
+    monkeypatch.setattr(ssr_api, "_sammenslatt", {})
+    monkeypatch.setattr(ssr_api, "_oppdateringer", {})
+    monkeypatch.setattr(ssr_api, "MIN_SEKUNDER_MELLOM_OPPDATERINGER", 0)
+    for funksjon in (ssr_api._hent_api_payload, ssr_api._hent_fullt_register, ssr_api._hent_posisjonsholdere):
+        funksjon.clear()
+
+
+def lag_rader(selskaper=("Alfa ASA", "Beta ASA"), dager=5, holder="Fond A", start="2025-01-06", hver=2):
+    """Normaliserte registerrader: én per selskap og virkedag, med shortandel som endres hver `hver` dag."""
+    rader = []
+    for i, selskap in enumerate(selskaper):
+        for j, dato in enumerate(pd.bdate_range(start, periods=dager)):
+            rader.append(
+                {
+                    "isin": f"NO000000000{i}",
+                    "issuerName": selskap,
+                    "positionHolder": holder,
+                    "date": dato.strftime("%Y-%m-%d"),
+                    "shortPercent": 1.0 + (j // hver) * 0.1,
+                    "shares": 1000.0 + (j // hver) * 100,
+                }
+            )
+    return pd.DataFrame(rader)
+
+
+class Registerstub:
+    """
+    Lokalt register som svarer etter en liste med oppførsler, én per
+    forespørsel (den siste gjentas): en payload, en HTTP-status, eller
+    ("treg", payload eller status, sekunder) for et svar som kommer sent.
+    """
+
+    def __init__(self):
+        self.svar = []
+        self.antall = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    oppforsel = stub.svar[min(stub.antall, len(stub.svar) - 1)]
+                    stub.antall += 1
+                forsinkelse = 0.0
+                if isinstance(oppforsel, tuple) and oppforsel[0] == "treg":
+                    _, oppforsel, forsinkelse = oppforsel
+                if isinstance(oppforsel, int):
+                    time.sleep(forsinkelse)
+                    self.send_response(oppforsel)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = json.dumps(oppforsel).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                # Første del sendes med en gang, resten etter forsinkelsen.
+                self.wfile.write(body[:10])
+                self.wfile.flush()
+                time.sleep(forsinkelse)
+                self.wfile.write(body[10:])
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stopp(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def registerstub():
+    stub = Registerstub()
+    yield stub
+    stub.stopp()
+
+
+def lag_payload(instrumenter=3, hendelser=5, seed=1):
+    import ssr_benchmark
+
+    return ssr_benchmark.lag_syntetisk_payload(instrumenter, hendelser, 2, seed=seed)
@@ -0,0 +1,25 @@
+import gzip
+import json
+
+import pytest
+
+import ssr_api
+from conftest import lag_rader
+
+
+@pytest.mark.parametrize("filnavn", ["historikk.jsonl", "historikk.jsonl.gz"])
+def test_jsonl_i_flere_biter_leses_linje_for_linje(tmp_path, db_path, filnavn):
+    rader = lag_rader(selskaper=("Alfa ASA", "Beta ASA", "Gamma ASA"), dager=4)
+    ssr_api.lagre_i_database(rader, db_path=db_path)
+
+    utfil = tmp_path / filnavn
+    resultat = ssr_api.eksporter(utfil, db_path=db_path, chunk_rader=5)
+
+    apne = gzip.open if filnavn.endswith(".gz") else open
+    with apne(utfil, "rt", encoding="utf-8") as fil:
+        linjer = fil.read().split("\n")
+    assert linjer[-1] == ""
+    poster = [json.loads(linje) for linje in linjer[:-1]]
+    assert resultat["rader"] == len(poster) == len(rader)
+    assert {p["issuerName"] for p in poster} == set(rader["issuerName"])
+    assert all(p["source"] == "finanstilsynet" for p in poster)
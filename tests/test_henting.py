@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import ssr_api
+import ssr_kilder
+from conftest import lag_payload
+
+
+@pytest.fixture(autouse=True)
+def _ren(ren_henting):
+    pass
+
+
+@pytest.fixture
+def kilde(registerstub):
+    return ssr_kilder.Kilde("test", "Testregisteret", registerstub.url)
+
+
+def test_503_gir_nytt_forsok(registerstub, kilde):
+    payload = lag_payload()
+    registerstub.svar = [503, payload]
+
+    assert ssr_api._last_ned_payload(max_retries=3, frist=10, kilde=kilde) == payload
+    assert registerstub.antall == 2
+
+
+def test_treg_body_stoppes_av_fristen(monkeypatch, registerstub, kilde):
+    monkeypatch.setattr(ssr_api, "HENT_FRIST_SEKUNDER", 0.5)
+    registerstub.svar = [("treg", lag_payload(), 3.0)]
+
+    start = time.monotonic()
+    with pytest.raises(ssr_api.HentingFeilet):
+        ssr_api._last_ned_payload(max_retries=3, kilde=kilde)
+    assert time.monotonic() - start < 2.0
+
+
+def test_kretsbryter_apner_og_slipper_ett_provekall(monkeypatch, registerstub, kilde):
+    monkeypatch.setenv("SHORTSALG_BREAKER_THRESHOLD", "2")
+    monkeypatch.setenv("SHORTSALG_BREAKER_COOLDOWN", "0.3")
+    registerstub.svar = [503]
+
+    for _ in range(2):
+        with pytest.raises(ssr_api.HentingFeilet):
+            ssr_api._last_ned_payload(max_retries=1, frist=5, kilde=kilde)
+    assert registerstub.antall == 2
+
+    # Åpen: kallet avvises uten å nå registeret.
+    with pytest.raises(ssr_api.HentingFeilet, match="venter"):
+        ssr_api._last_ned_payload(max_retries=1, frist=5, kilde=kilde)
+    assert registerstub.antall == 2
+
+    # Etter pausen slippes ett prøvekall gjennom; et samtidig kall avvises.
+    time.sleep(0.35)
+    registerstub.svar = [("treg", lag_payload(), 0.3)]
+    provekall = threading.Thread(target=ssr_api._last_ned_payload, kwargs={"max_retries": 1, "frist": 5, "kilde": kilde})
+    provekall.start()
+    time.sleep(0.1)
+    with pytest.raises(ssr_api.HentingFeilet, match="venter"):
+        ssr_api._last_ned_payload(max_retries=1, frist=5, kilde=kilde)
+    provekall.join()
+    assert registerstub.antall == 3
+
+    # Prøvekallet lyktes, så bryteren er lukket igjen.
+    registerstub.svar = [lag_payload()]
+    assert ssr_api._last_ned_payload(max_retries=1, frist=5, kilde=kilde)
+    assert registerstub.antall == 4
+
+
+def test_feilet_provekall_apner_bryteren_igjen(monkeypatch, registerstub, kilde):
+    monkeypatch.setenv("SHORTSALG_BREAKER_THRESHOLD", "1")
+    monkeypatch.setenv("SHORTSALG_BREAKER_COOLDOWN", "0.2")
+    registerstub.svar = [503]
+
+    with pytest.raises(ssr_api.HentingFeilet):
+        ssr_api._last_ned_payload(max_retries=1, frist=5, kilde=kilde)
+    time.sleep(0.25)
+    with pytest.raises(ssr_api.HentingFeilet):
+        ssr_api._last_ned_payload(max_retries=1, frist=5, kilde=kilde)
+    assert registerstub.antall == 2
+    with pytest.raises(ssr_api.HentingFeilet, match="venter"):
+        ssr_api._last_ned_payload(max_retries=1, frist=5, kilde=kilde)
+    assert registerstub.antall == 2
+
+
+def test_feil_gir_sist_vellykkede_register(monkeypatch, registerstub):
+    monkeypatch.setattr(ssr_kilder.FINANSTILSYNET, "url", registerstub.url)
+    registerstub.svar = [lag_payload()]
+    for_feil = ssr_api.hent_fullt_register(max_retries=1)
+    assert not for_feil.empty
+
+    # En tvungen oppdatering som feiler, beholder versjonen som vises.
+    registerstub.svar = [503]
+    assert ssr_api.tving_ny_nedlasting(max_retries=1) == "feilet"
+    etter = ssr_api.hent_fullt_register(max_retries=1)
+    assert etter.attrs["dataversjon"] == for_feil.attrs["dataversjon"]
+    pd.testing.assert_frame_equal(etter, for_feil)
+
+    # Også når cachen er tømt og nedlastingen feiler, vises sist vellykkede data.
+    ssr_api._hent_api_payload.clear()
+    ssr_api._hent_fullt_register.clear()
+    reserve = ssr_api.hent_fullt_register(max_retries=1)
+    assert reserve.attrs["dataversjon"] == for_feil.attrs["dataversjon"]
+    pd.testing.assert_frame_equal(reserve, for_feil)
+
+
+def test_ny_oppdatering_etter_feil_er_ikke_for_tidlig(monkeypatch, registerstub):
+    monkeypatch.setattr(ssr_kilder.FINANSTILSYNET, "url", registerstub.url)
+    monkeypatch.setattr(ssr_api, "MIN_SEKUNDER_MELLOM_OPPDATERINGER", 120)
+    registerstub.svar = [503, lag_payload()]
+
+    assert ssr_api.tving_ny_nedlasting(max_retries=1) == "feilet"
+    assert ssr_api.tving_ny_nedlasting(max_retries=1) == "oppdatert"
+    assert ssr_api.tving_ny_nedlasting(max_retries=1) == "for_tidlig"
@@ -0,0 +1,147 @@
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+import ssr_api
+import ssr_kilder
+from conftest import Registerstub, lag_payload
+
+ALIAS = {"issuerName": "emittent", "date": "datum", "shortPercent": "andel"}
+
+
+def _med_alias(verdi):
+    """Payloaden slik et register med andre feltnavn og innpakket liste ville sendt den."""
+    if isinstance(verdi, list):
+        return [_med_alias(v) for v in verdi]
+    if isinstance(verdi, dict):
+        return {ALIAS.get(k, k): _med_alias(v) for k, v in verdi.items()}
+    return verdi
+
+
+def _innpakket(payload):
+    return {"data": {"instruments": _med_alias(payload)}}
+
+
+def _svensk(url):
+    return ssr_kilder.Kilde(
+        "fi-se",
+        "Finansinspektionen",
+        url,
+        liste="data.instruments",
+        felt={felt: [alias] for felt, alias in ALIAS.items()},
+    )
+
+
+def test_innpakket_liste_og_feltnavn():
+    kilde = _svensk("http://example.invalid/")
+    payload = lag_payload()
+
+    assert kilde.instrumenter(_innpakket(payload)) == _med_alias(payload)
+    assert kilde.instrumenter({"data": []}) is None
+    assert kilde.instrumenter(_med_alias(payload)) is None
+
+    svensk = ssr_api._normaliser_payload(kilde.instrumenter(_innpakket(payload)), kilde)
+    norsk = ssr_api._normaliser_payload(payload)
+    assert set(svensk["source"]) == {"fi-se"}
+    pd.testing.assert_frame_equal(svensk.drop(columns="source"), norsk.drop(columns="source"))
+
+
+def test_ugyldig_kildeoppsett():
+    with pytest.raises(ValueError):
+        ssr_kilder.Kilde("Stor Bokstav", "X", "http://example.invalid/")
+    with pytest.raises(ValueError, match="Ukjente felt"):
+        ssr_kilder.Kilde("x", "X", "http://example.invalid/", felt={"kurs": ["price"]})
+    kilder = ssr_kilder.les_kilder('[{"navn": "fi-se", "url": "http://example.invalid/", "liste": "data"}]')
+    assert [(k.navn, k.tittel, k.liste) for k in kilder] == [("fi-se", "fi-se", "data")]
+
+
+def test_kilder_fra_fil(tmp_path):
+    sti = tmp_path / "kilder.json"
+    sti.write_text('[{"navn": "fi-se", "tittel": "Finansinspektionen", "url": "http://example.invalid/"}]')
+    assert [k.tittel for k in ssr_kilder.les_kilder(str(sti))] == ["Finansinspektionen"]
+
+
+@pytest.fixture
+def to_registre(monkeypatch, ren_henting, registerstub):
+    svensk_stub = Registerstub()
+    svensk = _svensk(svensk_stub.url)
+    monkeypatch.setattr(ssr_kilder.FINANSTILSYNET, "url", registerstub.url)
+    monkeypatch.setattr(ssr_kilder, "KILDER", [ssr_kilder.FINANSTILSYNET, svensk])
+    monkeypatch.setattr(ssr_kilder, "_ETTER_NAVN", {k.navn: k for k in ssr_kilder.KILDER})
+    yield registerstub, svensk_stub
+    svensk_stub.stopp()
+
+
+def _rader_per_kilde(df):
+    return df.groupby("source").size().to_dict()
+
+
+def test_to_kilder_slas_sammen(to_registre):
+    norsk_stub, svensk_stub = to_registre
+    norsk_stub.svar = [lag_payload(instrumenter=3)]
+    svensk_stub.svar = [_innpakket(lag_payload(instrumenter=2, seed=2))]
+
+    register = ssr_api.hent_fullt_register(max_retries=1)
+    forventet = {
+        "finanstilsynet": len(ssr_api._normaliser_payload(lag_payload(instrumenter=3))),
+        "fi-se": len(ssr_api._normaliser_payload(lag_payload(instrumenter=2, seed=2))),
+    }
+    assert _rader_per_kilde(register) == forventet
+    assert set(ssr_api.hent_posisjonsholdere(max_retries=1)["source"]) == {"finanstilsynet", "fi-se"}
+
+
+def test_kilde_som_feiler_beholder_sist_vellykkede_data(to_registre):
+    norsk_stub, svensk_stub = to_registre
+    norsk_stub.svar = [lag_payload(instrumenter=3)]
+    svensk_stub.svar = [_innpakket(lag_payload(instrumenter=2, seed=2))]
+    for_feil = ssr_api.hent_fullt_register(max_retries=1)
+
+    norsk_stub.svar = [503]
+    svensk_stub.svar = [_innpakket(lag_payload(instrumenter=4, seed=3))]
+    assert ssr_api.tving_ny_nedlasting(max_retries=1) == "oppdatert"
+
+    etter = ssr_api.hent_fullt_register(max_retries=1)
+    pd.testing.assert_frame_equal(
+        etter.loc[etter["source"] == "finanstilsynet"].reset_index(drop=True),
+        for_feil.loc[for_feil["source"] == "finanstilsynet"].reset_index(drop=True),
+    )
+    assert _rader_per_kilde(etter)["fi-se"] == len(ssr_api._normaliser_payload(lag_payload(instrumenter=4, seed=3)))
+
+
+def test_scriptkonteksten_tas_av_pooltradene_etterpa(monkeypatch, to_registre):
+    ctx = object()
+    sett = []
+
+    def funksjon(kildenavn):
+        sett.append(getattr(threading.current_thread(), ssr_api.SCRIPT_RUN_CONTEXT_ATTR_NAME, None))
+        return kildenavn
+
+    monkeypatch.setattr(ssr_api, "get_script_run_ctx", lambda suppress_warning=False: ctx)
+    assert ssr_api._per_kilde(funksjon) == {"finanstilsynet": "finanstilsynet", "fi-se": "fi-se"}
+    assert sett == [ctx, ctx]
+
+    pooltrader = [t for t in threading.enumerate() if t.name.startswith("ssr-kilde")]
+    assert pooltrader
+    assert all(getattr(t, ssr_api.SCRIPT_RUN_CONTEXT_ATTR_NAME, None) is None for t in pooltrader)
+
+
+def test_eldre_database_far_source_kolonnen(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE short_positions (isin TEXT, issuerName TEXT, positionHolder TEXT, "
+            "date TEXT, shortPercent REAL, shares REAL)"
+        )
+        conn.execute("CREATE TABLE updates_log (timestamp TEXT, new_rows INTEGER)")
+        conn.execute(
+            "INSERT INTO short_positions VALUES ('NO0000000001', 'Alfa ASA', 'Fond A', '2025-01-06', 1.5, 1500)"
+        )
+
+    historikk = ssr_api._les_historikk(db_path)
+    assert historikk["source"].tolist() == ["finanstilsynet"]
+
+    rad = historikk.drop(columns="source")
+    assert ssr_api.lagre_i_database(rad, db_path=db_path) == 0
+    assert ssr_api.lagre_i_database(rad.assign(source="fi-se"), db_path=db_path) == 1
+    assert sorted(ssr_api._les_historikk(db_path)["source"]) == ["fi-se", "finanstilsynet"]
@@ -0,0 +1,65 @@
+import json
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import ssr_api
+from conftest import lag_rader
+
+
+def _antall_rader(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM short_positions").fetchone()[0]
+
+
+@pytest.fixture(autouse=True)
+def radvis_lagring(monkeypatch):
+    monkeypatch.setattr(ssr_api, "LAGRINGSMODUS", "rader")
+
+
+def test_lagring_etter_kompaktering_setter_ikke_inn_perioder_pa_nytt(db_path):
+    rader = lag_rader(selskaper=("Alfa ASA", "Beta ASA", "Gamma ASA"), dager=10, hver=5)
+    assert ssr_api.lagre_i_database(rader, db_path=db_path) == 30
+
+    resultat = ssr_api.kompakter(db_path=db_path)
+    assert resultat["rader_etter"] == _antall_rader(db_path) < 30
+
+    assert ssr_api.lagre_i_database(rader, db_path=db_path) == 0
+    assert _antall_rader(db_path) == resultat["rader_etter"]
+
+
+def test_ny_observasjon_etter_kompaktering_forlenger_perioden(db_path):
+    rader = lag_rader(selskaper=("Alfa ASA",), dager=4)
+    ssr_api.lagre_i_database(rader, db_path=db_path)
+    ssr_api.kompakter(db_path=db_path)
+    perioder = _antall_rader(db_path)
+
+    neste = rader.tail(1).assign(date="2025-01-10")
+    assert ssr_api.lagre_i_database(neste, db_path=db_path) == 1
+    assert _antall_rader(db_path) == perioder
+    historikk = ssr_api._les_historikk(db_path)
+    assert historikk["date"].max() == "2025-01-10"
+
+
+def _eksportfil(sti, dager):
+    """Arkivert export-json med ett selskap og uendret shortandel alle dagene."""
+    events = [{"date": dato.strftime("%Y-%m-%d"), "shortPercent": 1.0, "shares": 1000} for dato in dager]
+    sti.write_text(json.dumps([{"isin": "NO0000000000", "issuerName": "Alfa ASA", "events": events}]))
+
+
+def test_backfill_etter_kompaktering_forlenger_periodene(tmp_path, db_path):
+    dager = pd.bdate_range("2025-01-06", periods=10)
+    forste, andre = tmp_path / "arkiv1", tmp_path / "arkiv2"
+    forste.mkdir()
+    andre.mkdir()
+    _eksportfil(forste / "2025-01-10.json", dager[:5])
+    _eksportfil(andre / "2025-01-17.json", dager)
+
+    ssr_api.backfill(forste, db_path=db_path, arbeidere=1)
+    ssr_api.kompakter(db_path=db_path)
+    assert ssr_api.backfill(andre, db_path=db_path, arbeidere=1)["nye_rader"] == 5
+
+    with sqlite3.connect(db_path) as conn:
+        perioder = conn.execute("SELECT date, valid_to FROM short_positions").fetchall()
+    assert perioder == [("2025-01-06", "2025-01-17")]
@@ -0,0 +1,90 @@
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import ssr_api
+import ssr_kilder
+import ssr_oppstart
+from conftest import lag_payload
+
+
+@pytest.fixture
+def helsesjekk(monkeypatch):
+    monkeypatch.setattr(ssr_oppstart, "KLAR", threading.Event())
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ssr_oppstart._Helsesjekk)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/ready"
+    server.shutdown()
+
+
+def _status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as svar:
+            return svar.status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+
+
+def test_ready_svarer_503_til_oppvarmingen_lykkes(monkeypatch, helsesjekk):
+    import streamlit.runtime
+
+    monkeypatch.setattr(streamlit.runtime.Runtime, "exists", staticmethod(lambda: True))
+    forsok = []
+    pauser = []
+    tilstand_under_feil = []
+
+    def varm_opp():
+        forsok.append(1)
+        if len(forsok) < 3:
+            raise RuntimeError("registeret svarer ikke")
+        return 10, 20
+
+    def sov(sekunder):
+        pauser.append(sekunder)
+        tilstand_under_feil.append(_status(helsesjekk))
+
+    monkeypatch.setattr(ssr_api, "varm_opp", varm_opp)
+    monkeypatch.setattr(ssr_oppstart.time, "sleep", sov)
+
+    ssr_oppstart._varm_opp()
+
+    assert len(forsok) == 3
+    assert pauser == [ssr_oppstart.OPPVARMING_PAUSE, ssr_oppstart.OPPVARMING_PAUSE * 2]
+    assert tilstand_under_feil == [503, 503]
+    assert _status(helsesjekk) == 200
+
+
+def test_uoppnaelig_register_holder_ready_pa_503(monkeypatch, tmp_path, helsesjekk, ren_henting, registerstub):
+    from streamlit.runtime import Runtime
+
+    # Bare ventingen på runtimen skal lures; cachene må fortsatt se at den mangler.
+    ekte = Runtime.exists
+
+    def finnes():
+        monkeypatch.setattr(Runtime, "exists", staticmethod(ekte))
+        return True
+
+    monkeypatch.setattr(Runtime, "exists", staticmethod(finnes))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ssr_kilder.FINANSTILSYNET, "url", "http://127.0.0.1:9/")
+    registerstub.svar = [lag_payload()]
+    tilstand_under_feil = []
+
+    def sov(sekunder):
+        if sekunder < ssr_oppstart.OPPVARMING_PAUSE:
+            return  # backoff mellom forsøkene i ssr_api
+        tilstand_under_feil.append(_status(helsesjekk))
+        if len(tilstand_under_feil) == 2:
+            # Registeret kommer tilbake; kretsbryteren ville ellers holdt det stengt i et minutt.
+            monkeypatch.setattr(ssr_kilder.FINANSTILSYNET, "url", registerstub.url)
+            monkeypatch.setattr(ssr_api, "_KRETSBRYTERE", {})
+
+    monkeypatch.setattr(ssr_oppstart.time, "sleep", sov)
+
+    ssr_oppstart._varm_opp()
+
+    assert tilstand_under_feil == [503, 503]
+    assert _status(helsesjekk) == 200
@@ -0,0 +1,48 @@
+import pytest
+
+import ssr_api
+import ssr_trengsel
+
+
+def lag_hendelser(*hendelser):
+    """Payload med ett instrument (Alfa ASA) og én event per (dato, {holder: andel})."""
+    return [
+        {
+            "isin": "NO0000000000",
+            "issuerName": "Alfa ASA",
+            "events": [
+                {
+                    "date": dato,
+                    "shortPercent": sum(posisjoner.values()),
+                    "activePositions": [
+                        {"positionHolder": holder, "shortPercent": andel, "shares": andel * 1000, "date": dato}
+                        for holder, andel in posisjoner.items()
+                    ],
+                }
+                for dato, posisjoner in hendelser
+            ],
+        }
+    ]
+
+
+def test_holder_som_faller_ut_av_siste_event_er_lukket(db_path):
+    forste = ssr_api._normaliser_posisjonsholdere(lag_hendelser(("2025-01-06", {"Fond A": 1.0, "Fond B": 1.0})))
+    ssr_api._registrer_posisjonshendelser(forste, db_path)
+
+    holdere = ssr_api._normaliser_posisjonsholdere(
+        lag_hendelser(("2025-01-06", {"Fond A": 1.0, "Fond B": 1.0}), ("2025-01-07", {"Fond A": 1.2}))
+    )
+    assert list(ssr_api._gjeldende_posisjoner(holdere)["positionHolder"]) == ["Fond A"]
+
+    hendelser = ssr_api._registrer_posisjonshendelser(holdere, db_path)
+    typer = dict(zip(hendelser["positionHolder"], hendelser["event_type"]))
+    assert typer == {"Fond A": "increased", "Fond B": "closed"}
+
+
+def test_eksponering_teller_bare_holdere_i_siste_event():
+    holdere = ssr_api._normaliser_posisjonsholdere(
+        lag_hendelser(("2025-01-06", {"Fond A": 1.0, "Fond B": 1.0}), ("2025-01-07", {"Fond A": 1.2}))
+    )
+    alfa = ssr_trengsel.bygg_eksponering(holdere).per_selskap().set_index("issuerName").loc["Alfa ASA"]
+    assert alfa["holdere"] == 1
+    assert alfa["shortPercent"] == pytest.approx(1.2)
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import ssr_api
+from conftest import lag_rader
+
+# Lesinger skal ikke vente på skrivetråden; én sekund er godt over normal tid.
+GRENSE_SEKUNDER = 1.0
+
+
+def test_lesinger_venter_ikke_pa_en_lagring_som_pagar(db_path):
+    ssr_api.lagre_i_database(lag_rader(dager=20), db_path=db_path)
+    for_lagring = ssr_api.hent_siste_oppdatering(db_path=db_path)[1]
+
+    startet = threading.Event()
+    slipp = threading.Event()
+    stor = lag_rader(selskaper=[f"Selskap {i:03d} ASA" for i in range(200)], dager=250, start="2026-01-05")
+
+    def stor_lagring(conn):
+        with conn:
+            ssr_api._sett_inn_rader(conn, ssr_api._klargjor_rader(stor))
+            startet.set()
+            # Transaksjonen holdes åpen til lesingene er ferdige.
+            assert slipp.wait(30)
+        return len(stor)
+
+    skriver = threading.Thread(target=ssr_api._skriv, args=(db_path, stor_lagring))
+    skriver.start()
+    try:
+        assert startet.wait(30)
+        tider = []
+        for _ in range(20):
+            start = time.perf_counter()
+            with ssr_api._leser(db_path) as conn:
+                antall = conn.execute("SELECT COUNT(*) FROM short_positions").fetchone()[0]
+            _, status_antall = ssr_api.hent_siste_oppdatering(db_path=db_path)
+            tider.append(time.perf_counter() - start)
+            # Lesingene ser databasen slik den var før lagringen.
+            assert antall == status_antall == for_lagring
+        assert skriver.is_alive()
+        assert max(tider) < GRENSE_SEKUNDER
+    finally:
+        slipp.set()
+        skriver.join()
+
+    assert ssr_api.hent_siste_oppdatering(db_path=db_path)[1] == for_lagring + len(stor)
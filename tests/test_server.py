@@ -0,0 +1,15 @@
+import pandas as pd
+
+import ssr_server
+
+
+def test_hendelser_versjon_folger_standardvinduet():
+    data = {"hendelser": "hendelser:7:db:1:10"}
+    i_dag = pd.Timestamp.today().strftime("%Y-%m-%d")
+
+    versjon, _ = ssr_server._hendelser(data, {})
+    assert versjon.endswith(f"{i_dag}:{i_dag}")
+
+    gammel, _ = ssr_server._hendelser(data, {"fra": "2025-01-01", "til": "2025-01-31"})
+    nyere, _ = ssr_server._hendelser(data, {"fra": "2025-01-01", "til": "2025-02-01"})
+    assert gammel != nyere
@@ -0,0 +1,60 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import ssr_api
+
+
+@pytest.fixture(autouse=True)
+def radvis_lagring(monkeypatch):
+    monkeypatch.setattr(ssr_api, "LAGRINGSMODUS", "rader")
+
+
+def _rad(selskap, dato, andel):
+    return {
+        "isin": f"NO{abs(hash(selskap)) % 10**10:010d}",
+        "issuerName": selskap,
+        "positionHolder": "Fond A",
+        "date": dato,
+        "shortPercent": andel,
+        "shares": andel * 1000,
+    }
+
+
+def _meldinger(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return [rad[0] for rad in conn.execute("SELECT message FROM alert_outbox ORDER BY rowid")]
+
+
+@pytest.fixture
+def historikk(db_path):
+    """Historikk lagret uten oppdater_historikk, så issuer_levels er tom."""
+    ssr_api.lagre_i_database(
+        pd.DataFrame([_rad("Alfa ASA", "2025-01-06", 3.0), _rad("Beta ASA", "2025-01-06", 1.0)]),
+        db_path=db_path,
+    )
+    ssr_api.legg_til_varselregel("over", issuerName="Alfa ASA", threshold=2.0, db_path=db_path)
+    return db_path
+
+
+def test_selskap_utenfor_forste_lagring_regnes_ikke_fra_null(historikk):
+    ssr_api.oppdater_historikk(pd.DataFrame([_rad("Beta ASA", "2025-01-07", 1.1)]), None, db_path=historikk)
+    ssr_api.oppdater_historikk(pd.DataFrame([_rad("Alfa ASA", "2025-01-08", 3.1)]), None, db_path=historikk)
+    assert _meldinger(historikk) == []
+
+
+def test_forrige_niva_hentes_fra_historikken(historikk):
+    ssr_api.oppdater_historikk(pd.DataFrame([_rad("Alfa ASA", "2025-01-07", 1.5)]), None, db_path=historikk)
+    assert _meldinger(historikk) == []
+    ssr_api.oppdater_historikk(pd.DataFrame([_rad("Alfa ASA", "2025-01-08", 2.5)]), None, db_path=historikk)
+    assert _meldinger(historikk) == ["Alfa ASA krysset 2.00 % oppover: 1.50 % → 2.50 %"]
+
+
+def test_nytt_selskap_regnes_fra_null_etter_forste_lagring(db_path):
+    ssr_api.legg_til_varselregel("over", threshold=2.0, db_path=db_path)
+    ssr_api.oppdater_historikk(pd.DataFrame([_rad("Gamma ASA", "2025-01-06", 2.5)]), None, db_path=db_path)
+    assert _meldinger(db_path) == []
+
+    ssr_api.oppdater_historikk(pd.DataFrame([_rad("Delta ASA", "2025-01-07", 2.5)]), None, db_path=db_path)
+    assert _meldinger(db_path) == ["Delta ASA krysset 2.00 % oppover: 0.00 % → 2.50 %"]